@@ -0,0 +1,263 @@
+"""
+Deterministic stand-in for the OpenAI chat completions API.
+
+The reply to a user message is `reply_tokens` words, emitted one every `token_latency` seconds
+when streaming (the whole delay is paid up front otherwise). When the request offers tools and
+`tool_calls` > 0, each turn first calls the first `tool_calls` tools with arguments derived from
+their schema, and the reply is sent once the tool results come back.
+
+With `rpm` or `tpm` set, requests are metered like the real API: a token bucket per limit,
+`x-ratelimit-*` headers on every response and a 429 with `Retry-After` past the limit.
+
+Point MCP_Agent at it with `OPENAI_BASE_URL=http://127.0.0.1:<port>/v1`.
+
+Usage:
+    uv run python -m benchmarks.fake_llm --port 8900 --token-latency 0.01 --reply-tokens 50 --rpm 600
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+class Fake_llm_settings:
+    def __init__(self, token_latency: float = 0.0, first_token_latency: float = 0.0, reply_tokens: int = 20,
+                 tool_calls: int = 0, rpm: int = None, tpm: int = None):
+        self.token_latency = token_latency
+        self.first_token_latency = first_token_latency
+        self.reply_tokens = reply_tokens
+        self.tool_calls = tool_calls
+        self.requests = 0
+        self.limits = Fake_rate_limits(rpm, tpm) if rpm or tpm else None
+
+
+class Fake_rate_limits:
+    """Token buckets of requests and tokens per minute, refilled continuously"""
+
+    def __init__(self, rpm: int = None, tpm: int = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm or 0)
+        self.tokens = float(tpm or 0)
+        self.updated = time.monotonic()
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def admit(self, tokens: int) -> float:
+        """Take a request of `tokens`, or return the seconds to wait before it would be admitted"""
+        self._refill()
+        wait = 0.0
+        if self.rpm and self.requests < 1:
+            wait = (1 - self.requests) * 60 / self.rpm
+        if self.tpm and self.tokens < min(tokens, self.tpm):
+            wait = max(wait, (min(tokens, self.tpm) - self.tokens) * 60 / self.tpm)
+        if wait:
+            self.rejected += 1
+            return wait
+        self.requests -= 1
+        self.tokens -= tokens
+        return 0.0
+
+    def headers(self) -> dict:
+        headers = {}
+        if self.rpm:
+            headers.update({'x-ratelimit-limit-requests': str(self.rpm),
+                            'x-ratelimit-remaining-requests': str(max(int(self.requests), 0)),
+                            'x-ratelimit-reset-requests': f"{max(self.rpm - self.requests, 0) * 60 / self.rpm:.3f}s"})
+        if self.tpm:
+            headers.update({'x-ratelimit-limit-tokens': str(self.tpm),
+                            'x-ratelimit-remaining-tokens': str(max(int(self.tokens), 0)),
+                            'x-ratelimit-reset-tokens': f"{max(self.tpm - self.tokens, 0) * 60 / self.tpm:.3f}s"})
+        return headers
+
+
+def _example_value(schema: dict):
+    kind = schema.get('type')
+    if 'default' in schema:
+        return schema['default']
+    if kind == 'integer':
+        return 1
+    if kind == 'number':
+        return 1.0
+    if kind == 'boolean':
+        return True
+    if kind == 'array':
+        return []
+    if kind == 'object':
+        return {}
+    return 'x'
+
+
+def _tool_arguments(tool: dict) -> str:
+    parameters = tool.get('function', {}).get('parameters', {})
+    properties = parameters.get('properties', {})
+    return json.dumps({name: _example_value(properties[name]) for name in parameters.get('required', [])})
+
+
+def _prompt_tokens(messages: list, tools: list) -> int:
+    # Tool schemas are part of the prompt, as with the real API
+    return max((len(json.dumps(messages)) + (len(json.dumps(tools)) if tools else 0)) // 4, 1)
+
+
+def build_app(settings: Fake_llm_settings) -> Starlette:
+    async def chat_completions(request: Request):
+        body = await request.json()
+        settings.requests += 1
+        messages = body.get('messages', [])
+        tools = body.get('tools') or []
+        model = body.get('model', 'fake-model')
+        created = int(time.time())
+        completion_id = f"chatcmpl-fake-{settings.requests}"
+        prompt_tokens = _prompt_tokens(messages, tools)
+
+        # Call tools once per turn: reply with text when the last assistant message was a tool call
+        assistant = [message for message in messages if message.get('role') == 'assistant']
+        in_tool_loop = bool(assistant and assistant[-1].get('tool_calls'))
+        tool_calls = []
+        if tools and settings.tool_calls and not in_tool_loop:
+            tool_calls = [
+                {
+                    'id': f"call_{settings.requests}_{index}",
+                    'type': 'function',
+                    'function': {'name': tool['function']['name'], 'arguments': _tool_arguments(tool)},
+                }
+                for index, tool in enumerate(tools[:settings.tool_calls])
+            ]
+        words = [f"token{index}" for index in range(settings.reply_tokens)]
+        completion_tokens = len(tool_calls) * 10 if tool_calls else len(words)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+        finish_reason = 'tool_calls' if tool_calls else 'stop'
+
+        headers = None
+        if settings.limits is not None:
+            # Metered on what the request may use, as the real API does with `max_tokens`
+            wait = settings.limits.admit(prompt_tokens + (body.get('max_tokens') or completion_tokens))
+            headers = settings.limits.headers()
+            if wait:
+                return JSONResponse({'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                               'code': 'rate_limit_exceeded'}}, status_code=429,
+                                    headers={**headers, 'retry-after': f"{wait:.3f}"})
+
+        if not body.get('stream'):
+            await asyncio.sleep(settings.first_token_latency + settings.token_latency * completion_tokens)
+            message = {'role': 'assistant', 'content': None if tool_calls else ' '.join(words)}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            return JSONResponse({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+                'usage': usage,
+            }, headers=headers)
+
+        def chunk(delta: dict, finish: str | None = None, with_usage: bool = False) -> str:
+            data = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}],
+            }
+            if with_usage:
+                data['usage'] = usage
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(settings.first_token_latency)
+            yield chunk({'role': 'assistant', 'content': ''})
+            if tool_calls:
+                for index, call in enumerate(tool_calls):
+                    yield chunk({'tool_calls': [{'index': index, **call}]})
+            else:
+                for index, word in enumerate(words):
+                    if settings.token_latency:
+                        await asyncio.sleep(settings.token_latency)
+                    yield chunk({'content': word if index == 0 else f" {word}"})
+            yield chunk({}, finish_reason, with_usage=True)
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(stream(), media_type='text/event-stream', headers=headers)
+
+    async def models(request: Request):
+        return JSONResponse({'object': 'list', 'data': [{'id': 'fake-model', 'object': 'model'}]})
+
+    return Starlette(routes=[
+        Route('/v1/chat/completions', chat_completions, methods=['POST']),
+        Route('/v1/models', models, methods=['GET']),
+    ])
+
+
+class Fake_llm_server:
+    """Runs the fake API in a background thread, for use from benchmarks"""
+
+    def __init__(self, settings: Fake_llm_settings = None, host: str = '127.0.0.1', port: int = 8900):
+        self.settings = settings or Fake_llm_settings()
+        self.host = host
+        self.port = port
+        self._server = uvicorn.Server(uvicorn.Config(build_app(self.settings), host=host, port=port,
+                                                     log_level='warning'))
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Deterministic OpenAI-compatible stand-in model')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--token-latency', type=float, default=0.0, help='Seconds per generated token')
+    parser.add_argument('--first-token-latency', type=float, default=0.0, help='Seconds before the first token')
+    parser.add_argument('--reply-tokens', type=int, default=20, help='Number of tokens in each reply')
+    parser.add_argument('--tool-calls', type=int, default=0, help='Tools to call on each user turn')
+    parser.add_argument('--rpm', type=int, help='Requests per minute before answering 429')
+    parser.add_argument('--tpm', type=int, help='Tokens per minute before answering 429')
+    args = parser.parse_args()
+    settings = Fake_llm_settings(args.token_latency, args.first_token_latency, args.reply_tokens, args.tool_calls,
+                                 args.rpm, args.tpm)
+    uvicorn.run(build_app(settings), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
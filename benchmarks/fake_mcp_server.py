@@ -0,0 +1,72 @@
+"""
+Local MCP server with configurable tool latency and payload size, for benchmarks.
+
+`--extra-tools` adds that many distinct tools (search_email_message, create_jira_ticket, ...)
+to stand in for a large fleet of servers.
+
+Usage:
+    uv run python -m benchmarks.fake_mcp_server --transport stdio --tool-latency 0.05 --payload-bytes 2000
+    uv run python -m benchmarks.fake_mcp_server --transport streamable-http --port 8901
+    uv run python -m benchmarks.fake_mcp_server --transport stdio --extra-tools 100
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+
+from mcp.server.fastmcp import FastMCP
+
+
+TOPICS = ('calendar event', 'email message', 'github issue', 'jira ticket', 'slack channel', 'weather forecast',
+          'stock price', 'database row', 'file', 'invoice', 'customer', 'flight', 'hotel booking', 'recipe',
+          'translation', 'map route', 'news article', 'spreadsheet cell', 'contact', 'note')
+VERBS = ('search', 'create', 'update', 'delete', 'list')
+
+
+def extra_tools(count: int) -> list[tuple[str, str]]:
+    """(name, description) of `count` distinct synthetic tools"""
+    tools = [(f"{verb}_{topic.replace(' ', '_')}", f"{verb.capitalize()} {topic}s in the user's account. "
+              f"Returns the matching {topic}s with their identifiers.")
+             for topic in TOPICS for verb in VERBS]
+    return tools[:count]
+
+
+def build_server(tool_latency: float = 0.0, payload_bytes: int = 100, port: int = 8901,
+                 extra_tool_count: int = 0) -> FastMCP:
+    server = FastMCP('bench', port=port, log_level='WARNING')
+
+    @server.tool()
+    async def lookup(query: str) -> str:
+        """Look up a query and return a document of fixed size"""
+        await asyncio.sleep(tool_latency)
+        return (query + ' ') * max(payload_bytes // (len(query) + 1), 1)
+
+    @server.tool()
+    async def add(a: int, b: int) -> int:
+        """Add two numbers"""
+        await asyncio.sleep(tool_latency)
+        return a + b
+
+    for name, description in extra_tools(extra_tool_count):
+        async def extra(query: str, limit: int = 10, name=name) -> str:
+            await asyncio.sleep(tool_latency)
+            return f"{name}: no results for {query!r}"
+
+        server.add_tool(extra, name=name, description=description)
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MCP server for benchmarks')
+    parser.add_argument('--transport', choices=['stdio', 'streamable-http', 'sse'], default='stdio')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--tool-latency', type=float, default=0.0, help='Seconds each tool call takes')
+    parser.add_argument('--payload-bytes', type=int, default=100, help='Size of the lookup tool result')
+    parser.add_argument('--extra-tools', type=int, default=0, help=f"Synthetic tools to add (up to {len(TOPICS) * len(VERBS)})")
+    args = parser.parse_args()
+    build_server(args.tool_latency, args.payload_bytes, args.port, args.extra_tools).run(transport=args.transport)
+
+
+if __name__ == '__main__':
+    main()
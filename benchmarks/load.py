@@ -0,0 +1,401 @@
+"""
+Load test of the Gradio app over HTTP, to find how many concurrent users one process handles.
+
+Virtual users drive the real app (`python -m src.gradio_app.app`) the way browsers do: each
+opens a session (with Gradio's heartbeat, so closing it runs the app's unload handler),
+initializes an agent, chats for `--turns` turns with a think time between them and disconnects,
+then starts over as a new user. Requests go through Gradio's queue protocol (`queue/join` then
+the `queue/data` event stream), so the numbers include Gradio's own queueing and streaming.
+
+The number of users follows a profile over `--duration` seconds:
+    ramp    from 1 to `--users`, to find the saturation point
+    steady  `--users` throughout
+    spike   `--users`, then `--spike-users` for the middle third, then back
+
+By default the app, the stand-in model (`benchmarks/fake_llm.py`) and a streamable-HTTP MCP
+server (`benchmarks/fake_mcp_server.py`) are started locally, each in its own process, and the
+app's CPU and RSS are sampled from /proc. `--url` targets a running deployment instead (with
+`--pid` to sample its process).
+
+Each profile reports latency percentiles per request type (time to the first streamed update
+and to the full reply for chat turns), error counts, per-window throughput, latency, CPU and
+RSS, and the saturation point: the number of users before the first window whose error rate
+exceeds `--max-error-rate` or whose p95 turn latency exceeds `--latency-factor` times that of
+the first window. Results are written as JSON, to be compared across releases.
+
+Usage:
+    uv run python -m benchmarks.load --profile ramp --users 64 --duration 120 --output load.json
+    uv run python -m benchmarks.load --profile spike --users 8 --spike-users 48 --token-latency 0.005
+    uv run python -m benchmarks.load --url http://127.0.0.1:7860 --pid 1234 --profile steady --users 10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from benchmarks.run import REPO_ROOT, Http_mcp_server, free_port, git_commit, summarize
+
+PROFILES = ('ramp', 'steady', 'spike')
+
+
+def target_users(profile: str, elapsed: float, duration: float, users: int, spike_users: int) -> int:
+    """Number of users the profile asks for `elapsed` seconds into the run"""
+    if profile == 'ramp':
+        return max(1, min(users, int(users * elapsed / duration) + 1))
+    if profile == 'spike':
+        return spike_users if duration / 3 <= elapsed < duration * 2 / 3 else users
+    return users
+
+
+class Process_sampler:
+    """CPU (percent of one core) and RSS of a process, read from /proc, None where it isn't available"""
+
+    def __init__(self, pid: int | None):
+        self.pid = pid
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._last = None
+
+    def _cpu_seconds(self) -> float | None:
+        try:
+            fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(')', 1)[1].split()
+        except (OSError, IndexError, TypeError):
+            return None
+        # utime and stime, fields 14 and 15 of stat
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def _rss_mb(self) -> float | None:
+        try:
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+        except (OSError, TypeError):
+            pass
+        return None
+
+    def sample(self) -> dict:
+        """CPU use since the previous sample and current RSS"""
+        now, cpu = time.monotonic(), self._cpu_seconds()
+        percent = None
+        if cpu is not None and self._last is not None and now > self._last[0]:
+            percent = round((cpu - self._last[1]) / (now - self._last[0]) * 100, 1)
+        self._last = (now, cpu) if cpu is not None else None
+        return {'cpu_percent': percent, 'rss_mb': self._rss_mb()}
+
+
+@dataclass
+class Request_record:
+    kind: str
+    start: float
+    end: float
+    first_update: float | None = None
+    error: str | None = None
+
+
+class Gradio_session:
+    """One browser tab: a session hash, its heartbeat and the queued calls of its events"""
+
+    def __init__(self, client: httpx.AsyncClient, dependencies: dict, timeout: float):
+        self.client = client
+        self.dependencies = dependencies
+        self.timeout = timeout
+        self.session_hash = uuid.uuid4().hex[:11]
+        self._heartbeat: asyncio.Task | None = None
+
+    async def _beat(self):
+        async with self.client.stream('GET', f"/gradio_api/heartbeat/{self.session_hash}") as response:
+            async for _ in response.aiter_lines():
+                pass
+
+    def open(self):
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def close(self):
+        """Close the tab: the app's unload handler releases the session"""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+
+    async def call(self, api_name: str, data: list) -> tuple[list | None, float | None]:
+        """Run the event of `api_name`, returns its final output and when its first update arrived"""
+        response = await self.client.post('/gradio_api/queue/join', json={
+            'data': data, 'fn_index': self.dependencies[api_name], 'session_hash': self.session_hash,
+            'event_data': None, 'trigger_id': None})
+        if response.status_code != 200:
+            raise RuntimeError(f"http {response.status_code}")
+        event_id = response.json()['event_id']
+        first_update = None
+        async with asyncio.timeout(self.timeout):
+            async with self.client.stream('GET', '/gradio_api/queue/data',
+                                          params={'session_hash': self.session_hash}) as stream:
+                async for line in stream.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    message = json.loads(line[5:])
+                    if message.get('event_id') != event_id:
+                        continue
+                    if message['msg'] == 'process_generating' and first_update is None:
+                        first_update = time.monotonic()
+                    elif message['msg'] == 'process_completed':
+                        if not message.get('success'):
+                            raise RuntimeError((message.get('output') or {}).get('error') or 'event failed')
+                        return message['output']['data'], first_update
+                    elif message['msg'] == 'unexpected_error':
+                        raise RuntimeError(message.get('message') or 'unexpected error')
+        raise RuntimeError('event stream closed before the event completed')
+
+
+class Load_test:
+    def __init__(self, args, url: str, pid: int | None, mcp_url: str | None):
+        self.args = args
+        self.url = url
+        self.sampler = Process_sampler(pid)
+        self.mcp_url = mcp_url
+
+    def init_data(self, conversation_id: str) -> list:
+        # The sidebar: key, conversation id, three url slots (url, name, type, headers), the stdio slot
+        servers = ['', '', 'http', ''] * 3
+        if self.mcp_url:
+            servers[:2] = [self.mcp_url, 'load_mcp']
+        return ['sk-load', conversation_id] + servers + ['', '', '']
+
+    async def timed(self, records: list, kind: str, session: Gradio_session, api_name: str, data: list,
+                    check) -> bool:
+        """Run one event, recording its latency and its error: a failed request or an error shown by the app"""
+        record = Request_record(kind, time.monotonic(), 0.0)
+        try:
+            output, record.first_update = await session.call(api_name, data)
+            record.error = check(output)
+        except TimeoutError:
+            record.error = 'timeout'
+        except httpx.HTTPError as e:
+            record.error = type(e).__name__
+        except RuntimeError as e:
+            record.error = str(e)[:80]
+        record.end = time.monotonic()
+        records.append(record)
+        return record.error is None
+
+    async def user(self, index: int, client, dependencies, profile: str, started: float, records: list,
+                   active: set):
+        rng = random.Random(index)
+        duration = self.args.duration
+        users = self.args.users
+
+        def wanted() -> bool:
+            elapsed = time.monotonic() - started
+            return elapsed < duration and index < target_users(profile, elapsed, duration, users, self.args.spike_users)
+
+        while time.monotonic() - started < duration:
+            if not wanted():
+                await asyncio.sleep(0.1)
+                continue
+            session = Gradio_session(client, dependencies, self.args.timeout)
+            session.open()
+            active.add(index)
+            try:
+                initialized = await self.timed(
+                    records, 'initialize', session, 'initialize_agent_wrapper', self.init_data(uuid.uuid4().hex),
+                    lambda output: None if output[2].startswith('Agent initialized') else output[2][:80])
+                for turn in range(self.args.turns if initialized else 0):
+                    await self.timed(records, 'chat', session, 'handle_chat',
+                                     [f"Question {turn + 1} of user {index}: look up the load test results"],
+                                     lambda output: output[1][:80] or None)
+                    if not wanted():
+                        break
+                    await asyncio.sleep(self.args.think_time * rng.uniform(0.5, 1.5))
+                if initialized:
+                    await self.timed(records, 'disconnect', session, 'disconnect_wrapper', [], lambda output: None)
+                else:
+                    # Refused (e.g. at capacity): come back a little later, as a person would
+                    await asyncio.sleep(self.args.think_time * rng.uniform(0.5, 1.5))
+            finally:
+                active.discard(index)
+                await session.close()
+
+    async def sample_windows(self, started: float, active: set, samples: list):
+        while True:
+            await asyncio.sleep(self.args.window)
+            samples.append({'end_s': round(time.monotonic() - started, 1), 'users': len(active),
+                            **self.sampler.sample()})
+
+    async def run(self, profile: str) -> dict:
+        users = self.args.spike_users if profile == 'spike' else self.args.users
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=self.url, timeout=httpx.Timeout(self.args.timeout, connect=10),
+                                     limits=limits) as client:
+            config = (await client.get('/config')).json()
+            dependencies = {dependency.get('api_name'): dependency['id'] for dependency in config['dependencies']}
+            records: list[Request_record] = []
+            samples: list[dict] = []
+            active: set[int] = set()
+            self.sampler.sample()
+            started = time.monotonic()
+            sampler = asyncio.create_task(self.sample_windows(started, active, samples))
+            await asyncio.gather(*(self.user(index, client, dependencies, profile, started, records, active)
+                                   for index in range(users)))
+            sampler.cancel()
+            elapsed = time.monotonic() - started
+        return self.report(records, samples, started, elapsed)
+
+    def report(self, records: list[Request_record], samples: list[dict], started: float, elapsed: float) -> dict:
+        requests = {}
+        for kind in ('initialize', 'chat', 'disconnect'):
+            done = [record for record in records if record.kind == kind]
+            if not done:
+                continue
+            errors = {}
+            for record in done:
+                if record.error:
+                    errors[record.error] = errors.get(record.error, 0) + 1
+            ok = [record for record in done if record.error is None]
+            requests[kind] = {
+                'count': len(done),
+                'error_rate': round((len(done) - len(ok)) / len(done), 4),
+                'errors': errors,
+                'latency': summarize([record.end - record.start for record in ok]),
+            }
+            if kind == 'chat':
+                requests[kind]['first_update'] = summarize([record.first_update - record.start for record in ok
+                                                            if record.first_update is not None])
+        windows = []
+        for sample in samples:
+            begin, end = sample['end_s'] - self.args.window, sample['end_s']
+            turns = [record for record in records
+                     if record.kind == 'chat' and begin <= record.end - started < end]
+            ok = [record.end - record.start for record in turns if record.error is None]
+            windows.append({**sample, 'turns_per_s': round(len(ok) / self.args.window, 2),
+                            'turn_error_rate': round((len(turns) - len(ok)) / len(turns), 4) if turns else 0.0,
+                            'turn': summarize(ok)})
+        return {'elapsed_s': round(elapsed, 1), 'requests': requests,
+                'turns_per_s': round(sum(1 for record in records if record.kind == 'chat' and record.error is None)
+                                     / elapsed, 2),
+                'peak_cpu_percent': max((window['cpu_percent'] for window in windows
+                                         if window['cpu_percent'] is not None), default=None),
+                'peak_rss_mb': max((window['rss_mb'] for window in windows if window['rss_mb'] is not None),
+                                   default=None),
+                'saturation': self.saturation(windows), 'windows': windows}
+
+    def saturation(self, windows: list[dict]) -> dict:
+        """Users before the first window past the error rate or latency thresholds"""
+        measured = [window for window in windows if window['turn']]
+        if not measured:
+            return {'users': None, 'reason': 'no completed turns'}
+        baseline = measured[0]['turn']['p95_ms']
+        previous = None
+        for window in windows:
+            if window['turn_error_rate'] > self.args.max_error_rate:
+                reason = f"turn error rate {window['turn_error_rate']:.1%}"
+            elif window['turn'] and window['turn']['p95_ms'] > baseline * self.args.latency_factor:
+                reason = f"p95 turn latency {window['turn']['p95_ms']:.0f} ms, {baseline:.0f} ms at first"
+            else:
+                previous = window
+                continue
+            return {'users': previous['users'] if previous else None, 'saturated_users': window['users'],
+                    'at_s': window['end_s'], 'reason': reason}
+        peak = max(windows, key=lambda window: window['turns_per_s'])
+        return {'users': None, 'reason': 'not reached', 'max_users': max(window['users'] for window in windows),
+                'peak_turns_per_s': peak['turns_per_s'], 'peak_users': peak['users']}
+
+
+def start_process(args: list[str], port: int, cwd: str = None, env: dict = None) -> subprocess.Popen:
+    from src.gradio_app.serve import wait_for_port
+
+    process = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port, process)
+    return process
+
+
+def stop_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run(args) -> dict:
+    profiles = PROFILES if args.profile == 'all' else (args.profile,)
+    results = {}
+    with ExitStack() as stack:
+        url, pid, mcp_url = args.url, args.pid, None
+        if url is None:
+            llm_port, app_port = free_port(), free_port()
+            llm = start_process([sys.executable, '-m', 'benchmarks.fake_llm', '--port', str(llm_port),
+                                 '--token-latency', str(args.token_latency),
+                                 '--first-token-latency', str(args.first_token_latency),
+                                 '--reply-tokens', str(args.reply_tokens), '--tool-calls', str(args.tool_calls)],
+                                llm_port, cwd=REPO_ROOT)
+            stack.callback(stop_process, llm)
+            if args.tool_calls:
+                mcp_url = stack.enter_context(Http_mcp_server(args.tool_latency, args.payload_bytes)).url
+            # The app's session store and traces go to a scratch directory
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+            env = dict(os.environ, PYTHONPATH=str(REPO_ROOT), OPENAI_BASE_URL=f"http://127.0.0.1:{llm_port}/v1")
+            app = start_process([sys.executable, '-m', 'src.gradio_app.app', '--host', '127.0.0.1',
+                                 '--port', str(app_port)], app_port, cwd=workdir, env=env)
+            stack.callback(stop_process, app)
+            url, pid = f"http://127.0.0.1:{app_port}", app.pid
+        load_test = Load_test(args, url, pid, mcp_url)
+        for profile in profiles:
+            print(f"running {profile}...", file=sys.stderr)
+            results[profile] = asyncio.run(load_test.run(profile))
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the MCP Agent Gradio app')
+    parser.add_argument('--output', default='load.json', help='JSON file the results are written to')
+    parser.add_argument('--profile', choices=PROFILES + ('all',), default='ramp')
+    parser.add_argument('--users', type=int, default=32, help='Peak users of ramp, users of steady, users before and after the spike')
+    parser.add_argument('--spike-users', type=int, help='Users during the spike (default: 4 x --users)')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of each profile')
+    parser.add_argument('--turns', type=int, default=5, help='Chat turns of each user before disconnecting')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Mean seconds between the turns of a user')
+    parser.add_argument('--window', type=float, default=5, help='Seconds of each reporting window')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds before a request counts as timed out')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Turn error rate of a saturated window')
+    parser.add_argument('--latency-factor', type=float, default=3.0,
+                        help='p95 turn latency of a saturated window, relative to the first window')
+    parser.add_argument('--url', help='Base url of a running app, instead of starting one locally')
+    parser.add_argument('--pid', type=int, help='Process of the app at --url, for CPU and RSS')
+    parser.add_argument('--token-latency', type=float, default=0.01, help='Seconds per token of the stand-in model')
+    parser.add_argument('--first-token-latency', type=float, default=0.2, help='Seconds before the first token')
+    parser.add_argument('--reply-tokens', type=int, default=50, help='Tokens per stand-in model reply')
+    parser.add_argument('--tool-calls', type=int, default=1, help='Tool calls per turn, 0 runs without an MCP server')
+    parser.add_argument('--tool-latency', type=float, default=0.05, help='Seconds per MCP tool call')
+    parser.add_argument('--payload-bytes', type=int, default=1000, help='Size of the MCP lookup tool result')
+    args = parser.parse_args()
+    args.spike_users = args.spike_users or args.users * 4
+
+    report = run(args)
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps({profile: {key: value for key, value in result.items() if key != 'windows'}
+                      for profile, result in report['results'].items()}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
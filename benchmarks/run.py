@@ -0,0 +1,422 @@
+"""
+Offline benchmark suite for MCP_Agent.
+
+Everything runs locally: a deterministic OpenAI-compatible stand-in model and stdio /
+streamable-HTTP MCP servers with configurable tool latency and payload size. Results are
+written as JSON so runs can be compared across commits.
+
+Usage:
+    uv run python -m benchmarks.run --output bench.json
+    uv run python -m benchmarks.run --only turns,concurrency --token-latency 0.005 --tool-latency 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.fake_llm import Fake_llm_server, Fake_llm_settings
+
+BENCHMARKS_DIR = Path(__file__).parent
+REPO_ROOT = BENCHMARKS_DIR.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def summarize(samples: list[float]) -> dict:
+    """Summary statistics of latency samples, in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95_ms': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+        'p99_ms': round(ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Http_mcp_server:
+    """Runs the benchmark MCP server over streamable HTTP in a subprocess"""
+
+    def __init__(self, tool_latency: float, payload_bytes: int):
+        self.port = free_port()
+        self.args = [sys.executable, str(BENCHMARKS_DIR / 'fake_mcp_server.py'), '--transport', 'streamable-http',
+                     '--port', str(self.port), '--tool-latency', str(tool_latency),
+                     '--payload-bytes', str(payload_bytes)]
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/mcp"
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError('benchmark MCP server did not start')
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+class Bench:
+    def __init__(self, args, llm: Fake_llm_server, http_url: str):
+        self.args = args
+        self.llm = llm
+        self.stdio_config = {
+            'name': 'bench_stdio',
+            'command': sys.executable,
+            'args': [str(BENCHMARKS_DIR / 'fake_mcp_server.py'), '--transport', 'stdio',
+                     '--tool-latency', str(args.tool_latency), '--payload-bytes', str(args.payload_bytes)],
+        }
+        self.http_config = {'name': 'bench_http', 'url': http_url, 'type': 'http', 'headers': None}
+
+    def agent(self, pool=None, servers: str = 'stdio', **options):
+        from src.mcp_agent.agent import MCP_Agent
+
+        return MCP_Agent(
+            api_keys={'openai_api_key': 'bench'},
+            mpc_server_urls=[self.http_config] if servers in ('http', 'both') else [],
+            mpc_stdio_commands=[self.stdio_config] if servers in ('stdio', 'both') else [],
+            instructions='You are a benchmark assistant.',
+            pool=pool,
+            **options,
+        )
+
+    async def construction(self) -> dict:
+        from src.mcp_agent.pool import MCPServerPool
+
+        pool = MCPServerPool()
+        samples = []
+        for _ in range(self.args.repeats * 10):
+            begin = time.perf_counter()
+            self.agent(pool, servers='both')
+            samples.append(time.perf_counter() - begin)
+        # The first agent pays for lazy client setup, report it apart from the steady state
+        return {'first_ms': round(samples[0] * 1000, 3), 'next': summarize(samples[1:])}
+
+    async def connect(self) -> dict:
+        from src.mcp_agent.pool import MCPServerPool
+
+        results = {}
+        for servers in ('stdio', 'http'):
+            cold, warm, entries, reconnected = [], [], [], []
+            for _ in range(self.args.repeats):
+                pool = MCPServerPool(health_check_interval=0)
+                first, second = self.agent(pool, servers), self.agent(pool, servers)
+                begin = time.perf_counter()
+                await first.connect()
+                cold.append(time.perf_counter() - begin)
+                begin = time.perf_counter()
+                await second.connect()
+                warm.append(time.perf_counter() - begin)
+                await first.disconnect()
+                await second.disconnect()
+                # Idle connections are closed and their entries removed, the agents can still connect again
+                pool.idle_timeout = 0
+                await pool.evict_idle()
+                entries.append(len(pool.entries))
+                await first.connect()
+                reconnected.append(len(first.active_servers) == 1 and len(pool.entries) == 1)
+                await first.disconnect()
+                await pool.close_all()
+            results[servers] = {'cold': summarize(cold), 'pooled': summarize(warm),
+                                'entries_after_eviction': max(entries), 'reconnected_after_eviction': all(reconnected)}
+        return results
+
+    async def turns(self) -> dict:
+        from src.mcp_agent.pool import MCPServerPool
+
+        results = {}
+        for label, tool_calls in (('no_tools', 0), ('with_tools', self.args.tool_calls)):
+            self.llm.settings.tool_calls = tool_calls
+            pool = MCPServerPool(health_check_interval=0)
+            agent = self.agent(pool, servers='stdio')
+            await agent.connect()
+            totals, first_tokens = [], []
+            for turn in range(self.args.turns):
+                begin = time.perf_counter()
+                first = None
+                async for event in agent.chat_stream(f"turn {turn}"):
+                    if first is None and event.type == 'text':
+                        first = time.perf_counter() - begin
+                totals.append(time.perf_counter() - begin)
+                first_tokens.append(first if first is not None else totals[-1])
+            await agent.disconnect()
+            await pool.close_all()
+            results[label] = {'turn': summarize(totals), 'first_token': summarize(first_tokens)}
+        self.llm.settings.tool_calls = 0
+        return results
+
+    async def concurrency(self) -> dict:
+        from src.mcp_agent.pool import MCPServerPool
+
+        results = {}
+        self.llm.settings.tool_calls = self.args.tool_calls
+        for sessions in self.args.sessions:
+            pool = MCPServerPool(health_check_interval=0)
+            agents = [self.agent(pool, servers='stdio') for _ in range(sessions)]
+            await asyncio.gather(*(agent.connect() for agent in agents))
+            latencies = []
+
+            async def converse(agent):
+                for turn in range(self.args.concurrent_turns):
+                    begin = time.perf_counter()
+                    await agent.chat(f"turn {turn}")
+                    latencies.append(time.perf_counter() - begin)
+
+            begin = time.perf_counter()
+            await asyncio.gather(*(converse(agent) for agent in agents))
+            elapsed = time.perf_counter() - begin
+            for agent in agents:
+                await agent.disconnect()
+            await pool.close_all()
+            results[str(sessions)] = {
+                'turns_per_s': round(len(latencies) / elapsed, 3),
+                'turn': summarize(latencies),
+            }
+        self.llm.settings.tool_calls = 0
+        return results
+
+    async def memory(self) -> dict:
+        from pydantic_ai.messages import ModelMessagesTypeAdapter
+        from src.mcp_agent.history import History_policy, estimate_tokens
+        from src.mcp_agent.pool import MCPServerPool
+        from src.mcp_agent.store import Memory_session_store
+
+        self.llm.settings.tool_calls = self.args.tool_calls
+        pool = MCPServerPool(health_check_interval=0)
+        # The conversation is persisted too: each turn should only append its own messages to the log
+        store = Memory_session_store()
+        agent = self.agent(pool, servers='stdio', store=store, session_id='bench-memory')
+        await agent.connect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        checkpoints = []
+        for turn in range(1, self.args.long_turns + 1):
+            await agent.chat(f"turn {turn}")
+            if turn % max(self.args.long_turns // 10, 1) == 0:
+                checkpoints.append({
+                    'turn': turn,
+                    'traced_bytes': tracemalloc.get_traced_memory()[0] - baseline,
+                    'history_messages': len(agent.memory.messages),
+                    'history_tokens': estimate_tokens(agent.memory.messages),
+                    'stored_messages': store.log_size('bench-memory'),
+                })
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        # Windowing an already windowed history (tool returns truncated) must leave it byte for byte
+        # as it was, or every turn rewrites the stored history and shifts the cached prompt prefix
+        policy = History_policy(max_tokens=agent.history_policy.max_tokens,
+                                max_tool_return_chars=max(self.args.payload_bytes // 2, 1))
+        once = policy.apply_window(agent.memory.messages)
+        history_stable = (ModelMessagesTypeAdapter.dump_json(once)
+                          == ModelMessagesTypeAdapter.dump_json(policy.apply_window(once)))
+        await agent.disconnect()
+        await pool.close_all()
+        self.llm.settings.tool_calls = 0
+        first, last = checkpoints[0], checkpoints[-1]
+        return {
+            'checkpoints': checkpoints,
+            'peak_bytes': peak,
+            'history_stable': history_stable,
+            'stored_messages_per_turn': round((last['stored_messages'] - first['stored_messages'])
+                                              / max(last['turn'] - first['turn'], 1), 2),
+            'bytes_per_turn': round((last['traced_bytes'] - first['traced_bytes']) / max(last['turn'] - first['turn'], 1), 1),
+        }
+
+    async def tool_selection(self) -> dict:
+        from src.mcp_agent.agent import MCP_Agent
+        from src.mcp_agent.pool import MCPServerPool
+        from src.mcp_agent.tool_selection import Tool_selector
+
+        fleet = dict(self.stdio_config, args=self.stdio_config['args'] + ['--extra-tools', str(self.args.fleet_tools)])
+        queries = ['find the email messages from Alice about the launch', 'create a jira ticket for the login bug',
+                   'what is the weather forecast for Paris', 'list my calendar events for tomorrow',
+                   'update the invoice of ACME with the new address']
+        results = {}
+        self.llm.settings.tool_calls = 1
+        for label, selector in (('all_tools', None), ('selected', Tool_selector(top_k=self.args.top_k))):
+            pool = MCPServerPool(health_check_interval=0)
+            agent = MCP_Agent(api_keys={'openai_api_key': 'bench'}, mpc_stdio_commands=[fleet],
+                              instructions='You are a benchmark assistant.', pool=pool, tool_selector=selector)
+            await agent.connect()
+            latencies, prompt_tokens = [], []
+            for turn in range(self.args.turns):
+                begin = time.perf_counter()
+                await agent.chat(queries[turn % len(queries)])
+                latencies.append(time.perf_counter() - begin)
+                prompt_tokens.append(agent.last_usage.request_tokens)
+            await agent.disconnect()
+            await pool.close_all()
+            results[label] = {'turn': summarize(latencies),
+                              'prompt_tokens_per_turn': round(statistics.fmean(prompt_tokens), 1)}
+            if selector is not None:
+                results[label]['selector'] = selector.stats()
+        self.llm.settings.tool_calls = 0
+        return results
+
+    async def rate_limits(self) -> dict:
+        from benchmarks.fake_llm import Fake_rate_limits
+        from src.mcp_agent.agent import MCP_Agent
+        from src.mcp_agent.models import Model_router
+        from src.mcp_agent.rate_limits import Rate_limiter
+
+        sessions = max(self.args.sessions)
+        results = {}
+        for label, limiter in (('unscheduled', None), ('scheduled', Rate_limiter())):
+            limits = self.llm.settings.limits = Fake_rate_limits(rpm=self.args.rpm)
+            # Start from a drained budget, as with a provider already under load
+            limits.requests = 0
+            router = Model_router([{'name': 'fake', 'model': 'fake-model'}], rate_limiter=limiter)
+            agents = [MCP_Agent(api_keys={'openai_api_key': 'bench'}, instructions='You are a benchmark assistant.',
+                                model_router=router) for _ in range(sessions)]
+            latencies, finished = [], []
+            failures = 0
+
+            async def converse(agent):
+                nonlocal failures
+                for turn in range(self.args.concurrent_turns):
+                    begin = time.perf_counter()
+                    try:
+                        await agent.chat(f"turn {turn}")
+                    except Exception:
+                        failures += 1
+                        continue
+                    latencies.append(time.perf_counter() - begin)
+                finished.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(converse(agent) for agent in agents))
+            elapsed = time.perf_counter() - start
+            results[label] = {
+                'turns': len(latencies),
+                'failed_turns': failures,
+                'rate_limited': limits.rejected,
+                'requests_per_min': round(len(latencies) / elapsed * 60, 1),
+                'limit_rpm': self.args.rpm,
+                'turn': summarize(latencies) if latencies else None,
+                # How evenly the sessions were served: all finish together when the queue is fair
+                'session_finish_spread_s': round(max(finished) - min(finished), 3),
+            }
+            if limiter is not None:
+                results[label]['limiter'] = {key: value for key, value in limiter.stats().items() if key != 'budgets'}
+        self.llm.settings.limits = None
+        results['cancelled_probe_wait_s'] = await self.cancelled_probe_wait()
+        return results
+
+    async def cancelled_probe_wait(self) -> float:
+        """Seconds a request waits after the first request to an endpoint was cancelled in flight"""
+        from src.mcp_agent.agent import MCP_Agent
+        from src.mcp_agent.models import Model_router
+        from src.mcp_agent.rate_limits import Rate_limiter
+
+        router = Model_router([{'name': 'fake', 'model': 'fake-model'}], rate_limiter=Rate_limiter())
+        agent = MCP_Agent(api_keys={'openai_api_key': 'bench'}, instructions='You are a benchmark assistant.',
+                          model_router=router)
+        # The first request probes the unknown limits; cancelling it must release the probe
+        first_token_latency, self.llm.settings.first_token_latency = self.llm.settings.first_token_latency, 5.0
+        probe = asyncio.create_task(agent.chat('probe'))
+        await asyncio.sleep(0.5)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        self.llm.settings.first_token_latency = first_token_latency
+        start = time.perf_counter()
+        await agent.chat('after the probe')
+        return round(time.perf_counter() - start, 3)
+
+    async def startup(self) -> dict:
+        from benchmarks.startup import measure
+
+        # Fresh interpreters, so imports and first-use setup are paid as in a new container
+        return await asyncio.to_thread(measure, self.args.repeats)
+
+
+BENCHMARKS = ('construction', 'connect', 'turns', 'concurrency', 'memory', 'tool_selection', 'rate_limits', 'startup')
+
+
+async def run(args) -> dict:
+    llm = Fake_llm_server(Fake_llm_settings(args.token_latency, args.first_token_latency, args.reply_tokens),
+                          port=free_port()).start()
+    os.environ['OPENAI_BASE_URL'] = llm.base_url
+    selected = args.only.split(',') if args.only else BENCHMARKS
+    results = {}
+    try:
+        with Http_mcp_server(args.tool_latency, args.payload_bytes) as http_server:
+            bench = Bench(args, llm, http_server.url)
+            for name in selected:
+                print(f"running {name}...", file=sys.stderr)
+                results[name] = await getattr(bench, name)()
+    finally:
+        llm.stop()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline MCP_Agent benchmarks')
+    parser.add_argument('--output', default='bench.json', help='JSON file the results are written to')
+    parser.add_argument('--only', help=f"Comma separated subset of {', '.join(BENCHMARKS)}")
+    parser.add_argument('--repeats', type=int, default=5, help='Repetitions of the construction/connect benchmarks')
+    parser.add_argument('--turns', type=int, default=20, help='Turns of the per-turn latency benchmark')
+    parser.add_argument('--sessions', type=lambda value: [int(n) for n in value.split(',')], default=[1, 8, 32],
+                        help='Comma separated concurrent session counts')
+    parser.add_argument('--concurrent-turns', type=int, default=5, help='Turns per session in the concurrency benchmark')
+    parser.add_argument('--long-turns', type=int, default=200, help='Turns of the memory growth benchmark')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='Seconds per token of the stand-in model')
+    parser.add_argument('--first-token-latency', type=float, default=0.0, help='Seconds before the first token')
+    parser.add_argument('--reply-tokens', type=int, default=20, help='Tokens per stand-in model reply')
+    parser.add_argument('--tool-calls', type=int, default=2, help='Tool calls per turn in tool benchmarks')
+    parser.add_argument('--tool-latency', type=float, default=0.0, help='Seconds per MCP tool call')
+    parser.add_argument('--payload-bytes', type=int, default=1000, help='Size of the MCP lookup tool result')
+    parser.add_argument('--fleet-tools', type=int, default=100, help='MCP tools offered in the tool selection benchmark')
+    parser.add_argument('--top-k', type=int, default=8, help='Tools selected per turn in the tool selection benchmark')
+    parser.add_argument('--rpm', type=int, default=1200, help='Requests per minute of the stand-in model in the rate limit benchmark')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report['results'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
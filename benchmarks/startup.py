@@ -0,0 +1,125 @@
+"""
+Cold start benchmark: every sample runs in a fresh interpreter, as a new container would.
+
+Measures the import time of the agent and of the Gradio app (and of pydantic-ai and Gradio on
+their own, which both import eagerly), the construction time of the first
+agent with and without a warmed `Agent_template`, and the time from launching the app until it
+answers HTTP requests.
+
+Usage:
+    uv run python -m benchmarks.startup --repeats 5 --output startup.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from benchmarks.run import REPO_ROOT, free_port
+
+# Runs in the child interpreter, prints its timings as JSON
+AGENT_PROBE = """
+import json, time
+start = time.perf_counter()
+from src.mcp_agent.agent import Agent_template, MCP_Agent
+imported = time.perf_counter()
+MCP_Agent(api_keys={'openai_api_key': 'sk-bench'})
+first = time.perf_counter()
+MCP_Agent(api_keys={'openai_api_key': 'sk-bench'})
+second = time.perf_counter()
+template = Agent_template(instructions='Be brief.')
+template.warm('sk-bench')
+warmed = time.perf_counter()
+MCP_Agent(api_keys={'openai_api_key': 'sk-bench'}, template=template)
+templated = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'first_agent_ms': (first - imported) * 1000,
+                  'next_agent_ms': (second - first) * 1000, 'warm_ms': (warmed - second) * 1000,
+                  'template_agent_ms': (templated - warmed) * 1000}))
+"""
+
+APP_PROBE = """
+import json, time
+start = time.perf_counter()
+import src.gradio_app.app
+print(json.dumps({'import_s': time.perf_counter() - start}))
+"""
+
+# Imports the agent and the app can't defer, timed alone
+DEPENDENCY_PROBE = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'import_s': time.perf_counter() - start}}))
+"""
+
+
+def summarize(samples: list[float]) -> dict:
+    return {'min': round(min(samples), 4), 'median': round(statistics.median(samples), 4),
+            'max': round(max(samples), 4)}
+
+
+def probe(code: str) -> dict:
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, capture_output=True, text=True,
+                            check=True, env=dict(os.environ, PYTHONPATH=str(REPO_ROOT))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def time_to_ready(timeout: float = 120) -> float:
+    """Seconds from launching the app until its page is served"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'src.gradio_app.app', '--host', '127.0.0.1', '--port', str(port)],
+                               cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"The app exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"The app did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def measure(repeats: int = 5, app: bool = True) -> dict:
+    agent = [probe(AGENT_PROBE) for _ in range(repeats)]
+    results = {'agent': {key: summarize([sample[key] for sample in agent]) for key in agent[0]}}
+    results['pydantic_ai_import_s'] = summarize([probe(DEPENDENCY_PROBE.format(module='pydantic_ai'))['import_s']
+                                                 for _ in range(repeats)])
+    if app:
+        results['gradio_import_s'] = summarize([probe(DEPENDENCY_PROBE.format(module='gradio'))['import_s']
+                                                for _ in range(repeats)])
+        results['app_import_s'] = summarize([probe(APP_PROBE)['import_s'] for _ in range(repeats)])
+        results['app_ready_s'] = summarize([time_to_ready() for _ in range(repeats)])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark of MCP_Agent and the Gradio app')
+    parser.add_argument('--repeats', type=int, default=5, help='Fresh interpreters per measurement')
+    parser.add_argument('--no-app', action='store_true', help='Only measure the agent, not the Gradio app')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    args = parser.parse_args()
+
+    results = measure(args.repeats, app=not args.no_app)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Headless HTTP API: the sessions of the Gradio UI, without the UI.
+
+A lean Starlette app served by uvicorn, for programs talking to `MCP_Agent` at high request
+rates. It shares the process-wide state of `runtime.py` (config, models, MCP connection pool,
+caches, session store, admission limit) and keeps its sessions in a `SessionManager` of its own.
+
+Every /v1 request carries `Authorization: Bearer <token>`, one of the tokens of `api.tokens` or
+`$MCP_AGENT_API_TOKENS` (comma-separated). The token identifies the client: its sessions and
+stored conversations are its own, other clients get a 404 for them.
+
+Endpoints:
+    GET    /healthz                      the process is up
+    GET    /readyz                       ready for turns: warmed up and not draining (503 otherwise)
+    POST   /v1/sessions                  {"openai_api_key"?, "conversation_id"?, "servers"?} -> 201 {"session_id", ...}
+    POST   /v1/sessions/{id}/messages    {"message", "stream"?} -> {"output", "usage"}, or server-sent events
+    POST   /v1/sessions/{id}/reset       forget the conversation
+    DELETE /v1/sessions/{id}             close the session and release its agent
+    GET    /metrics                      Prometheus metrics, when `tracing.metrics_port` is set
+
+Streamed turns send `text`, `tool_call` and `tool_result` events as they happen, then `done`
+(with the usage) or `error`, and a `: ping` comment every `sse_ping_interval` seconds of silence.
+
+Usage:
+    uv run python -m src.gradio_app.api --port 8000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import threading
+import uuid
+from contextlib import aclosing
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from src.mcp_agent.pool import default_pool
+from src.mcp_agent.servers import normalize_server, split_servers
+from src.mcp_agent.tracing import default_tracer
+from src.gradio_app.runtime import (admission, agent_template, build_agent, config, metrics_sink, server_watcher,
+                                    session_manager_for, session_settings)
+from src.gradio_app.sessions import ServerBusyError, SessionLimitError, TurnQueueFullError
+
+api_settings = config.get('api', {})
+max_body_bytes = api_settings.get('max_body_bytes', 1048576)
+max_message_chars = api_settings.get('max_message_chars', 100000)
+sse_ping_interval = api_settings.get('sse_ping_interval', 15)
+# Bearer tokens of the clients allowed to use the API, none means every /v1 request is refused
+api_tokens = [token.strip().encode() for token in
+              [*api_settings.get('tokens', []), *os.environ.get('MCP_AGENT_API_TOKENS', '').split(',')] if token.strip()]
+
+
+class ApiError(Exception):
+    """Answered as `{"error": message}` with `status` (and `headers`)"""
+
+    def __init__(self, status: int, message: str, headers: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class ApiSession:
+    """The agent of one API session, the counterpart of `GradioMCPApp` without the chat log"""
+
+    def __init__(self):
+        self.agent = None
+        self.servers = []
+        # Digest of the token of the client that created the session, see `caller_of`
+        self.owner = None
+
+    async def start(self, openai_api_key: str, conversation_id: str, servers: list[dict]) -> dict:
+        """Connect the session's agent, resuming the stored conversation, returns the unreachable servers"""
+        self.servers = servers
+        self.agent = build_agent(openai_api_key, conversation_id, servers)
+        await self.agent.connect()
+        await self.agent.resume()
+        return self.agent.server_errors
+
+    async def apply_servers(self) -> dict | None:
+        """Bring the agent's MCP servers in line with config.json and those given at creation"""
+        if self.agent:
+            return await self.agent.update_servers(*split_servers(server_watcher.servers + self.servers))
+        return None
+
+    def offload(self) -> bool:
+        """Drop the agent's conversation memory from RAM while idle, it lives on in the session store"""
+        if self.agent and self.agent.history_store is not None:
+            self.agent.offload()
+            return True
+        return False
+
+    async def cleanup(self):
+        if self.agent:
+            agent, self.agent = self.agent, None
+            await agent.disconnect()
+
+
+# One ApiSession per session id handed out by POST /v1/sessions
+session_manager = session_manager_for(ApiSession)
+# Set once the model and MCP SDKs are imported, see `main`
+warmed = threading.Event()
+
+
+def error_response(error: ApiError) -> JSONResponse:
+    return JSONResponse({'error': str(error)}, status_code=error.status, headers=error.headers)
+
+
+def busy_error(error: ServerBusyError) -> ApiError:
+    """429 for a session with too many turns queued, 503 with Retry-After for a busy or draining process"""
+    if isinstance(error, TurnQueueFullError):
+        return ApiError(429, str(error))
+    return ApiError(503, str(error), headers={'Retry-After': '1'})
+
+
+async def read_json(request: Request) -> dict:
+    """The JSON object in the body of `request`, refused with 413 past `max_body_bytes` without reading it all"""
+    length = request.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > max_body_bytes:
+        raise ApiError(413, f"Request body is larger than {max_body_bytes} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_body_bytes:
+            raise ApiError(413, f"Request body is larger than {max_body_bytes} bytes")
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ApiError(400, "Request body is not valid JSON")
+    if not isinstance(data, dict):
+        raise ApiError(400, "Request body must be a JSON object")
+    return data
+
+
+def caller_of(request: Request) -> str:
+    """Identity of the client: a digest of its bearer token, refused with 401 without a known one"""
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    token = token.strip().encode()
+    if scheme.lower() != 'bearer' or not any(hmac.compare_digest(token, known) for known in api_tokens):
+        raise ApiError(401, "A valid API token is required: 'Authorization: Bearer <token>'",
+                       headers={'WWW-Authenticate': 'Bearer'})
+    return hashlib.sha256(token).hexdigest()[:16]
+
+
+def session_of(request: Request):
+    caller = caller_of(request)
+    session = session_manager.sessions.get(request.path_params['session_id'])
+    # Another client's session is answered like a missing one
+    if session is None or session.app.owner != caller:
+        raise ApiError(404, f"No session {request.path_params['session_id']!r}, it was closed or has expired")
+    session.touch()
+    return session
+
+
+def usage_of(agent) -> dict | None:
+    usage = agent.last_usage
+    if usage is None:
+        return None
+    return {'input_tokens': usage.request_tokens, 'output_tokens': usage.response_tokens, 'requests': usage.requests}
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def healthz(request: Request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def readyz(request: Request):
+    if admission.draining:
+        return JSONResponse({'status': 'draining'}, status_code=503)
+    if not warmed.is_set():
+        return JSONResponse({'status': 'starting'}, status_code=503)
+    return JSONResponse({'status': 'ready', 'sessions': len(session_manager.sessions),
+                         'inflight_turns': admission.inflight})
+
+
+async def create_session(request: Request):
+    try:
+        caller = caller_of(request)
+        body = await read_json(request)
+        conversation_id = body.get('conversation_id') or uuid.uuid4().hex
+        if not isinstance(conversation_id, str):
+            raise ApiError(400, "'conversation_id' must be a string")
+        openai_api_key = body.get('openai_api_key')
+        if not openai_api_key and api_settings.get('allow_server_key', False):
+            # Opt-in: clients would otherwise spend this server's key without holding one
+            openai_api_key = os.environ.get('OPENAI_API_KEY')
+        servers = []
+        for server in body.get('servers') or []:
+            if not isinstance(server, dict):
+                raise ApiError(400, "Each server must be a JSON object")
+            if server.get('command') and not api_settings.get('allow_stdio_servers', False):
+                # Clients would otherwise run arbitrary commands on this host
+                raise ApiError(403, "stdio MCP servers are not allowed over the API, declare them in config.json")
+            try:
+                servers.append(normalize_server(server))
+            except ValueError as e:
+                raise ApiError(400, str(e))
+        if admission.draining:
+            raise ApiError(503, "The server is restarting, please try again in a moment.", headers={'Retry-After': '5'})
+
+        session_id = uuid.uuid4().hex
+        session = await session_manager.get(session_id)
+        session.app.owner = caller
+        try:
+            async with session.lock:
+                # Stored under the caller's namespace, so a client can only resume its own conversations
+                unavailable = await session.app.start(openai_api_key, f"{caller}/{conversation_id}", servers)
+        except Exception:
+            await session_manager.close(session_id)
+            raise
+    except ApiError as e:
+        return error_response(e)
+    except SessionLimitError as e:
+        return error_response(ApiError(503, str(e), headers={'Retry-After': '5'}))
+    except Exception as e:
+        print(f"Error creating API session: {e}")
+        return error_response(ApiError(500, f"Error initializing agent: {e}"))
+    return JSONResponse({'session_id': session_id, 'conversation_id': conversation_id,
+                         'servers': len(session.app.agent.mpc_servers), 'unavailable_servers': unavailable},
+                        status_code=201)
+
+
+async def send_message(request: Request):
+    try:
+        session = session_of(request)
+        body = await read_json(request)
+        message = body.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise ApiError(400, "'message' must be a non-empty string")
+        if len(message) > max_message_chars:
+            raise ApiError(413, f"Message is longer than {max_message_chars} characters")
+        # Refuse a turn that can't run with a status code, before a stream's headers go out
+        if session.lock.locked() and session.waiting >= session_manager.max_queued_turns:
+            raise ApiError(429, "The previous messages of this session are still being answered.")
+        if admission.draining or (admission.max_inflight and admission.inflight >= admission.max_inflight):
+            raise busy_error(ServerBusyError("The server is busy, please try again in a moment."))
+    except ApiError as e:
+        return error_response(e)
+
+    if body.get('stream'):
+        return StreamingResponse(stream_turn(session, message.strip()), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    try:
+        async with session_manager.turn(session):
+            with admission:
+                output = await session.app.agent.chat(message.strip())
+    except ServerBusyError as e:
+        return error_response(busy_error(e))
+    except Exception as e:
+        print(f"Error during API turn: {e}")
+        return error_response(ApiError(502, f"Error during chat: {e}"))
+    return JSONResponse({'output': str(output), 'usage': usage_of(session.app.agent)})
+
+
+async def stream_turn(session, message: str):
+    """Server-sent events of one turn, with a ping comment whenever the agent is silent for a while"""
+    events: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def run():
+        # The turn runs in a task of its own, so closing the session cancels it like a UI turn
+        try:
+            async with session_manager.turn(session):
+                with admission:
+                    async with aclosing(session.app.agent.chat_stream(message)) as stream:
+                        async for event in stream:
+                            events.put_nowait(sse(event.type, {'content': event.content, 'tool_name': event.tool_name}))
+            events.put_nowait(sse('done', {'usage': usage_of(session.app.agent)}))
+        except ServerBusyError as e:
+            events.put_nowait(sse('error', {'error': str(e), 'status': busy_error(e).status}))
+        except asyncio.CancelledError:
+            events.put_nowait(sse('error', {'error': "The turn was cancelled", 'status': 409}))
+            raise
+        except Exception as e:
+            print(f"Error during API turn: {e}")
+            events.put_nowait(sse('error', {'error': f"Error during chat: {e}", 'status': 502}))
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), sse_ping_interval)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if item is None:
+                break
+            yield item
+    finally:
+        # The client went away mid-turn: abort the model request and tool calls
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def reset_session(request: Request):
+    try:
+        session = session_of(request)
+    except ApiError as e:
+        return error_response(e)
+    await session_manager.cancel_turns(session)
+    async with session.lock:
+        if session.app.agent:
+            session.app.agent.reset()
+    return JSONResponse({'status': 'reset'})
+
+
+async def close_session(request: Request):
+    try:
+        session_of(request)
+    except ApiError as e:
+        return error_response(e)
+    await session_manager.close(request.path_params['session_id'])
+    return Response(status_code=204)
+
+
+async def metrics(request: Request):
+    return Response(metrics_sink.render(), media_type='text/plain; version=0.0.4')
+
+
+async def lifespan(app):
+    # Servers declared in config.json are hot-reloaded into every session, as in the UI
+    server_watcher.start()
+    yield
+    finished = await admission.drain(session_settings.get('drain_timeout', 30))
+    if not finished:
+        print(f"Drain timed out with {admission.inflight} turn(s) still running")
+    await server_watcher.stop()
+    await session_manager.close_all()
+    await default_pool.close_all()
+    default_tracer.close()
+
+
+app = Starlette(routes=[
+    Route('/healthz', healthz, methods=['GET']),
+    Route('/readyz', readyz, methods=['GET']),
+    Route('/v1/sessions', create_session, methods=['POST']),
+    Route('/v1/sessions/{session_id}/messages', send_message, methods=['POST']),
+    Route('/v1/sessions/{session_id}/reset', reset_session, methods=['POST']),
+    Route('/v1/sessions/{session_id}', close_session, methods=['DELETE']),
+] + ([Route('/metrics', metrics, methods=['GET'])] if metrics_sink is not None else []), lifespan=lifespan)
+
+
+class _Draining_server(uvicorn.Server):
+    """Uvicorn server that fails readiness and refuses new turns as soon as it is asked to stop"""
+
+    def handle_exit(self, sig, frame):
+        admission.draining = True
+        super().handle_exit(sig, frame)
+
+
+def warm():
+    agent_template.warm()
+    warmed.set()
+
+
+def main(host: str = '0.0.0.0', port: int = 8000):
+    # Import the model and MCP SDKs while the server starts, /readyz answers 503 until then
+    threading.Thread(target=warm, name='agent-warmup', daemon=True).start()
+    if not api_tokens:
+        print("No API tokens configured (api.tokens or $MCP_AGENT_API_TOKENS): every /v1 request will be refused")
+    server = _Draining_server(uvicorn.Config(
+        app, host=host, port=port, log_level='warning',
+        # Clients reuse their connections across turns, the default of 5s would close them between turns
+        timeout_keep_alive=api_settings.get('keep_alive', 75),
+        # In-flight turns get the drain timeout to finish once the server stops
+        timeout_graceful_shutdown=session_settings.get('drain_timeout', 30)))
+    print(f"MCP Agent API on http://{host}:{port}")
+    server.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless HTTP API of the MCP Agent')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    main(host=args.host, port=args.port)
@@ -1,124 +1,153 @@
+# Eager on purpose: the UI is built when this module is imported, and Gradio is ~3.5 s of the ~3.7 s
+# import. Entry points that don't serve the UI (api.py, serve.py) import runtime.py and never load it
 import gradio as gr
+import argparse
 import asyncio
-import json
 import atexit
+import os
 import signal
 import sys
-from src.mcp_agent.agent import MCP_Agent
-from pathlib import Path
-from datetime import datetime
-
-# Get the path to the config.json file to initialize the agent
-config_file_path = Path(__file__).parent.parent.parent / "config.json"
-
-def load_config(config_file_path: str = None) -> dict:
-    """Load configuration from JSON file"""
-    if config_file_path is None:
-        # Default to config.json in the project root
-        config_file_path = Path(__file__).parent.parent.parent / "config.json"
-    
-    try:
-        with open(config_file_path, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Return default config if file not found
-        return {
-            "agent_config": {
-                "instructions": "You are a helpful assistant that can help with a wide range of tasks. You have the current time and the user query, you can use the tools provided to you if necessary to help the user with their queries. Ask how you can help the user. Sometimes the user will ask you not to use the tools, in this case you should not use the tools.",
-                "model_settings": {
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                }
-            },
-            "mcp_servers": {
-                "default_timeout": 30,
-                "retry_attempts": 3
-            }
-        }
+import threading
+import time
+import uuid
+from contextlib import aclosing
+from src.mcp_agent.pool import default_pool
+from src.mcp_agent.servers import normalize_server, split_servers
+from src.mcp_agent.history import SUMMARY_PREFIX
+from src.mcp_agent.tracing import default_tracer
+from src.mcp_agent.metrics import serve_metrics
+from src.gradio_app.chat_log import ChatLog
+from src.gradio_app.runtime import (admission, agent_template, build_agent, config, metrics_sink, server_watcher,
+                                    session_manager_for, session_settings, tracing_settings)
+from src.gradio_app.sessions import ServerBusyError, SessionLimitError
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+def chat_history_of(messages) -> list:
+    """Rebuild the [user, assistant] pairs shown in the chatbot from a resumed conversation"""
+    chat_history = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(message, ModelRequest) and isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                if not part.content.startswith(SUMMARY_PREFIX):
+                    chat_history.append([part.content, ""])
+            elif isinstance(message, ModelResponse) and isinstance(part, TextPart) and chat_history:
+                chat_history[-1][1] += part.content
+    return [pair for pair in chat_history if pair[1]]
+
+def servers_from_form(server_configs) -> list[dict]:
+    """
+    Server configs entered in the sidebar. server_configs comes as a flat list: the three url slots
+    [url1, name1, type1, headers1, ..., url3, name3, type3, headers3] then the stdio slot [command, args, name].
+    The stdio slot is ignored unless `ui.allow_stdio_servers` is set: visitors would otherwise run
+    arbitrary commands on this host. stdio servers belong in config.json.
+    """
+    url_fields, stdio_fields = server_configs[:12], server_configs[12:15]
+    servers = []
+    for i in range(0, len(url_fields) - 3, 4):
+        server_url, server_name, server_type, headers = url_fields[i:i + 4]
+        if server_url and server_url.strip():
+            servers.append(normalize_server({
+                'url': server_url,
+                'name': server_name.strip() if server_name and server_name.strip() else f'server_{i//4 + 1}',
+                'type': server_type if server_type else 'http',
+                'headers': headers,
+            }))
+    if len(stdio_fields) == 3 and ui_settings.get('allow_stdio_servers', False):
+        command, args, server_name = stdio_fields
+        if command and command.strip():
+            server = {'command': command, 'args': args}
+            if server_name and server_name.strip():
+                server['name'] = server_name.strip()
+            servers.append(normalize_server(server))
+    return servers
 
 class GradioMCPApp:
     def __init__(self):
         self.agent = None
-        self.chat_history = []
-        self._loop = None
+        # What the chatbot shows, bounded and paged, apart from the agent's own memory
+        self.chat_log = ChatLog(max_turns=ui_settings.get('max_turns', 500), page_turns=ui_settings.get('page_turns', 50))
+        self.stream_interval = ui_settings.get('stream_interval', 0.05)
         self.server_count = 1
+        self.ui_servers = []
+
+    @property
+    def chat_history(self) -> list:
+        """The turns sent to the chatbot: the latest page, or more once earlier ones were loaded"""
+        return self.chat_log.window()
         
-    def get_or_create_loop(self):
-        """Get existing event loop or create a new one"""
-        if self._loop is None or self._loop.is_closed():
-            self._loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self._loop)
-        return self._loop
-        
-    async def initialize_agent(self, openai_api_key, *server_configs):
-        """Initialize the MCP Agent with provided configuration"""
+    async def initialize_agent(self, openai_api_key, conversation_id, *server_configs):
+        """Initialize the MCP Agent with provided configuration, resuming the stored conversation of `conversation_id`"""
         try:
             # Clean up existing agent first
             if self.agent:
                 await self.disconnect_agent()
             
-            # Build MCP servers configuration from form fields
-            # server_configs comes as a flat list: [url1, name1, type1, token1, url2, name2, type2, token2, ...]
-            mcp_servers = []
-            for i in range(0, len(server_configs), 4):
-                if i + 3 < len(server_configs):
-                    server_url = server_configs[i]
-                    server_name = server_configs[i + 1]
-                    server_type = server_configs[i + 2]
-                    headers = server_configs[i + 3]
-                    
-                    if server_url and server_url.strip():
-                        server_config = {
-                            'url': server_url.strip(),
-                            'name': server_name.strip() if server_name and server_name.strip() else f'server_{i//4 + 1}',
-                            'type': server_type if server_type else 'http',
-                            'headers': headers.strip() if headers and headers.strip() else None
-                        }
-                        mcp_servers.append(server_config)
-            
-            # Initialize agent
-            api_keys = {'openai_api_key': openai_api_key}
-            self.agent = MCP_Agent(api_keys=api_keys, mpc_server_urls=mcp_servers, instructions=load_config(config_file_path)['agent_config']['instructions'])
+            # Servers declared in config.json, then the ones entered in the sidebar
+            self.ui_servers = servers_from_form(server_configs)
+            self.agent = build_agent(openai_api_key, conversation_id, self.ui_servers)
             
-            # Connect to MCP servers
+            # Connect to MCP servers, unreachable ones are retried in the background
             await self.agent.connect()
+            self.chat_log.replace(chat_history_of(await self.agent.resume()))
             
-            server_count = len(mcp_servers)
+            server_count = len(self.agent.mpc_servers)
             if server_count == 0:
                 return True, "Agent initialized successfully (no MCP servers configured)!"
-            else:
-                return True, f"Agent initialized successfully with {server_count} MCP server(s)!"
+            unavailable = self.agent.server_errors
+            message = f"Agent initialized successfully with {server_count - len(unavailable)}/{server_count} MCP server(s)!"
+            if unavailable:
+                message += "\nUnavailable, retrying in the background: " + "; ".join(
+                    f"{name} ({error})" for name, error in unavailable.items())
+            return True, message
             
         except Exception as e:
             return False, f"Error initializing agent: {str(e)}"
     
     async def chat_with_agent(self, message):
-        """Handle text chat with the agent"""
+        """Handle text chat with the agent, yielding the chat history as the response streams in"""
         if not self.agent:
-            return self.chat_history, "Please initialize the agent first by providing your OpenAI API key and clicking 'Initialize Agent'."
+            yield self.chat_history, "Please initialize the agent first by providing your OpenAI API key and clicking 'Initialize Agent'."
+            return
         
         if not message or not message.strip():
-            return self.chat_history, "Please provide a message."
+            yield self.chat_history, "Please provide a message."
+            return
         
+        # Add the turn right away and fill the reply in as events arrive
+        turn = self.chat_log.append(message.strip())
+        tool_lines = []
+        text = ""
+        # Gradio sends each update after the first as a diff of the window, coalesced to one per stream_interval
+        last_update = 0.0
         try:
-            # Get response from agent
-            response = await self.agent.chat(message.strip()+f" The current time is {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            # Update chat history
-            self.chat_history.append([message.strip(), str(response)])
-            
-            return self.chat_history, ""
-            
+            # aclosing: when the client goes away mid-turn the run is torn down right away, not at GC
+            async with aclosing(self.agent.chat_stream(message.strip())) as events:
+                async for event in events:
+                    if event.type == 'text':
+                        text += event.content
+                    elif event.type == 'tool_call':
+                        tool_lines.append(f"🔧 Calling `{event.tool_name}`...")
+                    elif event.type == 'tool_result':
+                        tool_lines.append(f"✅ `{event.tool_name}` returned")
+                    turn[1] = "\n\n".join(tool_lines + [text]) if tool_lines else text
+                    if time.monotonic() - last_update >= self.stream_interval:
+                        last_update = time.monotonic()
+                        yield self.chat_history, ""
+            yield self.chat_history, ""
+        except (asyncio.CancelledError, GeneratorExit):
+            # Stopped by the user or abandoned by a closed tab: the agent's memory is left as it was
+            turn[1] += "\n\n⏹️ *Stopped*"
+            raise
         except Exception as e:
             error_msg = f"Error during chat: {str(e)}"
-            self.chat_history.append([message, error_msg])
-            return self.chat_history, error_msg
+            turn[1] = error_msg
+            yield self.chat_history, error_msg
     
     async def reset_agent(self):
         """Reset the agent's conversation history"""
         if self.agent:
             self.agent.reset()
-            self.chat_history = []
+            self.chat_log.clear()
             return [], "Agent conversation history reset successfully!"
         else:
             return [], "No agent to reset. Please initialize the agent first."
@@ -132,76 +161,155 @@ class GradioMCPApp:
                 print(f"Error during disconnect: {e}")
             finally:
                 self.agent = None
-                self.chat_history = []
+                self.chat_log.clear()
         return [], "Agent disconnected successfully!"
     
+    def show_earlier(self) -> list:
+        """Page the previous turns into the chatbot"""
+        return self.chat_log.show_earlier()
+
+    async def apply_servers(self) -> dict | None:
+        """Bring the agent's MCP servers in line with config.json and the sidebar, keeping unchanged connections"""
+        if self.agent:
+            return await self.agent.update_servers(*split_servers(server_watcher.servers + self.ui_servers))
+        return None
+
+    def offload(self) -> bool:
+        """Drop the agent's conversation memory from RAM while idle, it lives on in the session store"""
+        if self.agent and self.agent.history_store is not None:
+            self.agent.offload()
+            return True
+        return False
+
     async def cleanup(self):
         """Clean up resources"""
         if self.agent:
             await self.disconnect_agent()
-        if self._loop and not self._loop.is_closed():
-            self._loop.close()
 
-# Create the app instance
-app_instance = GradioMCPApp()
+# Size of what each session's chatbot holds and is sent
+ui_settings = config.get('ui', {})
+
+# One GradioMCPApp per browser session, all running on Gradio's event loop
+session_manager = session_manager_for(GradioMCPApp)
 
-def run_async_safely(coro, *args):
-    """Safely run async function with proper error handling"""
-    loop = app_instance.get_or_create_loop()
+def get_session_id(request: gr.Request) -> str:
+    """Key sessions by the Gradio session hash"""
+    return request.session_hash if request is not None and request.session_hash else "default"
+
+# Define async wrapper functions for Gradio
+# The request comes before the server fields: Gradio can't pass it after *server_configs
+async def initialize_agent_wrapper(openai_api_key, conversation_id, request: gr.Request, *server_configs):
     try:
-        return loop.run_until_complete(coro(*args))
+        server_watcher.start()
+        session = await session_manager.get(get_session_id(request))
+        async with session.lock:
+            success, message = await session.app.initialize_agent(openai_api_key, conversation_id, *server_configs)
+    except SessionLimitError as e:
+        return gr.update(visible=False), gr.update(visible=True), str(e), []
     except Exception as e:
         print(f"Error in async operation: {e}")
-        return None, f"Error: {str(e)}"
+        return gr.update(visible=False), gr.update(visible=True), f"Error: {str(e)}", []
+    return gr.update(visible=success), gr.update(visible=not success), message, session.app.chat_history
 
-# Define async wrapper functions for Gradio
-def initialize_agent_wrapper(openai_api_key, *server_configs):
-    success, message = run_async_safely(
-        app_instance.initialize_agent, 
-        openai_api_key, *server_configs
-    )
-    if success is None:
-        return gr.update(visible=False), gr.update(visible=True), message
-    return gr.update(visible=success), gr.update(visible=not success), message
-
-def chat_wrapper(message):
-    chat_history, error_msg = run_async_safely(app_instance.chat_with_agent, message)
-    if chat_history is None:
-        return [], error_msg, ""
-    return chat_history, error_msg, ""  # Clear input
-
-def reset_wrapper():
-    chat_history, message = run_async_safely(app_instance.reset_agent)
-    if chat_history is None:
-        return [], message
-    return chat_history, message
-
-def disconnect_wrapper():
-    chat_history, message = run_async_safely(app_instance.disconnect_agent)
-    if chat_history is None:
-        return [], gr.update(visible=False), gr.update(visible=True), message
+def ensure_conversation_id(conversation_id):
+    """Give the browser a stable conversation id the first time it opens the app"""
+    return conversation_id or uuid.uuid4().hex
+
+async def chat_wrapper(message, request: gr.Request):
+    try:
+        session = await session_manager.get(get_session_id(request))
+        if session.lock.locked():
+            yield session.app.chat_history, "Waiting for the previous message to finish...", message
+        async with session_manager.turn(session):
+            with admission:
+                async for chat_history, error_msg in session.app.chat_with_agent(message):
+                    yield chat_history, error_msg, ""  # Clear input
+    except ServerBusyError as e:
+        session = session_manager.sessions.get(get_session_id(request))
+        # Keep the message in the input box so it can be sent again
+        yield (session.app.chat_history if session else []), str(e), message
+    except SessionLimitError as e:
+        yield [], str(e), ""
+    except Exception as e:
+        print(f"Error in async operation: {e}")
+        yield [], f"Error: {str(e)}", ""
+
+async def reset_wrapper(request: gr.Request):
+    try:
+        session = await session_manager.get(get_session_id(request))
+        await session_manager.cancel_turns(session)
+        async with session.lock:
+            return await session.app.reset_agent()
+    except Exception as e:
+        print(f"Error in async operation: {e}")
+        return [], f"Error: {str(e)}"
+
+async def disconnect_wrapper(request: gr.Request):
+    try:
+        session = await session_manager.get(get_session_id(request))
+        await session_manager.cancel_turns(session)
+        async with session.lock:
+            chat_history, message = await session.app.disconnect_agent()
+    except Exception as e:
+        print(f"Error in async operation: {e}")
+        chat_history, message = [], f"Error: {str(e)}"
     return chat_history, gr.update(visible=False), gr.update(visible=True), message
 
+async def earlier_wrapper(request: gr.Request):
+    session = session_manager.sessions.get(get_session_id(request))
+    return session.app.show_earlier() if session else []
+
+def earlier_button(request: gr.Request):
+    """Offer earlier turns only when some are outside the chatbot's window"""
+    session = session_manager.sessions.get(get_session_id(request))
+    return gr.update(visible=bool(session and session.app.chat_log.has_earlier))
+
+async def close_session(request: gr.Request):
+    """Release the session's agent when the browser tab is closed"""
+    await session_manager.close(get_session_id(request))
+
+async def shutdown():
+    """Close every session, then the shared MCP connections"""
+    await session_manager.close_all()
+    await default_pool.close_all()
+
 # Cleanup function for graceful shutdown
 def cleanup_on_exit():
     """Cleanup function to run on exit"""
     try:
-        loop = app_instance.get_or_create_loop()
-        if not loop.is_closed():
-            loop.run_until_complete(app_instance.cleanup())
+        session_manager.run_blocking(shutdown)
+        default_tracer.close()
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
 # Register cleanup function
 atexit.register(cleanup_on_exit)
 
+async def drain():
+    """Refuse new turns, let the running ones finish (up to `drain_timeout`), then shut down"""
+    finished = await admission.drain(session_settings.get('drain_timeout', 30))
+    if not finished:
+        print(f"Drain timed out with {admission.inflight} turn(s) still running")
+    await shutdown()
+
 # Handle SIGINT (Ctrl+C) gracefully
 def signal_handler(signum, frame):
     print("\nReceived interrupt signal. Cleaning up...")
     cleanup_on_exit()
     sys.exit(0)
 
+# SIGTERM (container stop, worker supervisor) drains the running turns before exiting
+def drain_handler(signum, frame):
+    print("\nReceived termination signal. Draining...")
+    try:
+        session_manager.run_blocking(drain, timeout=session_settings.get('drain_timeout', 30) + 10)
+        default_tracer.close()
+    except Exception as e:
+        print(f"Error during drain: {e}")
+    sys.exit(0)
+
 signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, drain_handler)
 
 # Server management functions
 def add_server(current_count):
@@ -251,7 +359,8 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
             )
             
             gr.Markdown("### MCP Servers Setup")
-            gr.Markdown("Configure your MCP server connections (leave all URLs empty to run without MCP servers)")
+            gr.Markdown("Configure your MCP server connections (leave all URLs empty to run without MCP servers). "
+                        "Servers declared in `config.json` are always connected.")
             
             # Container for dynamic server configurations
             servers_container = gr.Column()
@@ -338,7 +447,7 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
                             placeholder="Leave empty if not required",
                             info="Headers for the MCP server (if required), example: {'Authorization': 'Bearer 1234567890'}"
                         )
-                with gr.Tab("Stdio based servers"):
+                with gr.Tab("Stdio based servers", visible=ui_settings.get('allow_stdio_servers', False)):
                     with gr.Group():
                         gr.Markdown("#### Server 1")
                         server1_command = gr.Textbox(
@@ -351,7 +460,7 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
                             placeholder="['-y', '@modelcontextprotocol/server-memory']",
                             info="The arguments to use to run the MCP server"
                         )
-                        server1_name = gr.Textbox(
+                        stdio1_name = gr.Textbox(
                             label="Server Name",
                             placeholder="server_1",
                             info="A friendly name for your MCP server"
@@ -364,6 +473,9 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
             # Track current server count
             server_count_state = gr.State(1)
             
+            # Key of this browser's conversation in the session store, kept in local storage
+            conversation_id = gr.BrowserState(None, storage_key="mcp_agent_conversation_id")
+            
             init_btn = gr.Button("Initialize Agent", variant="primary", size="lg")
             init_status = gr.Textbox(label="Status", interactive=False, max_lines=3)
     
@@ -376,6 +488,7 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
         
         chat_interface = gr.Column(visible=False)
         with chat_interface:
+            earlier_btn = gr.Button("⬆ Load earlier messages", variant="secondary", size="sm", visible=False)
             chatbot = gr.Chatbot(
                 label="Conversation",
                 height=500,
@@ -391,6 +504,7 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
                     lines=2
                 )
                 send_btn = gr.Button("Send", variant="primary", scale=1)
+                stop_btn = gr.Button("Stop", variant="stop", scale=1)
             
             error_display = gr.Textbox(
                 label="Error Messages",
@@ -427,39 +541,54 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
         fn=initialize_agent_wrapper,
         inputs=[
             openai_key,
+            conversation_id,
             server1_url, server1_name, server1_type, server1_headers,
             server2_url, server2_name, server2_type, server2_headers,
             server3_url, server3_name, server3_type, server3_headers,
-            server1_command, server1_args, server1_name
+            server1_command, server1_args, stdio1_name
         ],
-        outputs=[chat_interface, placeholder, init_status]
-    )
+        outputs=[chat_interface, placeholder, init_status, chatbot]
+    ).then(earlier_button, outputs=[earlier_btn])
+    
+    # The chatbot holds a window of the latest turns, earlier ones are paged in from the server
+    earlier_btn.click(
+        fn=earlier_wrapper,
+        outputs=[chatbot]
+    ).then(earlier_button, outputs=[earlier_btn])
     
     # Chat functionality
-    def handle_chat(message):
+    async def handle_chat(message, request: gr.Request):
         if not message or not message.strip():
-            return app_instance.chat_history, "Please provide a message.", ""
-        return chat_wrapper(message)
+            session = session_manager.sessions.get(get_session_id(request))
+            yield (session.app.chat_history if session else []), "Please provide a message.", ""
+            return
+        async for update in chat_wrapper(message, request):
+            yield update
     
-    send_btn.click(
+    send_event = send_btn.click(
         fn=handle_chat,
         inputs=[msg],
         outputs=[chatbot, error_display, msg]
-    ).then(
+    )
+    send_event.then(
         lambda error: gr.update(visible=bool(error)),
         inputs=[error_display],
         outputs=[error_display]
-    )
+    ).then(earlier_button, outputs=[earlier_btn])
     
-    msg.submit(
+    submit_event = msg.submit(
         fn=handle_chat,
         inputs=[msg],
         outputs=[chatbot, error_display, msg]
-    ).then(
+    )
+    submit_event.then(
         lambda error: gr.update(visible=bool(error)),
         inputs=[error_display],
         outputs=[error_display]
-    )
+    ).then(earlier_button, outputs=[earlier_btn])
+    
+    # Cancelling the event cancels the turn's task, which aborts its model request and tool calls
+    stop_btn.click(fn=None, cancels=[send_event, submit_event])
     
     reset_btn.click(
         fn=reset_wrapper,
@@ -468,15 +597,29 @@ with gr.Blocks(title="MCP Agent Chat", theme=gr.themes.Soft()) as demo:
         lambda error: gr.update(visible=bool(error)),
         inputs=[error_display],
         outputs=[error_display]
-    )
+    ).then(earlier_button, outputs=[earlier_btn])
     
     disconnect_btn.click(
         fn=disconnect_wrapper,
         outputs=[chatbot, chat_interface, placeholder, init_status]
     )
+    
+    demo.load(fn=ensure_conversation_id, inputs=[conversation_id], outputs=[conversation_id])
+    
+    # Free the session's agent and MCP connections when the tab closes
+    demo.unload(close_session)
 
 def main(server_name:str = "0.0.0.0", server_port:int = 7860, share:bool = False):
     """Main entry point for the application"""
+    # Let every live session run its handlers concurrently on Gradio's event loop
+    demo.queue(default_concurrency_limit=session_manager.max_sessions)
+    if metrics_sink is not None:
+        # Workers of `serve.py` each serve their own metrics on consecutive ports
+        metrics_port = tracing_settings['metrics_port'] + int(os.environ.get('MCP_AGENT_WORKER_INDEX', 0))
+        serve_metrics(metrics_sink, port=metrics_port)
+        print(f"Prometheus metrics on http://{server_name}:{metrics_port}/metrics")
+    # Import the model and MCP SDKs while the server starts rather than in the first session
+    threading.Thread(target=agent_template.warm, name='agent-warmup', daemon=True).start()
     demo.launch(
         server_name=server_name,
         server_port=server_port,
@@ -485,4 +628,8 @@ def main(server_name:str = "0.0.0.0", server_port:int = 7860, share:bool = False
     )
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="MCP Agent Gradio app (single process, see serve.py for workers)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7860)
+    args = parser.parse_args()
+    main(server_name=args.host, server_port=args.port)
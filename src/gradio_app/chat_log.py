@@ -0,0 +1,60 @@
+import itertools
+from collections import deque
+
+
+class ChatLog:
+    """
+    Chat history shown by one session's chatbot, kept apart from the agent's memory.
+
+    Only the last `max_turns` turns are kept, and the chatbot is only sent the last `visible`
+    of them, so the payload of a turn (and the work of rendering it) stays the same however long
+    the conversation gets. Earlier turns are paged in on request, a page at a time.
+    """
+
+    def __init__(self, max_turns: int = 500, page_turns: int = 50):
+        """
+        Args:
+            max_turns (int): Turns kept in memory, the oldest are dropped beyond it
+            page_turns (int): Turns sent to the chatbot, and added by each `show_earlier`
+        """
+        self.turns: deque[list[str]] = deque(maxlen=max_turns)
+        self.page_turns = page_turns
+        self.visible = page_turns
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def append(self, message: str, reply: str = "") -> list[str]:
+        """Add a turn and return its [user, assistant] pair, to be filled in as the reply streams"""
+        if len(self.turns) == self.turns.maxlen:
+            self.dropped += 1
+        pair = [message, reply]
+        self.turns.append(pair)
+        # A new turn brings the view back to the latest page
+        self.visible = self.page_turns
+        return pair
+
+    def replace(self, pairs: list[list[str]]):
+        """Start over from the turns of a resumed conversation"""
+        self.clear()
+        for message, reply in pairs:
+            self.append(message, reply)
+
+    def window(self) -> list[list[str]]:
+        """The turns the chatbot shows: the last `visible` ones"""
+        return list(itertools.islice(self.turns, max(len(self.turns) - self.visible, 0), None))
+
+    @property
+    def has_earlier(self) -> bool:
+        return self.visible < len(self.turns)
+
+    def show_earlier(self) -> list[list[str]]:
+        """Extend the window by a page of earlier turns"""
+        self.visible = min(self.visible + self.page_turns, max(len(self.turns), self.page_turns))
+        return self.window()
+
+    def clear(self):
+        self.turns.clear()
+        self.visible = self.page_turns
+        self.dropped = 0
@@ -0,0 +1,255 @@
+"""
+Process-wide state shared by the Gradio UI (`app.py`) and the HTTP API (`api.py`): the
+configuration, the MCP connection pool settings, the models and agent template, the caches
+and stores, and the builder of a session's agent. It doesn't import Gradio.
+"""
+import asyncio
+import json
+from pathlib import Path
+
+from src.mcp_agent.agent import Agent_template, MCP_Agent
+from src.mcp_agent.pool import default_pool
+from src.mcp_agent.servers import Server_config_watcher, servers_from_config, split_servers
+from src.mcp_agent.result_cache import Tool_result_cache
+from src.mcp_agent.response_cache import Response_cache
+from src.mcp_agent.models import Model_router
+from src.mcp_agent.tool_results import Tool_result_offloader, result_store_from_config
+from src.mcp_agent.tool_selection import Tool_selector
+from src.mcp_agent.history import History_policy, model_summarizer
+from src.mcp_agent.store import store_from_config
+from src.mcp_agent.prompt import Prompt_assembler
+from src.mcp_agent.tracing import default_tracer, tracer_from_config
+from src.mcp_agent.metrics import Metrics_sink
+from src.gradio_app.sessions import AdmissionLimit, SessionManager
+
+# Get the path to the config.json file to initialize the agent
+config_file_path = Path(__file__).parent.parent.parent / "config.json"
+
+def load_config(config_file_path: str = None) -> dict:
+    """Load configuration from JSON file"""
+    if config_file_path is None:
+        # Default to config.json in the project root
+        config_file_path = Path(__file__).parent.parent.parent / "config.json"
+    
+    try:
+        with open(config_file_path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Return default config if file not found
+        return {
+            "agent_config": {
+                "instructions": "You are a helpful assistant that can help with a wide range of tasks. You have the current time and the user query, you can use the tools provided to you if necessary to help the user with their queries. Ask how you can help the user. Sometimes the user will ask you not to use the tools, in this case you should not use the tools.",
+                "model_settings": {
+                    "temperature": 0.7,
+                    "max_tokens": 1000
+                },
+                "history": {
+                    "max_tokens": 16000,
+                    "max_tool_return_chars": 8000,
+                    "max_session_tokens": 32000,
+                    "compact_target": 0.75,
+                    "summarize": False
+                },
+                "time_resolution": 60
+            },
+            "models": {
+                "policy": "cheapest",
+                "request_timeout": 120,
+                "cooldown": 30,
+                "rate_limits": {
+                    "enabled": True,
+                    "completion_tokens": 512,
+                    "max_wait": 300,
+                    "retries": 3
+                },
+                "endpoints": [
+                    {"name": "gpt-4.1-mini", "model": "gpt-4.1-mini", "cost": 1.0}
+                ]
+            },
+            "mcp_servers": {
+                "default_timeout": 30,
+                "connect_timeout": 10,
+                "retry_attempts": 3,
+                "max_concurrency": 4,
+                "idempotent_tools": [],
+                "pool_idle_timeout": 300,
+                "health_check_interval": 60,
+                "tools_cache_ttl": 300,
+                "reload_interval": 2,
+                "servers": []
+            },
+            "tool_result_cache": {
+                "enabled": False,
+                "backend": "memory",
+                "max_bytes": 67108864,
+                "default_ttl": 300,
+                "tools": {}
+            },
+            "tool_results": {
+                "max_result_bytes": 8000,
+                "preview_bytes": 1500,
+                "max_read_bytes": 6000,
+                "backend": "memory",
+                "max_bytes": 268435456
+            },
+            "tool_selection": {
+                "enabled": False,
+                "top_k": 10,
+                "context_turns": 1,
+                "embedder": None,
+                "embedding_weight": 0.5,
+                "always": ["read_tool_result"]
+            },
+            "response_cache": {
+                "enabled": False,
+                "ttl": 3600,
+                "max_entries": 1000,
+                "similarity": {
+                    "enabled": False,
+                    "threshold": 0.92,
+                    "embedder": "hashing"
+                }
+            },
+            "sessions": {
+                "max_sessions": 50,
+                "idle_timeout": 1800,
+                "max_inflight_turns": 32,
+                "max_queued_turns": 1,
+                "cancel_timeout": 5,
+                "drain_timeout": 30
+            },
+            "session_store": {
+                "enabled": False,
+                "backend": "sqlite",
+                "path": "sessions.sqlite",
+                "keep_full_history": True,
+                "offload_after": 300
+            },
+            "api": {
+                "max_body_bytes": 1048576,
+                "max_message_chars": 100000,
+                "keep_alive": 75,
+                "sse_ping_interval": 15,
+                "allow_stdio_servers": False,
+                "tokens": [],
+                "allow_server_key": False
+            },
+            "ui": {
+                "page_turns": 50,
+                "max_turns": 500,
+                "stream_interval": 0.05,
+                "allow_stdio_servers": False
+            },
+            "tracing": {
+                "sinks": [],
+                "jsonl_path": "traces.jsonl",
+                "otlp_endpoint": "http://localhost:4318/v1/traces",
+                "metrics_port": None
+            }
+        }
+
+config = load_config(config_file_path)
+
+# MCP connections are shared by every session through the process-wide pool
+mcp_server_settings = config.get('mcp_servers', {})
+default_pool.idle_timeout = mcp_server_settings.get('pool_idle_timeout', default_pool.idle_timeout)
+default_pool.health_check_interval = mcp_server_settings.get('health_check_interval', default_pool.health_check_interval)
+default_pool.tools_ttl = mcp_server_settings.get('tools_cache_ttl', default_pool.tools_ttl)
+default_pool.connect_timeout = mcp_server_settings.get('connect_timeout', default_pool.connect_timeout)
+default_pool.tool_call_defaults = {
+    'timeout': mcp_server_settings.get('default_timeout', 30),
+    'retry_attempts': mcp_server_settings.get('retry_attempts', 3),
+    'max_concurrency': mcp_server_settings.get('max_concurrency', 4),
+    'idempotent_tools': mcp_server_settings.get('idempotent_tools', []),
+}
+default_pool.result_cache = Tool_result_cache.from_config(config.get('tool_result_cache'))
+# Answers to repeated tool-free questions, shared by every session
+response_cache = Response_cache.from_config(config.get('response_cache'),
+                                             config['agent_config'].get('time_resolution', 60))
+# Models every agent routes its requests to, with their observed latency and rate limits
+model_router = Model_router.from_config(config.get('models'))
+# What every session's agent shares: instructions, models and their clients, tool schemas
+agent_template = Agent_template(instructions=config['agent_config']['instructions'], model_router=model_router,
+                                model_settings=config['agent_config'].get('model_settings'),
+                                tool_selector=Tool_selector.from_config(config.get('tool_selection')))
+# Oversized tool results are kept out of the conversations, in one store for every session
+tool_result_settings = config.get('tool_results', {})
+tool_result_store = result_store_from_config(tool_result_settings)
+
+# Spans go to the configured sinks, metrics are served on their own port when enabled
+tracing_settings = config.get('tracing', {})
+tracer_from_config(tracing_settings)
+metrics_sink = default_tracer.add_sink(Metrics_sink()) if tracing_settings.get('metrics_port') else None
+
+# Conversations are persisted by conversation id (per browser in the UI) and survive restarts
+store_settings = dict(config.get('session_store', {}))
+if store_settings.get('path'):
+    # Relative to config.json rather than to wherever the app was started from
+    store_settings['path'] = str(config_file_path.parent / store_settings['path'])
+session_store = store_from_config(store_settings)
+
+session_settings = config.get('sessions', {})
+# Turns beyond this many in flight get an immediate "busy" answer instead of waiting in the queue
+admission = AdmissionLimit(max_inflight=session_settings.get('max_inflight_turns', 32))
+
+# Session managers of the entry points running in this process: the Gradio UI, the HTTP API
+session_managers: list[SessionManager] = []
+
+def session_manager_for(factory) -> SessionManager:
+    """Session manager of the `sessions` block of config.json, whose sessions get the server reloads"""
+    manager = SessionManager(
+        factory=factory,
+        max_sessions=session_settings.get('max_sessions', 50),
+        idle_timeout=session_settings.get('idle_timeout', 1800),
+        offload_after=store_settings.get('offload_after', 300) if session_store is not None else None,
+        max_queued_turns=session_settings.get('max_queued_turns', 1),
+        cancel_timeout=session_settings.get('cancel_timeout', 5)
+    )
+    session_managers.append(manager)
+    return manager
+
+async def reload_servers(servers: list[dict]):
+    """Apply a changed server list of config.json to the agent of every live session"""
+    async def apply(session):
+        # Between turns, so no tool call is cut off by its server going away
+        async with session.lock:
+            return await session.app.apply_servers()
+    sessions = [session for manager in session_managers for session in manager.sessions.values()]
+    results = await asyncio.gather(*(apply(session) for session in sessions), return_exceptions=True)
+    for session, result in zip(sessions, results):
+        if isinstance(result, Exception):
+            print(f"Error applying MCP servers to session {session.session_id}: {result}")
+
+# Servers declared in config.json are given to every session, and hot-reloaded when the file changes
+server_watcher = Server_config_watcher(config_file_path, on_change=reload_servers,
+                                       interval=mcp_server_settings.get('reload_interval', 2),
+                                       servers=servers_from_config(config))
+
+
+def build_agent(openai_api_key: str, conversation_id: str = None, servers: list[dict] = ()) -> MCP_Agent:
+    """
+    Agent of one session, not yet connected.
+
+    Args:
+        openai_api_key (str): Key of the OpenAI endpoints without one of their own
+        conversation_id (str, optional): Key of the conversation in the session store, resumed on the first turn
+        servers (list): Normalized MCP server configs given to this session on top of those of config.json
+    """
+    mcp_server_urls, mcp_stdio_commands = split_servers(server_watcher.servers + list(servers))
+    agent_config = config['agent_config']
+    history_settings = dict(agent_config.get('history', {}))
+    summarize = history_settings.pop('summarize', False)
+    agent = MCP_Agent(api_keys={'openai_api_key': openai_api_key}, mpc_server_urls=mcp_server_urls,
+                      mpc_stdio_commands=mcp_stdio_commands, template=agent_template,
+                      history_policy=History_policy(**history_settings),
+                      prompt_assembler=Prompt_assembler(time_resolution=agent_config.get('time_resolution', 60)),
+                      store=session_store if conversation_id else None, session_id=conversation_id,
+                      response_cache=response_cache,
+                      tool_results=Tool_result_offloader(
+                          tool_result_store,
+                          max_bytes=tool_result_settings.get('max_result_bytes', 8000),
+                          preview_bytes=tool_result_settings.get('preview_bytes', 1500),
+                          max_read_bytes=tool_result_settings.get('max_read_bytes', 6000)))
+    if summarize:
+        agent.history_policy.summarizer = model_summarizer(agent.llms['mcp_llm'])
+    return agent
@@ -0,0 +1,310 @@
+"""
+Production launcher: N Gradio worker processes behind a local router with session affinity.
+
+Every worker is a full copy of the app (`python -m src.gradio_app.app`) with its own event
+loop, sessions and MCP connection pool, listening on 127.0.0.1. The router is the only public
+listener: it pins each browser to one worker with a cookie, so a user's `MCP_Agent` always
+lives on the same worker, and spreads new browsers over the least busy workers.
+
+With `--api-port`, the headless HTTP API (`python -m src.gradio_app.api`) runs next to the
+workers as one more process of the container, listening on that port of the public host.
+
+Every process (the API included) gets `MCP_AGENT_PROCESS_COUNT`, so the rate-limit budgets
+of the shared API keys are split between them.
+
+A worker that exits is restarted, and a worker the router couldn't reach is probed until it
+answers again.
+
+On SIGTERM the router stops taking new browsers, waits for in-flight requests to finish (not
+for the heartbeat stream every open page keeps), then sends SIGTERM to the workers (and the
+API), which drain their running turns before exiting.
+
+Usage:
+    uv run python -m src.gradio_app.serve --workers 4 --port 7860 --api-port 8000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+import httpx
+import uvicorn
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+
+# Headers that only make sense for a single connection and must not be forwarded
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+              'transfer-encoding', 'upgrade'}
+
+# Streams a page keeps open for as long as it is shown, not work in progress: drain doesn't wait for them
+IDLE_STREAMS = ('/heartbeat/',)
+
+# Upper bound of the default worker count: every worker is a full copy of the app and its agents
+MAX_DEFAULT_WORKERS = 4
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity, bounded by the cgroup CPU quota of the container"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        quota, period = open('/sys/fs/cgroup/cpu.max').read().split()
+        if quota != 'max':
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+def default_workers() -> int:
+    return int(os.environ.get('WEB_CONCURRENCY') or min(available_cpus(), MAX_DEFAULT_WORKERS))
+
+
+class StickyRouter:
+    """ASGI reverse proxy pinning each browser to one worker with a cookie"""
+
+    def __init__(self, worker_urls: list[str], cookie_name: str = 'mcp_agent_worker',
+                 processes: list[subprocess.Popen] = None, restart: Callable[[int], subprocess.Popen] = None,
+                 probe_interval: float = 2):
+        """
+        Args:
+            worker_urls (list): Base urls of the workers, e.g. ['http://127.0.0.1:7870']
+            cookie_name (str): Cookie holding the index of the browser's worker
+            processes (list, optional): Worker processes, in the order of `worker_urls`, restarted when they exit
+            restart (callable, optional): Starts worker `index` again, returns its process
+            probe_interval (float): Seconds between checks of exited and unreachable workers
+        """
+        self.worker_urls = worker_urls
+        self.cookie_name = cookie_name
+        self.processes = processes
+        self.restart = restart
+        self.probe_interval = probe_interval
+        self.inflight = [0] * len(worker_urls)
+        # In-flight requests drain waits for, i.e. without the idle streams
+        self.busy = [0] * len(worker_urls)
+        self.alive = [True] * len(worker_urls)
+        self.draining = False
+        self._supervisor: asyncio.Task | None = None
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5), limits=httpx.Limits(
+            max_connections=None, max_keepalive_connections=100))
+
+    def pick(self, request: Request) -> tuple[int | None, bool]:
+        """Return (worker index, whether the browser is new to it)"""
+        pinned = request.cookies.get(self.cookie_name)
+        if pinned is not None and pinned.isdigit() and int(pinned) < len(self.worker_urls) and self.alive[int(pinned)]:
+            return int(pinned), False
+        candidates = [index for index, alive in enumerate(self.alive) if alive]
+        if not candidates:
+            return None, True
+        return min(candidates, key=lambda index: self.inflight[index]), True
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    self._supervisor = asyncio.create_task(self.supervise())
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self._supervisor.cancel()
+                    await self.client.aclose()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        response = await self.proxy(Request(scope, receive))
+        await response(scope, receive, send)
+
+    async def proxy(self, request: Request) -> Response:
+        worker, new = self.pick(request)
+        if worker is None:
+            return PlainTextResponse('No worker available, please try again in a moment.', 503,
+                                     headers={'Retry-After': '5'})
+        if new and self.draining:
+            return PlainTextResponse('The server is restarting, please try again in a moment.', 503,
+                                     headers={'Retry-After': '5'})
+        url = self.worker_urls[worker] + request.url.path + (f"?{request.url.query}" if request.url.query else '')
+        headers = [(name, value) for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP]
+        headers += [('x-forwarded-for', request.client.host if request.client else ''),
+                    ('x-forwarded-proto', request.url.scheme)]
+        upstream_request = self.client.build_request(request.method, url, headers=headers, content=request.stream())
+        try:
+            upstream = await self.client.send(upstream_request, stream=True)
+        except httpx.ConnectError:
+            self.alive[worker] = False
+            return PlainTextResponse('Worker unavailable, please reload the page.', 502)
+
+        busy = not any(stream in request.url.path for stream in IDLE_STREAMS)
+        self.inflight[worker] += 1
+        self.busy[worker] += busy
+
+        async def body():
+            try:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+            finally:
+                await upstream.aclose()
+                self.inflight[worker] -= 1
+                self.busy[worker] -= busy
+
+        response = StreamingResponse(body(), status_code=upstream.status_code)
+        response.raw_headers = [
+            (name.encode('latin-1'), value.encode('latin-1'))
+            for name, value in upstream.headers.multi_items() if name.lower() not in HOP_BY_HOP
+        ]
+        if new:
+            response.set_cookie(self.cookie_name, str(worker), httponly=True, samesite='lax')
+        return response
+
+    async def drain(self, timeout: float = 30) -> bool:
+        """Stop pinning new browsers and wait up to `timeout` seconds for in-flight requests"""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while sum(self.busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return not sum(self.busy)
+
+    async def supervise(self):
+        """Restart the workers that exited and route to unreachable workers again once they answer"""
+        while not self.draining:
+            await asyncio.sleep(self.probe_interval)
+            for index, url in enumerate(self.worker_urls):
+                if self.draining:
+                    return
+                process = self.processes[index] if self.processes is not None else None
+                if process is not None and self.restart is not None and process.poll() is not None:
+                    print(f"Worker {index} exited with code {process.returncode}, restarting it")
+                    self.alive[index] = False
+                    self.processes[index] = self.restart(index)
+                if not self.alive[index]:
+                    self.alive[index] = await self.answers(url)
+
+    @staticmethod
+    async def answers(url: str) -> bool:
+        """Whether something listens on the worker's port"""
+        parts = urlsplit(url)
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port), 1)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Worker on port {port} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Worker on port {port} did not start within {timeout}s")
+
+
+def start_worker(index: int, base_port: int) -> subprocess.Popen:
+    """Start worker `index` without waiting for it to listen"""
+    env = dict(os.environ, MCP_AGENT_WORKER_INDEX=str(index))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'src.gradio_app.app', '--host', '127.0.0.1', '--port', str(base_port + index)],
+        env=env,
+    )
+
+
+def start_workers(count: int, base_port: int) -> list[subprocess.Popen]:
+    workers = [start_worker(index, base_port) for index in range(count)]
+    for index, worker in enumerate(workers):
+        wait_for_port(base_port + index, worker)
+    return workers
+
+
+def start_api(host: str, port: int) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, '-m', 'src.gradio_app.api', '--host', host, '--port', str(port)])
+    wait_for_port(port, process)
+    return process
+
+
+def stop_workers(workers: list[subprocess.Popen], timeout: float = 40):
+    """SIGTERM every worker (they drain their running turns), SIGKILL the ones still alive after `timeout`"""
+    for worker in workers:
+        if worker.poll() is None:
+            worker.send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        try:
+            worker.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+
+class _Draining_server(uvicorn.Server):
+    """Uvicorn server that drains the router before it stops accepting connections"""
+
+    def __init__(self, config: uvicorn.Config, router: StickyRouter, drain_timeout: float):
+        super().__init__(config)
+        self.router = router
+        self.drain_timeout = drain_timeout
+
+    def _exit(self, sig, frame):
+        super().handle_exit(sig, frame)
+        # Uvicorn re-raises the signal once it has stopped, which would kill the supervisor
+        # before it has stopped the workers
+        self._captured_signals.clear()
+
+    def handle_exit(self, sig, frame):
+        if self.router.draining:
+            # Second signal: stop right away
+            return self._exit(sig, frame)
+        print(f"\nReceived signal {sig}, draining for up to {self.drain_timeout}s...")
+        self.router.draining = True
+        loop = asyncio.get_event_loop()
+        loop.call_soon_threadsafe(lambda: loop.create_task(self.router.drain(self.drain_timeout)).add_done_callback(
+            lambda _: self._exit(sig, frame)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the MCP Agent app as several workers behind a sticky router')
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help=f"Number of worker processes (default: $WEB_CONCURRENCY, or the CPUs available to "
+                             f"the container up to {MAX_DEFAULT_WORKERS})")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=7860, help='Public port of the router')
+    parser.add_argument('--worker-base-port', type=int, default=7870,
+                        help='Workers listen on 127.0.0.1 from this port upwards')
+    parser.add_argument('--drain-timeout', type=float, default=30,
+                        help='Seconds to wait for in-flight requests on shutdown')
+    parser.add_argument('--api-port', type=int, help='Also serve the headless HTTP API on this port')
+    args = parser.parse_args()
+
+    # Inherited by every process started below
+    os.environ['MCP_AGENT_PROCESS_COUNT'] = str(args.workers + (1 if args.api_port else 0))
+    workers = start_workers(args.workers, args.worker_base_port)
+    others = []
+    if args.api_port:
+        others.append(start_api(args.host, args.api_port))
+        print(f"Serving the HTTP API on http://{args.host}:{args.api_port}")
+    router = StickyRouter([f"http://127.0.0.1:{args.worker_base_port + index}" for index in range(args.workers)],
+                          processes=workers, restart=lambda index: start_worker(index, args.worker_base_port))
+    print(f"Serving {args.workers} worker(s) on http://{args.host}:{args.port}")
+    server = _Draining_server(uvicorn.Config(router, host=args.host, port=args.port, log_level='warning',
+                                             timeout_graceful_shutdown=5),
+                              router, args.drain_timeout)
+    try:
+        server.run()
+    finally:
+        # The router replaces restarted workers in `workers`
+        stop_workers(workers + others, timeout=args.drain_timeout + 10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+
+class SessionLimitError(Exception):
+    """Raised when a new session is requested while the manager is at capacity"""
+
+
+class ServerBusyError(Exception):
+    """Raised when a turn is refused because the worker is at its admission limit or draining"""
+
+
+class TurnQueueFullError(ServerBusyError):
+    """Raised when a session already has as many turns waiting as its queue allows"""
+
+
+class AdmissionLimit:
+    """
+    Caps the number of turns in flight on this worker.
+
+    A turn over the limit is refused right away with `ServerBusyError` rather than queued, so a
+    saturated worker answers "busy" in milliseconds and the client (or the router) can retry.
+    While draining, every new turn is refused and `drain` waits for the running ones.
+    """
+
+    def __init__(self, max_inflight: int = 32):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.rejected = 0
+        self.draining = False
+        self._idle: asyncio.Event | None = None
+
+    def __enter__(self):
+        if self.draining or (self.max_inflight and self.inflight >= self.max_inflight):
+            self.rejected += 1
+            raise ServerBusyError(
+                "The server is restarting, please try again in a moment." if self.draining
+                else "The server is busy, please try again in a moment."
+            )
+        self.inflight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.inflight -= 1
+        if self.inflight == 0 and self._idle is not None:
+            self._idle.set()
+        return False
+
+    async def drain(self, timeout: float = 30) -> bool:
+        """Refuse new turns and wait up to `timeout` seconds for the running ones, True if they all finished"""
+        self.draining = True
+        if self.inflight == 0:
+            return True
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+@dataclass
+class Session:
+    session_id: str
+    app: Any
+    last_active: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Tasks running or waiting to run a turn of this session
+    turn_tasks: set = field(default_factory=set)
+    waiting: int = 0
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def idle_for(self, now: float = None) -> float:
+        return (now if now is not None else time.monotonic()) - self.last_active
+
+
+class SessionManager:
+    """
+    Keeps one isolated app state (agent + chat history) per Gradio session.
+
+    All methods are coroutines meant to run on Gradio's own event loop, so sessions
+    only ever contend for their own lock and never block each other.
+    """
+
+    def __init__(self, factory: Callable[[], Any], max_sessions: int = 50, idle_timeout: float = 1800,
+                 reap_interval: float = 60, offload_after: float = None, max_queued_turns: int = 1,
+                 cancel_timeout: float = 5):
+        """
+        Args:
+            factory (callable): Builds the per-session state, must expose an async `cleanup()` method
+            max_sessions (int): Maximum number of live sessions
+            idle_timeout (float): Seconds of inactivity after which a session is evicted
+            reap_interval (float): Seconds between background eviction sweeps
+            offload_after (float, optional): Seconds of inactivity after which a session's conversation
+                                             memory is dropped from RAM (the app's `offload()` is called),
+                                             for apps that persist it to a store
+            max_queued_turns (int): Turns of one session that may wait behind its running turn,
+                                    more are refused with `TurnQueueFullError`
+            cancel_timeout (float): Seconds a closing session waits for its cancelled turns to unwind
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.offload_after = offload_after
+        self.max_queued_turns = max_queued_turns
+        self.cancel_timeout = cancel_timeout
+        self.sessions: dict[str, Session] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._reaper: asyncio.Task | None = None
+
+    def _ensure_reaper(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        if self._reaper is None or self._reaper.done():
+            self._reaper = self.loop.create_task(self._reap_forever())
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.evict_idle()
+                self.offload_idle()
+            except Exception as e:
+                print(f"Error during session eviction: {e}")
+
+    async def get(self, session_id: str) -> Session:
+        """Return the session for `session_id`, creating it if needed"""
+        self._ensure_reaper()
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                await self.evict_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise SessionLimitError(
+                    f"Server is at capacity ({self.max_sessions} active sessions), please try again later."
+                )
+            session = Session(session_id=session_id, app=self.factory())
+            self.sessions[session_id] = session
+        session.touch()
+        return session
+
+    @asynccontextmanager
+    async def turn(self, session: Session):
+        """
+        Run one turn of `session`. Turns of a session run one at a time in arrival order, and at
+        most `max_queued_turns` wait behind the running one. The turn's task is tracked so closing
+        the session cancels it, which aborts its model request and tool calls.
+        """
+        if session.lock.locked() and session.waiting >= self.max_queued_turns:
+            raise TurnQueueFullError(
+                "Your previous messages are still being answered, please wait for them to finish."
+            )
+        task = asyncio.current_task()
+        session.turn_tasks.add(task)
+        try:
+            session.waiting += 1
+            try:
+                await session.lock.acquire()
+            finally:
+                session.waiting -= 1
+            try:
+                yield session
+            finally:
+                session.touch()
+                session.lock.release()
+        finally:
+            session.turn_tasks.discard(task)
+
+    async def cancel_turns(self, session: Session) -> int:
+        """Cancel the running and queued turns of a session, waiting up to `cancel_timeout` for them to stop"""
+        tasks = [task for task in session.turn_tasks if not task.done() and task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.cancel_timeout)
+            if pending:
+                print(f"{len(pending)} turn(s) of session {session.session_id} still running after cancellation")
+        return len(tasks)
+
+    async def close(self, session_id: str):
+        """Close a session, cancelling its turns, and release its agent"""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        await self.cancel_turns(session)
+        try:
+            await session.app.cleanup()
+        except Exception as e:
+            print(f"Error closing session {session_id}: {e}")
+
+    async def evict_idle(self) -> int:
+        """Close every session idle for longer than `idle_timeout`, returns the number evicted"""
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, session in self.sessions.items()
+            if session.idle_for(now) > self.idle_timeout and not session.lock.locked()
+        ]
+        for session_id in expired:
+            await self.close(session_id)
+        return len(expired)
+
+    def offload_idle(self) -> int:
+        """Offload the memory of every session idle for longer than `offload_after`, returns the number offloaded"""
+        if not self.offload_after:
+            return 0
+        now = time.monotonic()
+        offloaded = 0
+        for session in self.sessions.values():
+            if session.idle_for(now) > self.offload_after and not session.lock.locked():
+                if session.app.offload():
+                    offloaded += 1
+        return offloaded
+
+    async def close_all(self):
+        """Close every live session"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for session_id in list(self.sessions):
+            await self.close(session_id)
+
+    def run_blocking(self, coro_fn: Callable[[], Any] = None, timeout: float = 10):
+        """
+        Run `coro_fn()` (defaults to `close_all`) on the sessions' event loop from outside it,
+        e.g. from a signal or atexit handler.
+        """
+        if self.loop is None or self.loop.is_closed():
+            return
+        coro = (coro_fn or self.close_all)()
+        if self.loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+            return future.result(timeout=timeout)
+        return self.loop.run_until_complete(coro)
@@ -1,10 +1,24 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+# Eager on purpose: any pydantic_ai submodule (messages below) runs the package __init__, which
+# imports pydantic_ai.agent, so deferring Agent wouldn't save anything (~0.45 s either way)
 from pydantic_ai import Agent
 
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
-from pydantic_ai.mcp import MCPServerStreamableHTTP, MCPServerSSE, MCPServerStdio
+from src.mcp_agent.pool import MCPServerPool, default_pool, server_class
+from src.mcp_agent.models import Model_router, Routed_model, default_router
+from src.mcp_agent.history import History_policy, estimate_tokens
+from src.mcp_agent.prompt import Prompt_assembler
+from src.mcp_agent.tracing import Tracer, Traced_model, default_tracer
+from src.mcp_agent.store import Persisted_history
+from src.mcp_agent.rate_limits import rate_limit_owner
+from src.mcp_agent.tool_calls import tool_call_scope
+from src.mcp_agent.response_cache import Response_cache
+from src.mcp_agent.tool_results import Tool_result_offloader, default_result_store, read_tool_result_tool
+from src.mcp_agent.tool_selection import Tool_selector
 from dataclasses import dataclass
 from datetime import datetime
 from pydantic import Field
@@ -13,8 +27,19 @@ import os
 from pathlib import Path
 from pydantic_ai.messages import (
     ModelMessage,
-
+    ModelRequest,
+    ModelResponse,
+    PartStartEvent,
+    PartDeltaEvent,
+    TextPart,
+    TextPartDelta,
+    FunctionToolCallEvent,
+    FunctionToolResultEvent,
+    SystemPromptPart,
+    UserPromptPart,
 )
+from pydantic_ai.usage import Usage
+from typing import AsyncIterator
 
 
 
@@ -29,11 +54,76 @@ class Message_state:
     messages: list[ModelMessage]
 
 
-    
-    
+# Status of a connected server whose connection dropped, until the pool reconnects it
+DEGRADED = 'degraded: connection lost, reconnecting'
+
+
+@dataclass
+class Stream_event:
+    """
+    An incremental event yielded by `MCP_Agent.chat_stream`
+
+    type is one of:
+        'text': content is a text delta of the final answer
+        'tool_call': the model called tool_name, content holds the arguments
+        'tool_result': tool_name returned, content holds its (stringified) result
+    """
+    type: str
+    content: str
+    tool_name: str | None = None
+
+
+class Agent_template:
+    """
+    Session-independent parts of an `MCP_Agent`, built once per process and shared by every agent
+    created from it: the instructions, the model router and settings, the model of each API key
+    (with its provider and HTTP client) and the tool schemas. Agents built from a template only
+    create their per-session state.
+    """
+
+    def __init__(self, instructions: str = None, model_router: Model_router = None, model_settings: dict = None,
+                 tool_selector: Tool_selector = None, max_models: int = 256):
+        """
+        Args:
+            instructions (str, optional): Instructions of the agents
+            model_router (Model_router, optional): Models the requests are routed to, defaults to gpt-4.1-mini
+            model_settings (dict, optional): Settings of every model request
+            tool_selector (Tool_selector, optional): Offers only the tools relevant to each turn
+            max_models (int): Number of API keys whose model is kept, least recently used first out
+        """
+        self.instructions = instructions
+        self.model_router = model_router if model_router is not None else default_router
+        self.model_settings = model_settings
+        self.tool_selector = tool_selector
+        self.max_models = max_models
+        self.tools = [read_tool_result_tool()]
+        self._models: OrderedDict[str | None, Routed_model] = OrderedDict()
+
+    def model_for(self, api_key: str | None) -> Routed_model:
+        """Model of an API key, shared by every agent of the template using that key"""
+        model = self._models.get(api_key)
+        if model is None:
+            model = self._models[api_key] = self.model_router.model_for(api_key)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        self._models.move_to_end(api_key)
+        return model
+
+    def warm(self, api_key: str | None = None):
+        """
+        Do the one-off work of the first agent ahead of time: import the model and MCP SDKs and
+        create the providers and clients of every endpoint. Blocking, run it off the event loop.
+        """
+        model = self.model_for(api_key)
+        for endpoint in self.model_router.endpoints:
+            model.model_of(endpoint)
+        for transport in ('stdio', 'SSE', 'http'):
+            server_class(transport)
+
+
 class MCP_Agent:
    
-    def __init__(self, api_keys:dict, mpc_server_urls:list = [], mpc_stdio_commands:list = [], instructions:str = None):
+    def __init__(self, api_keys:dict, mpc_server_urls:list = [], mpc_stdio_commands:list = [], instructions:str = None, pool:MCPServerPool = None, history_policy:History_policy = None, prompt_assembler:Prompt_assembler = None, tracer:Tracer = None, store = None, session_id:str = None, response_cache:Response_cache = None, model_router:Model_router = None, model_settings:dict = None, tool_results:Tool_result_offloader = None, tool_selector:Tool_selector = None, template:Agent_template = None):
         """
         Args:
             
@@ -47,6 +137,9 @@ class MCP_Agent:
                   'name': 'mcp_server_1',
                   'type': 'http','SSE'
                   'headers': {'Authorization': 'Bearer', '1234567890'} #optional or None
+                  'lazy': True #optional, connect in the background instead of waiting for it
+                  'connect_timeout': 10 #optional, overrides the pool's connect timeout
+                  'tool_prefix': 'search' #optional, tools are offered as search_<tool>
                 }
               ]
             mpc_stdio_commands (list): The list of commands to use with the stdio mpc server
@@ -61,12 +154,42 @@ class MCP_Agent:
             
             instructions (str, optional): Instructions for the agent. If not provided, 
                                           defaults to the instructions in the config.json file.
+            pool (MCPServerPool, optional): Connection pool the MCP servers are shared through.
+                                            Defaults to the process-wide pool, so agents with the same
+                                            server config reuse one live connection.
+            history_policy (History_policy, optional): Keeps the conversation memory within a token budget
+                                                       (sliding window, tool return truncation, optional
+                                                       summarization). Defaults to `History_policy()`.
+            prompt_assembler (Prompt_assembler, optional): Adds volatile context such as the current time
+                                                           as a single trailing slot of each request, so the
+                                                           system prompt and earlier turns stay byte-stable
+                                                           for provider prompt caching.
+            tracer (Tracer, optional): Records turns and model requests as spans. Defaults to the
+                                       process-wide tracer, which is a no-op until a sink is added.
+            store (optional): Session store (e.g. `Sqlite_session_store`) the memory is persisted to after
+                              each turn, appending only the new messages. Requires `session_id`.
+            session_id (str, optional): Key of the conversation in the store, resumed on the first turn
+            response_cache (Response_cache, optional): Answers repeated tool-free questions without a model
+                                                       round trip, usually shared by every agent of the process
+            model_router (Model_router, optional): Models or endpoints the requests are routed to, with fallback.
+                                                   Defaults to gpt-4.1-mini on OpenAI with `openai_api_key`.
+            model_settings (dict, optional): Settings of every model request, e.g. {'temperature': 0.7, 'max_tokens': 1000}
+            tool_results (Tool_result_offloader, optional): Moves MCP tool results over its size budget out of the
+                                                            conversation, the model reading slices back with the
+                                                            `read_tool_result` tool. Defaults to an 8000 byte budget
+                                                            in the process-wide in-memory result store.
+            tool_selector (Tool_selector, optional): Offers the model only the tools relevant to each turn
+                                                     instead of the schema of every tool of every server
+            template (Agent_template, optional): Shared instructions, model router, model settings, tool selector
+                                                 and models the agent is created from, so building it is cheap.
+                                                 Explicit arguments take precedence.
 
             
         """
         
         # Load configuration
-        self.instructions = instructions
+        self.template = template
+        self.instructions = instructions if instructions is not None or template is None else template.instructions
         
         self.api_keys=Api_keys(api_keys=api_keys)
         
@@ -76,47 +199,208 @@ class MCP_Agent:
     
         
         # tools
-        self.llms={'mcp_llm':OpenAIModel('gpt-4.1-mini',provider=OpenAIProvider(api_key=self.api_keys.api_keys['openai_api_key']))}
+        if template is not None:
+            model_router = model_router if model_router is not None else template.model_router
+            model_settings = model_settings if model_settings is not None else template.model_settings
+            tool_selector = tool_selector if tool_selector is not None else template.tool_selector
+        self.model_router = model_router if model_router is not None else default_router
+        self.model_settings = model_settings
+        self.tool_selector = tool_selector
+        openai_api_key = self.api_keys.api_keys.get('openai_api_key')
+        if template is not None and self.model_router is template.model_router:
+            self.llms={'mcp_llm':template.model_for(openai_api_key)}
+        else:
+            self.llms={'mcp_llm':self.model_router.model_for(openai_api_key)}
         
         
-        #mpc servers
-        self.mpc_servers=[]
-        for mpc_server_url in self.mpc_server_urls:
-            if mpc_server_url['type'] == 'http':
-                if mpc_server_url['headers'] is not None:
-                    self.mpc_servers.append(MCPServerStreamableHTTP(url=mpc_server_url['url'], headers=mpc_server_url['headers']))
-                else:
-                    self.mpc_servers.append(MCPServerStreamableHTTP(mpc_server_url['url']))
-            elif mpc_server_url['type'] == 'SSE':
-                if mpc_server_url['headers'] is not None:
-                    self.mpc_servers.append(MCPServerSSE(url=mpc_server_url['url'], headers=mpc_server_url['headers']))
-                else:
-                    self.mpc_servers.append(MCPServerSSE(mpc_server_url['url']))
-        for mpc_stdio_command in self.mpc_stdio_commands:
-            self.mpc_servers.append(MCPServerStdio(command=mpc_stdio_command['command'], args=mpc_stdio_command['args']))
-
-        self._mcp_context_manager = None
+        #mpc servers, shared with every other agent using the same config
+        self.pool = pool if pool is not None else default_pool
+        self.mpc_servers, self.server_names, self._lazy_servers = self._servers_of(self.mpc_server_urls + self.mpc_stdio_commands)
+
+        # Servers the model is offered tools from, filled in place as their connections come up,
+        # so a slow or unreachable server never blocks or breaks a run
+        self.active_servers = []
+        self.server_errors = {}
+        self._connected_servers = []
+        # Background connect task of each server that is retried or lazily connected, by id
+        self._background_connects = {}
         self._is_connected = False
         #agent
 
-        self.agent=Agent(self.llms['mcp_llm'],tools=[], mcp_servers=self.mpc_servers, instructions=self.instructions)
+        self.history_policy = history_policy if history_policy is not None else History_policy()
+        self.prompt_assembler = prompt_assembler if prompt_assembler is not None else Prompt_assembler()
+        self.tracer = tracer if tracer is not None else default_tracer
+        self.tool_results = tool_results if tool_results is not None else Tool_result_offloader(default_result_store)
+        # `read_tool_result` is only offered once a result was stored out of band; its schema is shared
+        tools = template.tools if template is not None else [read_tool_result_tool()]
+        # The instructions are a static system prompt stored once at the head of the history, so every
+        # request starts with the same bytes; the trailing context slot is added last
+        self.agent=Agent(Traced_model(self.llms['mcp_llm'], self.tracer),tools=tools, mcp_servers=self.active_servers,
+                         system_prompt=self.instructions or (), model_settings=self.model_settings,
+                         prepare_tools=self.tool_selector,
+                         history_processors=[self.history_policy.apply_window, self.prompt_assembler.append_context])
         self.memory=Message_state(messages=[])
+        self.last_usage=None
+        self.history_store = Persisted_history(store, session_id) if store is not None else None
+        self.response_cache = response_cache
+        # Unit of fair queueing of the model requests when they are rate limited
+        self.owner = session_id or f"agent-{id(self):x}"
+        self._memory_loaded = self.history_store is None
         
     
     async def connect(self):
-        """Establish persistent connection to MCP server"""
+        """
+        Connect the MCP servers concurrently, each bounded by the pool's connect timeout.
+
+        Only the servers that are not `lazy` are waited for. A server that fails to connect is
+        recorded in `server_errors` and retried in the background with backoff instead of failing
+        the agent, and lazy servers connect in the background from the start. Tools of a server
+        are offered to the model once it is connected.
+        """
         if not self._is_connected:
-            self._mcp_context_manager = self.agent.run_mcp_servers()
-            await self._mcp_context_manager.__aenter__()
             self._is_connected = True
-            return "Connected to MCP server"
+            await self._connect_servers(self.mpc_servers)
+            return f"Connected to {len(self._connected_servers)}/{len(self.mpc_servers)} MCP server(s)"
 
-    async def disconnect(self):
-        """Close the MCP server connection"""
-        if self._is_connected and self._mcp_context_manager:
-            await self._mcp_context_manager.__aexit__(None, None, None)
+    def _servers_of(self, configs:list) -> tuple[list, dict, list]:
+        """(servers, names by server id, lazy servers) of a list of server configs, from the pool"""
+        servers, names, lazy = [], {}, []
+        for config in configs:
+            server = self.pool.server_for(config)
+            if not any(server is existing for existing in servers):
+                servers.append(server)
+                names[id(server)] = config.get('name') or self.pool.label_of(server)
+                if config.get('lazy'):
+                    lazy.append(server)
+        return servers, names, lazy
+
+    async def _connect_servers(self, servers:list):
+        required = [server for server in servers if not any(server is lazy for lazy in self._lazy_servers)]
+        try:
+            results = await asyncio.gather(*(self._connect_server(server) for server in required),
+                                           return_exceptions=True)
+        except BaseException:
+            await self.disconnect(force=True)
+            raise
+        for server, result in zip(required, results):
+            if isinstance(result, BaseException):
+                self._connect_in_background(server, failed=True)
+        for server in servers:
+            if any(server is lazy for lazy in self._lazy_servers):
+                self._connect_in_background(server)
+
+    async def update_servers(self, mpc_server_urls:list = None, mpc_stdio_commands:list = None) -> dict:
+        """
+        Switch the agent to a new set of MCP servers without rebuilding it or reconnecting the
+        servers it keeps. Servers in both sets keep their connection and cached tool listing, added
+        servers are connected as by `connect` (if the agent is connected), and removed servers are
+        released; their connection is closed unless another agent still uses it.
+
+        Args:
+            mpc_server_urls (list, optional): The new url servers, None to keep the current ones
+            mpc_stdio_commands (list, optional): The new stdio servers, None to keep the current ones
+
+        Returns:
+            dict: Names of the 'added' and 'removed' servers, and the number of 'unchanged' ones
+        """
+        if mpc_server_urls is not None:
+            self.mpc_server_urls = mpc_server_urls
+        if mpc_stdio_commands is not None:
+            self.mpc_stdio_commands = mpc_stdio_commands
+        servers, names, lazy = self._servers_of(self.mpc_server_urls + self.mpc_stdio_commands)
+        added = [server for server in servers if not any(server is old for old in self.mpc_servers)]
+        removed = [server for server in self.mpc_servers if not any(server is new for new in servers)]
+        changes = {'added': [names[id(server)] for server in added],
+                   'removed': [self.server_names[id(server)] for server in removed],
+                   'unchanged': len(servers) - len(added)}
+
+        for server in removed:
+            task = self._background_connects.pop(id(server), None)
+            if task is not None:
+                task.cancel()
+            self.server_errors.pop(self.server_names[id(server)], None)
+        self.mpc_servers, self.server_names, self._lazy_servers = servers, names, lazy
+        self.active_servers[:] = [s for s in servers if any(s is c for c in self._connected_servers)]
+        for server in removed:
+            if any(server is connected for connected in self._connected_servers):
+                self._connected_servers[:] = [c for c in self._connected_servers if c is not server]
+                await self.pool.release(server)
+            await self.pool.close_unreferenced(server)
+        if self._is_connected and added:
+            await self._connect_servers(added)
+        return changes
+
+    async def _connect_server(self, server):
+        name = self.server_names[id(server)]
+        try:
+            await self.pool.acquire(server)
+        except Exception as e:
+            self.server_errors[name] = f"{type(e).__name__}: {e}"
+            raise
+        if not self._is_connected or not any(server is s for s in self.mpc_servers):
+            # Disconnected, or the server removed, while it was connecting
+            await self.pool.release(server)
+            return
+        self.server_errors.pop(name, None)
+        self._connected_servers.append(server)
+        # Keep the configured order so the tool list, part of every request prefix, stays stable
+        self.active_servers[:] = [s for s in self.mpc_servers if any(s is c for c in self._connected_servers)]
+
+    def _refresh_active_servers(self):
+        """
+        Offer the tools of the servers whose pooled connection is up. A connection that dropped is
+        marked degraded in `server_errors` and left out until the pool's health check reconnects it.
+        """
+        for server in self._connected_servers:
+            name = self.server_names[id(server)]
+            if server.connected:
+                if self.server_errors.get(name) == DEGRADED:
+                    del self.server_errors[name]
+            else:
+                self.server_errors[name] = DEGRADED
+        self.active_servers[:] = [s for s in self.mpc_servers
+                                  if any(s is c for c in self._connected_servers) and s.connected]
+
+    def _connect_in_background(self, server, failed:bool = False):
+        async def keep_trying(failed):
+            while self._is_connected:
+                delay = self.pool.retry_in(server)
+                await asyncio.sleep(max(delay, self.pool.retry_backoff) if failed else delay)
+                try:
+                    await self._connect_server(server)
+                    return
+                except Exception:
+                    failed = True
+
+        def forget(task):
+            if self._background_connects.get(id(server)) is task:
+                del self._background_connects[id(server)]
+        task = asyncio.get_running_loop().create_task(keep_trying(failed))
+        task.add_done_callback(forget)
+        self._background_connects[id(server)] = task
+
+    def server_status(self) -> dict:
+        """'connected', 'connecting', degraded or the last connect error of each MCP server, by name"""
+        status = {}
+        for server in self.mpc_servers:
+            name = self.server_names[id(server)]
+            if any(server is connected for connected in self._connected_servers) and server.connected:
+                status[name] = 'connected'
+            else:
+                status[name] = self.server_errors.get(name, 'connecting')
+        return status
+
+    async def disconnect(self, force:bool = False):
+        """Release the MCP server connections back to the pool"""
+        if self._is_connected or force:
             self._is_connected = False
-            self._mcp_context_manager = None
+            while self._background_connects:
+                self._background_connects.popitem()[1].cancel()
+            self.active_servers.clear()
+            self.server_errors.clear()
+            while self._connected_servers:
+                await self.pool.release(self._connected_servers.pop())
+            self.tool_results.clear()
             return "Disconnected from MCP server"
     async def chat(self, query:any):
         """
@@ -130,16 +414,153 @@ class MCP_Agent:
         
         agent.memory.messages
         ```
+        The token usage of the last turn is kept in `agent.last_usage`.
+        Cancelling the calling task aborts the model request and the tool calls in flight
+        and leaves the memory as it was.
         """
         if not self._is_connected:
             await self.connect()
-            
-        result=await self.agent.run(query, message_history=self.memory.messages)
-        self.memory.messages=result.all_messages()
+
+        self._refresh_active_servers()
+        await self.resume()
+        with self._turn_span(query, stream=False) as span, tool_call_scope(), rate_limit_owner(self.owner):
+            context, cached = self._cached_answer(query, span)
+            if cached is not None:
+                await self._remember_cached(query, cached, span)
+                return cached
+            result=await self.agent.run(query, message_history=self.memory.messages, deps=self)
+            self.last_usage=result.usage()
+            self._cache_answer(query, context, result.new_messages(), result.output)
+            await self._remember(result.all_messages(), span)
         return result.output
+
+    async def chat_stream(self, query:any) -> AsyncIterator[Stream_event]:
+        """
+        Streaming version of `chat`.
+
+        Yields `Stream_event`s as the run progresses: text deltas as the model produces
+        them and tool calls/results as they happen. The memory is updated once the run completes.
+
+        Cancelling the consuming task, or closing the generator (see `contextlib.aclosing`),
+        aborts the model request and the tool calls in flight and leaves the memory as it was.
+
+        ```python
+        async for event in agent.chat_stream('Hello'):
+            if event.type == 'text':
+                print(event.content, end='')
+        ```
+        """
+        if not self._is_connected:
+            await self.connect()
+
+        self._refresh_active_servers()
+        await self.resume()
+        with self._turn_span(query, stream=True) as span, tool_call_scope(), rate_limit_owner(self.owner):
+            context, cached = self._cached_answer(query, span)
+            if cached is not None:
+                yield Stream_event(type='text', content=cached)
+                await self._remember_cached(query, cached, span)
+                return
+            async with self.agent.iter(query, message_history=self.memory.messages, deps=self) as run:
+                async for node in run:
+                    if Agent.is_model_request_node(node):
+                        async with node.stream(run.ctx) as request_stream:
+                            async for event in request_stream:
+                                if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                                    if event.part.content:
+                                        yield Stream_event(type='text', content=event.part.content)
+                                elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                                    if event.delta.content_delta:
+                                        yield Stream_event(type='text', content=event.delta.content_delta)
+                    elif Agent.is_call_tools_node(node):
+                        async with node.stream(run.ctx) as tools_stream:
+                            async for event in tools_stream:
+                                if isinstance(event, FunctionToolCallEvent):
+                                    yield Stream_event(type='tool_call', content=event.part.args_as_json_str(), tool_name=event.part.tool_name)
+                                elif isinstance(event, FunctionToolResultEvent):
+                                    yield Stream_event(type='tool_result', content=str(event.result.content), tool_name=event.result.tool_name)
+            self.last_usage=run.result.usage()
+            self._cache_answer(query, context, run.result.new_messages(), run.result.output)
+            await self._remember(run.result.all_messages(), span)
+
+    def _turn_span(self, query:any, stream:bool):
+        span = self.tracer.span('agent.turn', stream=stream)
+        if span.recording:
+            span.set_attributes(query_chars=len(query) if isinstance(query, str) else None,
+                                history_messages=len(self.memory.messages),
+                                history_tokens=estimate_tokens(self.memory.messages))
+        return span
+
+    def _cached_answer(self, query:any, span) -> tuple[bytes | None, str | None]:
+        """Look the query up in the response cache, returns (context of the turn, cached answer or None)"""
+        if self.response_cache is None or not isinstance(query, str):
+            return None, None
+        # The answer also depends on the model and on the tools it can call, and is only shared between
+        # callers with the same credentials (a hash of them, the keys themselves never reach the cache)
+        credentials = hashlib.sha256(json.dumps(self.api_keys.api_keys, sort_keys=True).encode()).hexdigest()
+        scope = '\x00'.join([credentials, self.llms['mcp_llm'].model_name]
+                            + [self.server_names[id(s)] for s in self.active_servers])
+        context = self.response_cache.context(self.instructions, scope, self.memory.messages,
+                                              self.prompt_assembler.volatile_context())
+        if context is None:
+            span.set_attribute('response_cache', 'bypass')
+            return None, None
+        hit = self.response_cache.get(query, context)
+        span.set_attribute('response_cache', hit[0] if hit else 'miss')
+        return context, hit[1] if hit else None
+
+    def _cache_answer(self, query:any, context:bytes | None, new_messages:list[ModelMessage], output:any):
+        if context is not None:
+            self.response_cache.set(query, context, new_messages, output)
+
+    async def _remember_cached(self, query:str, answer:str, span):
+        """Add a turn answered from the response cache to the memory, as if the model had answered it"""
+        self.last_usage = Usage()
+        messages = list(self.memory.messages)
+        if not messages and self.instructions:
+            messages.append(ModelRequest(parts=[SystemPromptPart(content=self.instructions)]))
+        messages += [ModelRequest(parts=[UserPromptPart(content=query)]),
+                     ModelResponse(parts=[TextPart(content=answer)], model_name=self.llms['mcp_llm'].model_name)]
+        await self._remember(messages, span)
+
+    async def _remember(self, messages:list[ModelMessage], span):
+        """Store the compacted history of a finished run and record its usage on the turn span"""
+        with self.tracer.span('history.compact', messages=len(messages)) as compact_span:
+            self.memory.messages=await self.history_policy.compact(messages)
+            compact_span.set_attribute('kept_messages', len(self.memory.messages))
+        if self.history_store is not None:
+            with self.tracer.span('history.persist'):
+                # A turn cancelled while saving still finishes the save, so the store and its mirror agree
+                await asyncio.shield(self.history_store.sync(self.memory.messages))
+        if span.recording:
+            span.set_attributes(input_tokens=self.last_usage.request_tokens,
+                                output_tokens=self.last_usage.response_tokens,
+                                requests=self.last_usage.requests)
     
     
     
+    def tool_cache_stats(self) -> dict:
+        """
+        Hit/miss counters of the tool listing cache of each MCP server the agent uses.
+
+        Tool listings are cached per pooled connection, so the counters include every agent sharing it.
+        """
+        return {self.pool.label_of(server): server.tools_cache.stats() for server in self.mpc_servers}
+
+    async def resume(self) -> list[ModelMessage]:
+        """Load the stored window of the conversation if it isn't in memory, a no-op without a store"""
+        if not self._memory_loaded:
+            self.memory.messages = await self.history_store.load()
+            self._memory_loaded = True
+        return self.memory.messages
+
+    def offload(self):
+        """Drop the memory of an idle agent from RAM, it is reloaded from the store on the next turn"""
+        if self.history_store is not None and self._memory_loaded:
+            self.memory.messages = []
+            self.history_store.offload()
+            self._memory_loaded = False
+
     def reset(self):
         """
         Resets the Agent to its initial state.
@@ -148,6 +569,10 @@ class MCP_Agent:
             str: A confirmation message indicating that the agent has been reset.
         """
         self.memory.messages=[]
+        self.tool_results.clear()
+        if self.history_store is not None:
+            self.history_store.reset()
+            self._memory_loaded = True
         return f'Agent has been reset'
     
     async def __aenter__(self):
@@ -0,0 +1,178 @@
+"""
+Batch / offline query runner for MCP_Agent.
+
+Reads prompts from a JSONL file (one `{"id": ..., "prompt": ...}` object per line), runs them
+with bounded concurrency over a pool of agents sharing their MCP connections, and appends
+results to a JSONL file as they finish. Items already in the output file are skipped, so a
+killed job resumes where it stopped.
+
+Usage:
+    uv run python -m src.mcp_agent.batch prompts.jsonl results.jsonl --concurrency 8 --servers servers.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+from src.mcp_agent.agent import MCP_Agent
+from src.mcp_agent.pool import default_pool
+
+
+def load_items(input_path: str | Path) -> list[dict]:
+    """Read the prompts, items without an id are numbered by line"""
+    items = []
+    with open(input_path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {'prompt': item}
+            item.setdefault('id', line_number)
+            items.append(item)
+    return items
+
+
+def completed_ids(output_path: str | Path, retry_errors: bool = False) -> set:
+    """Ids already present in the output file (the checkpoint)"""
+    done = set()
+    if not Path(output_path).exists():
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial last line of a killed job
+                continue
+            if retry_errors and record.get('error'):
+                continue
+            done.add(record['id'])
+    return done
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def run_batch(items: Iterable[dict], agent_factory: Callable[[], MCP_Agent], output_path: str | Path,
+                    concurrency: int = 4, retry_errors: bool = False) -> dict:
+    """
+    Run `items` through a pool of `concurrency` agents and stream the results to `output_path`.
+
+    Args:
+        items (iterable): Dicts with an `id` and a `prompt`
+        agent_factory (callable): Builds one agent of the pool, agents created with the same server
+                                  configs share their MCP connections through the connection pool
+        output_path (str): JSONL file results are appended to, also used as the checkpoint
+        concurrency (int): Number of agents, i.e. queries in flight
+        retry_errors (bool): Run again the items whose previous result was an error
+
+    Returns:
+        dict: Throughput and latency report of this run
+    """
+    done = completed_ids(output_path, retry_errors)
+    todo = [item for item in items if item['id'] not in done]
+
+    agents: asyncio.Queue[MCP_Agent] = asyncio.Queue()
+    pool = [agent_factory() for _ in range(max(min(concurrency, len(todo)), 1))]
+    for agent in pool:
+        await agent.connect()
+        agents.put_nowait(agent)
+
+    latencies: list[float] = []
+    tokens = 0
+    errors = 0
+    write_lock = asyncio.Lock()
+    started = time.perf_counter()
+
+    async def run_item(item: dict, output):
+        nonlocal tokens, errors
+        agent = await agents.get()
+        record = {'id': item['id']}
+        begin = time.perf_counter()
+        try:
+            # Items are independent queries, each starts from an empty history
+            agent.reset()
+            record['output'] = str(await agent.chat(item['prompt']))
+            usage = agent.last_usage
+            record['tokens'] = (usage.total_tokens or 0) if usage is not None else 0
+            tokens += record['tokens']
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+            errors += 1
+        finally:
+            agents.put_nowait(agent)
+        record['latency'] = round(time.perf_counter() - begin, 4)
+        latencies.append(record['latency'])
+        async with write_lock:
+            output.write(json.dumps(record, default=str) + '\n')
+            output.flush()
+
+    try:
+        with open(output_path, 'a') as output:
+            await asyncio.gather(*(run_item(item, output) for item in todo))
+    finally:
+        for agent in pool:
+            await agent.disconnect()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'completed': len(todo),
+        'skipped': len(done),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'queries_per_s': round(len(todo) / elapsed, 3) if elapsed else 0.0,
+        'tokens_per_s': round(tokens / elapsed, 3) if elapsed else 0.0,
+        'latency_p50_s': round(percentile(latencies, 50), 4),
+        'latency_p95_s': round(percentile(latencies, 95), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run prompts from a JSONL file through MCP_Agent')
+    parser.add_argument('input', help='JSONL file of {"id": ..., "prompt": ...} objects')
+    parser.add_argument('output', help='JSONL file results are appended to (also the resume checkpoint)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of queries in flight')
+    parser.add_argument('--servers', help='JSON file with "mpc_server_urls" and/or "mpc_stdio_commands" lists')
+    parser.add_argument('--config', default=str(Path(__file__).parent.parent.parent / 'config.json'),
+                        help='config.json to read the agent instructions from')
+    parser.add_argument('--retry-errors', action='store_true', help='Run again items that previously failed')
+    args = parser.parse_args()
+
+    servers = {}
+    if args.servers:
+        with open(args.servers, 'r') as f:
+            servers = json.load(f)
+    instructions = None
+    if Path(args.config).exists():
+        with open(args.config, 'r') as f:
+            instructions = json.load(f).get('agent_config', {}).get('instructions')
+    api_keys = {'openai_api_key': os.environ.get('OPENAI_API_KEY')}
+
+    def agent_factory() -> MCP_Agent:
+        return MCP_Agent(api_keys=api_keys, mpc_server_urls=servers.get('mpc_server_urls', []),
+                         mpc_stdio_commands=servers.get('mpc_stdio_commands', []), instructions=instructions)
+
+    async def run() -> dict:
+        try:
+            return await run_batch(load_items(args.input), agent_factory, args.output,
+                                   args.concurrency, args.retry_errors)
+        finally:
+            await default_pool.close_all()
+
+    report = asyncio.run(run())
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import re
+from typing import Awaitable, Callable
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+# Start of the user prompt carrying the summary of evicted turns
+SUMMARY_PREFIX = 'Summary of the earlier conversation: '
+# End of a tool return cut to `max_tool_return_chars`
+TRUNCATED_MARKER = re.compile(r'\n\.\.\.\[truncated \d+ characters\]$')
+
+
+def _part_chars(part) -> int:
+    if isinstance(part, ToolCallPart):
+        return len(part.tool_name) + len(part.args_as_json_str())
+    if isinstance(part, ToolReturnPart):
+        return len(part.tool_name) + len(part.model_response_str())
+    content = getattr(part, 'content', '')
+    if isinstance(content, str):
+        return len(content)
+    try:
+        return len(json.dumps(content, default=str))
+    except (TypeError, ValueError):
+        return len(str(content))
+
+
+def estimate_tokens(messages: list[ModelMessage]) -> int:
+    """Rough token count of a message list (~4 characters per token), good enough for budgeting"""
+    return sum(_part_chars(part) for message in messages for part in message.parts) // 4 + 4 * len(messages)
+
+
+def split_turns(messages: list[ModelMessage]) -> list[list[ModelMessage]]:
+    """
+    Split a history into turns, each starting at a request that carries a user prompt.
+
+    A turn holds every tool call of the run together with its tool return, so cutting
+    the history on turn boundaries never separates a call from its result.
+    """
+    turns: list[list[ModelMessage]] = []
+    for message in messages:
+        starts_turn = isinstance(message, ModelRequest) and any(
+            isinstance(part, UserPromptPart) for part in message.parts
+        )
+        if starts_turn or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def summary_text(messages: list[ModelMessage]) -> str:
+    """Plain-text transcript of the messages, used as summarizer input"""
+    lines = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, UserPromptPart):
+                lines.append(f"User: {part.content if isinstance(part.content, str) else '[non-text content]'}")
+            elif isinstance(part, TextPart):
+                lines.append(f"Assistant: {part.content}")
+            elif isinstance(part, ToolCallPart):
+                lines.append(f"Tool call {part.tool_name}: {part.args_as_json_str()}")
+            elif isinstance(part, ToolReturnPart):
+                lines.append(f"Tool result {part.tool_name}: {part.model_response_str()}")
+    return '\n'.join(lines)
+
+
+def model_summarizer(model, max_chars: int = 20000) -> Callable[[list[ModelMessage]], Awaitable[str]]:
+    """Build a summarizer that condenses old turns with the given pydantic-ai model"""
+    from pydantic_ai import Agent
+
+    summarizer = Agent(
+        model,
+        instructions='Summarize the conversation below in a few sentences. Keep facts, decisions, '
+                     'names and open questions the assistant will need later. Do not add anything.',
+    )
+
+    async def summarize(messages: list[ModelMessage]) -> str:
+        result = await summarizer.run(summary_text(messages)[-max_chars:])
+        return result.output
+
+    return summarize
+
+
+class History_policy:
+    """
+    Keeps the conversation memory within a token budget.
+
+    - Tool returns bigger than `max_tool_return_chars` are truncated.
+    - A sliding window keeps the most recent turns that fit in `max_tokens`.
+    - Once the stored history exceeds `max_tokens` it is compacted down to `compact_target * max_tokens`,
+      so compaction (and the change of the history head it causes) happens once every few turns.
+    - Older turns are either dropped or, with a `summarizer`, condensed into one message.
+    - `max_session_tokens` is a hard ceiling the stored history never exceeds.
+
+    The cheap part (truncation + window) also runs as a pydantic-ai history processor,
+    so tool loops inside a single run stay within budget too.
+    """
+
+    def __init__(self, max_tokens: int = 16000, max_tool_return_chars: int = 8000,
+                 max_session_tokens: int = 32000, compact_target: float = 0.75,
+                 summarizer: Callable[[list[ModelMessage]], Awaitable[str]] = None,
+                 token_counter: Callable[[list[ModelMessage]], int] = estimate_tokens):
+        """
+        Args:
+            max_tokens (int): Token budget of the sliding window of recent turns
+            max_tool_return_chars (int): Tool returns longer than this are truncated, None to keep them whole
+            max_session_tokens (int): Hard ceiling of the stored history, summary included
+            compact_target (float): Fraction of `max_tokens` the recent turns are cut to when compacting,
+                                    the rest is headroom for the summary and the next turns
+            summarizer (callable, optional): async function turning evicted turns into a summary string,
+                                             see `model_summarizer`. Evicted turns are dropped if not set.
+            token_counter (callable): Function counting the tokens of a message list
+        """
+        self.max_tokens = max_tokens
+        self.max_tool_return_chars = max_tool_return_chars
+        self.max_session_tokens = max_session_tokens
+        self.compact_target = compact_target
+        self.summarizer = summarizer
+        self.token_counter = token_counter
+
+    def truncate_tool_returns(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """
+        Return the messages with oversized tool returns truncated, originals are left untouched.
+        A truncated return fits the limit, so truncating again is a no-op and the history keeps its bytes.
+        """
+        limit = self.max_tool_return_chars
+        if limit is None:
+            return messages
+        result = []
+        for message in messages:
+            if isinstance(message, ModelRequest) and any(self._oversized(part, limit) for part in message.parts):
+                parts = [
+                    dataclasses.replace(part, content=self._truncated(part.model_response_str(),
+                                                                      limit - len(part.tool_name)))
+                    if self._oversized(part, limit) else part
+                    for part in message.parts
+                ]
+                message = dataclasses.replace(message, parts=parts)
+            result.append(message)
+        return result
+
+    @staticmethod
+    def _oversized(part, limit: int) -> bool:
+        return (isinstance(part, ToolReturnPart) and _part_chars(part) > limit
+                and not (isinstance(part.content, str) and TRUNCATED_MARKER.search(part.content)))
+
+    @staticmethod
+    def _truncated(text: str, limit: int) -> str:
+        """The head of `text` and a marker, `limit` characters at most (the marker alone if it doesn't fit)"""
+        # Sized with the digits of the whole length, which the omitted count never exceeds
+        keep = max(limit - len(f"\n...[truncated {len(text)} characters]"), 0)
+        return text[:keep] + f"\n...[truncated {len(text) - keep} characters]"
+
+    def _window(self, turns: list[list[ModelMessage]], budget: int) -> int:
+        """Index of the oldest turn kept so the newest turns fit in `budget` (the last turn is always kept)"""
+        used = 0
+        start = len(turns)
+        while start > 0:
+            cost = self.token_counter(turns[start - 1])
+            if start < len(turns) and used + cost > budget:
+                break
+            used += cost
+            start -= 1
+        return start
+
+    @staticmethod
+    def _with_system_prompts(system_parts: list, messages: list[ModelMessage]) -> list[ModelMessage]:
+        # System prompts only live in the first request, carry them over when it gets cut
+        if not system_parts or not messages:
+            return messages
+        first = messages[0]
+        if isinstance(first, ModelRequest) and any(isinstance(part, SystemPromptPart) for part in first.parts):
+            return messages
+        if isinstance(first, ModelRequest):
+            return [dataclasses.replace(first, parts=system_parts + list(first.parts))] + messages[1:]
+        return [ModelRequest(parts=system_parts)] + messages
+
+    @staticmethod
+    def _system_parts(messages: list[ModelMessage]) -> list:
+        if messages and isinstance(messages[0], ModelRequest):
+            return [part for part in messages[0].parts if isinstance(part, SystemPromptPart)]
+        return []
+
+    def apply_window(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """Truncate tool returns and keep the most recent turns within `max_tokens` (no summarization)"""
+        system_parts = self._system_parts(messages)
+        turns = split_turns(self.truncate_tool_returns(messages))
+        start = self._window(turns, self.max_tokens)
+        return self._with_system_prompts(system_parts, [m for turn in turns[start:] for m in turn])
+
+    def __call__(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """pydantic-ai history processor"""
+        return self.apply_window(messages)
+
+    async def compact(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """
+        Compact the stored history after a turn: truncate, window, optionally summarize
+        the evicted turns, then enforce the hard `max_session_tokens` ceiling.
+        Nothing is evicted until the history exceeds `max_tokens`, it is then cut to the low-water mark.
+        """
+        system_parts = self._system_parts(messages)
+        messages = self.truncate_tool_returns(messages)
+        if self.token_counter(messages) <= self.max_tokens:
+            return messages
+
+        turns = split_turns(messages)
+        start = self._window(turns, int(self.max_tokens * self.compact_target))
+        kept = [m for turn in turns[start:] for m in turn]
+        evicted = [m for turn in turns[:start] for m in turn]
+
+        if self.summarizer is not None and evicted:
+            try:
+                summary = await self.summarizer(evicted)
+                kept = [ModelRequest(parts=[UserPromptPart(
+                    content=f"{SUMMARY_PREFIX}{summary}"
+                )]), ModelResponse(parts=[TextPart(content='Understood.')])] + kept
+            except Exception as e:
+                print(f"Error summarizing history: {e}")
+
+        kept = self._with_system_prompts(system_parts, kept)
+        # Hard ceiling: drop the oldest turns (summary first) until the history fits
+        turns = split_turns(kept)
+        start = self._window(turns, self.max_session_tokens)
+        return self._with_system_prompts(system_parts, [m for turn in turns[start:] for m in turn])
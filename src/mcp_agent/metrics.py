@@ -0,0 +1,155 @@
+"""
+Prometheus metrics derived from spans.
+
+`Metrics_sink` is a span sink that turns finished spans into latency histograms
+(turns, model requests, tool calls, MCP connects) and token counters, and
+`serve_metrics` exposes them in the Prometheus text format on `/metrics`.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mcp_agent.tracing import Span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Span name -> (histogram name, help text, span attributes used as labels)
+SPAN_HISTOGRAMS = {
+    'agent.turn': ('mcp_agent_turn_seconds', 'Latency of agent turns', ()),
+    'model.request': ('mcp_agent_model_request_seconds', 'Latency of model requests', ('model',)),
+    'tool.call': ('mcp_agent_tool_call_seconds', 'Latency of MCP tool calls', ('server', 'tool')),
+    'mcp.connect': ('mcp_agent_mcp_connect_seconds', 'Latency of MCP server connects', ('server',)),
+}
+
+
+def _label_text(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self.series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, labels: tuple = ()):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, labels: tuple = ()):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_label_text(labels)} {value}" for labels, value in self.series.items())
+        return lines
+
+
+class Metrics_sink:
+    """Span sink aggregating spans into Prometheus histograms and counters"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.histograms = {
+            span_name: Histogram(name, help, buckets) for span_name, (name, help, _) in SPAN_HISTOGRAMS.items()
+        }
+        self.errors = Counter('mcp_agent_errors_total', 'Failed turns, model requests, tool calls and connects')
+        self.cancelled = Counter('mcp_agent_cancelled_total', 'Turns, model requests and tool calls abandoned mid-flight')
+        self.tokens = Counter('mcp_agent_tokens_total', 'Model tokens used by agent turns')
+        self.response_cache = Counter('mcp_agent_response_cache_total', 'Response cache lookups of agent turns')
+        self.tool_selection = Counter('mcp_agent_tool_selection_total', 'Tool selection outcome of agent turns')
+        self.tool_tokens_saved = Counter('mcp_agent_tool_tokens_saved_total',
+                                         'Estimated prompt tokens of tool schemas left out by tool selection')
+        self.rate_limit_wait = Counter('mcp_agent_rate_limit_wait_seconds_total',
+                                       'Seconds model requests were held back by the rate limiter')
+
+    def export(self, span: Span):
+        spec = SPAN_HISTOGRAMS.get(span.name)
+        if spec is None:
+            return
+        labels = tuple((name, str(span.attributes.get(name, ''))) for name in spec[2])
+        with self._lock:
+            self.histograms[span.name].observe(span.duration, labels)
+            if span.status == 'error':
+                self.errors.inc(labels=(('span', span.name),))
+            elif span.status == 'cancelled':
+                self.cancelled.inc(labels=(('span', span.name),))
+            if span.name == 'model.request' and span.attributes.get('rate_limit_wait'):
+                self.rate_limit_wait.inc(span.attributes['rate_limit_wait'], (('model', span.attributes.get('model', '')),))
+            if span.name == 'agent.turn':
+                if 'response_cache' in span.attributes:
+                    self.response_cache.inc(labels=(('result', span.attributes['response_cache']),))
+                if 'tool_selection' in span.attributes:
+                    self.tool_selection.inc(labels=(('result', span.attributes['tool_selection']),))
+                    self.tool_tokens_saved.inc(span.attributes.get('tool_tokens_saved', 0))
+                for kind in ('input', 'output'):
+                    tokens = span.attributes.get(f"{kind}_tokens")
+                    if tokens:
+                        self.tokens.inc(tokens, (('kind', kind),))
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = []
+            for metric in (*self.histograms.values(), self.errors, self.cancelled, self.tokens, self.response_cache,
+                           self.tool_selection, self.tool_tokens_saved, self.rate_limit_wait):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        pass
+
+
+def serve_metrics(sink: Metrics_sink, port: int = 9464, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Serve `sink.render()` on http://host:port/metrics from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = sink.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,406 @@
+"""
+Model pool: several models or OpenAI-compatible endpoints behind one pydantic-ai model.
+
+Each request is routed by a policy (cheapest first, lowest observed latency, or round-robin)
+and falls back to the next endpoint on timeouts, connection errors, 429s and 5xx responses.
+An endpoint answering 429 is cooled down for its `Retry-After` (or `cooldown` seconds). With
+a `Rate_limiter`, requests are held back until they fit the endpoint's rate limits, and a
+request answered 429 anyway is queued again rather than failed.
+Every endpoint shares one tuned `httpx.AsyncClient`, and providers are shared by every agent
+using the same endpoint and API key.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from dataclasses import dataclass, field
+from functools import cache, lru_cache
+from typing import TYPE_CHECKING, AsyncIterator
+
+import httpx
+from pydantic_ai.exceptions import FallbackExceptionGroup, ModelHTTPError
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+from pydantic_ai.settings import ModelSettings
+from pydantic_ai.usage import Usage
+
+from src.mcp_agent.rate_limits import Rate_grant, Rate_limiter, observe_rate_limit_headers
+from src.mcp_agent.tracing import current_span
+
+if TYPE_CHECKING:
+    # The OpenAI SDK is only imported once a model is first used, it is slow to import
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+POLICIES = ('cheapest', 'latency', 'round_robin')
+
+# Statuses worth trying another endpoint for: the request may succeed elsewhere
+FALLBACK_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+@cache
+def _http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(600, connect=5),
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=90),
+        event_hooks={'response': [observe_rate_limit_headers]},
+    )
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    """Process-wide HTTP client of the model endpoints, keeping connections alive across agents and turns"""
+    client = _http_client()
+    if client.is_closed:
+        _http_client.cache_clear()
+        client = _http_client()
+    return client
+
+
+@lru_cache(maxsize=256)
+def provider_for(base_url: str | None, api_key: str | None, max_retries: int = 2) -> OpenAIProvider:
+    """Provider of an endpoint and API key, shared by every agent using them"""
+    import openai
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    return OpenAIProvider(openai_client=openai.AsyncOpenAI(
+        base_url=base_url, api_key=api_key or 'api-key-not-set', http_client=shared_http_client(),
+        max_retries=max_retries,
+    ))
+
+
+@dataclass
+class Model_endpoint:
+    """One model on one OpenAI-compatible endpoint, with the routing stats observed for it"""
+    name: str
+    model: str
+    base_url: str | None = None
+    api_key: str | None = None
+    api_key_env: str | None = None
+    cost: float = 0.0
+    settings: dict = field(default_factory=dict)
+    rpm: float | None = None
+    tpm: float | None = None
+    latency: float | None = None
+    cooldown_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    last_error: str | None = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> Model_endpoint:
+        """
+        Args:
+            config (dict): e.g. {'name': 'local', 'model': 'llama3.1', 'base_url': 'http://localhost:11434/v1',
+                                 'api_key_env': 'OLLAMA_API_KEY', 'cost': 0, 'settings': {'temperature': 0.2}},
+                          with optional 'rpm' and 'tpm' limits for providers not sending rate-limit headers
+        """
+        return cls(name=config.get('name') or config['model'], model=config['model'],
+                   base_url=config.get('base_url'), api_key=config.get('api_key'),
+                   api_key_env=config.get('api_key_env'), cost=config.get('cost', 0.0),
+                   settings=config.get('settings') or {}, rpm=config.get('rpm'), tpm=config.get('tpm'))
+
+    def key(self, default_api_key: str | None) -> str | None:
+        """API key of the endpoint: its own, the one in its environment variable, or the agent's for OpenAI"""
+        if self.api_key:
+            return self.api_key
+        if self.api_key_env:
+            return os.environ.get(self.api_key_env)
+        return default_api_key if self.base_url is None else None
+
+
+class Model_router:
+    """
+    Process-wide routing policy and stats of a set of model endpoints.
+
+    `model_for(api_key)` returns the pydantic-ai model an agent runs with; every agent shares
+    the router, so latency and rate-limit observations of one benefit all.
+    """
+
+    def __init__(self, endpoints: list[Model_endpoint | dict], policy: str = 'cheapest', request_timeout: float = 120,
+                 cooldown: float = 30, latency_smoothing: float = 0.3, max_retries: int = None,
+                 rate_limiter: Rate_limiter = None):
+        """
+        Args:
+            endpoints (list): `Model_endpoint`s or their config dicts, in order of preference on ties
+            policy (str): 'cheapest' (lowest `cost` first), 'latency' (lowest observed latency first,
+                          untried endpoints first) or 'round_robin'
+            request_timeout (float): Seconds before a request (or the first chunk of a streamed one)
+                                     is abandoned and the next endpoint tried
+            cooldown (float): Seconds an endpoint is skipped after a 429 without `Retry-After`,
+                              or after a timeout or connection error
+            latency_smoothing (float): Weight of the newest sample in the latency moving average
+            max_retries (int, optional): Retries of the OpenAI client on the same endpoint, defaults
+                                         to 0 when there are endpoints to fall back to or a rate
+                                         limiter to queue the retries, and 2 otherwise
+            rate_limiter (Rate_limiter, optional): Scheduler holding requests back until they fit the
+                                                   rate limits of their endpoint
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.endpoints = [e if isinstance(e, Model_endpoint) else Model_endpoint.from_config(e) for e in endpoints]
+        if not self.endpoints:
+            raise ValueError('A model router needs at least one endpoint')
+        self.policy = policy
+        self.request_timeout = request_timeout
+        self.cooldown = cooldown
+        self.latency_smoothing = latency_smoothing
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries if max_retries is not None else (
+            0 if len(self.endpoints) > 1 or rate_limiter is not None else 2)
+        self._turn = itertools.count()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Model_router:
+        """Build the router of the `models` block of config.json"""
+        config = config or {}
+        return cls(config.get('endpoints') or [{'name': 'gpt-4.1-mini', 'model': 'gpt-4.1-mini'}],
+                   policy=config.get('policy', 'cheapest'), request_timeout=config.get('request_timeout', 120),
+                   cooldown=config.get('cooldown', 30), max_retries=config.get('max_retries'),
+                   rate_limiter=Rate_limiter.from_config(config.get('rate_limits')))
+
+    def model_for(self, api_key: str | None = None) -> Routed_model:
+        """The model of an agent, `api_key` being used by the OpenAI endpoints without a key of their own"""
+        return Routed_model(self, api_key)
+
+    def order(self) -> list[Model_endpoint]:
+        """Endpoints in the order the next request tries them, the cooled-down ones last"""
+        if self.policy == 'cheapest':
+            ordered = sorted(self.endpoints, key=lambda e: e.cost)
+        elif self.policy == 'latency':
+            ordered = sorted(self.endpoints, key=lambda e: e.latency or 0.0)
+        else:
+            start = next(self._turn) % len(self.endpoints)
+            ordered = self.endpoints[start:] + self.endpoints[:start]
+        now = time.monotonic()
+        return [e for e in ordered if e.cooldown_until <= now] + sorted(
+            (e for e in ordered if e.cooldown_until > now), key=lambda e: e.cooldown_until)
+
+    def record_success(self, endpoint: Model_endpoint, latency: float):
+        endpoint.requests += 1
+        endpoint.latency = latency if endpoint.latency is None else (
+            self.latency_smoothing * latency + (1 - self.latency_smoothing) * endpoint.latency)
+
+    def record_failure(self, endpoint: Model_endpoint, error: BaseException, retry_after: float = None):
+        endpoint.requests += 1
+        endpoint.failures += 1
+        endpoint.last_error = f"{type(error).__name__}: {error}"
+        endpoint.cooldown_until = time.monotonic() + (retry_after if retry_after is not None else self.cooldown)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {e.name: {'model': e.model, 'requests': e.requests, 'failures': e.failures,
+                         'latency': e.latency, 'cooling_down': max(e.cooldown_until - now, 0),
+                         'last_error': e.last_error} for e in self.endpoints}
+
+
+def should_fall_back(error: BaseException) -> bool:
+    """Whether another endpoint may succeed where this one failed"""
+    import openai
+
+    if isinstance(error, ModelHTTPError):
+        return error.status_code in FALLBACK_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, httpx.TransportError))
+
+
+def was_sent(error: BaseException) -> bool:
+    """Whether a failed request may have reached the provider: only errors connecting to it say it didn't"""
+    cause = error
+    while cause is not None:
+        if isinstance(cause, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return False
+        cause = cause.__cause__
+    return True
+
+
+def retry_after(error: BaseException) -> float | None:
+    """Seconds asked for by the `Retry-After` header of a rate-limited response, if any"""
+    response = getattr(error.__cause__, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Routed_model(Model):
+    """pydantic-ai model sending each request to the endpoints of a `Model_router`, in routing order"""
+
+    def __init__(self, router: Model_router, api_key: str | None = None):
+        self.router = router
+        self.api_key = api_key
+        self._models: dict[str, OpenAIModel] = {}
+
+    def model_of(self, endpoint: Model_endpoint) -> OpenAIModel:
+        model = self._models.get(endpoint.name)
+        if model is None:
+            from pydantic_ai.models.openai import OpenAIModel
+
+            provider = provider_for(endpoint.base_url, endpoint.key(self.api_key), self.router.max_retries)
+            model = self._models[endpoint.name] = OpenAIModel(endpoint.model, provider=provider)
+        return model
+
+    @staticmethod
+    def _settings(endpoint: Model_endpoint, model_settings: ModelSettings | None) -> ModelSettings | None:
+        if not endpoint.settings:
+            return model_settings
+        return {**(model_settings or {}), **endpoint.settings}
+
+    def _order(self) -> list[Model_endpoint]:
+        endpoints = self.router.order()
+        limiter = self.router.rate_limiter
+        if limiter is None or len(endpoints) == 1:
+            return endpoints
+        # Endpoints with budget left first, rather than queueing behind an exhausted one
+        return sorted(endpoints, key=lambda e: limiter.budget(e, e.key(self.api_key)).delay(1) > 0)
+
+    async def _acquire(self, endpoint: Model_endpoint, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                       model_request_parameters: ModelRequestParameters) -> Rate_grant | None:
+        """Wait for the endpoint's rate limits to allow the request, None without a rate limiter"""
+        limiter = self.router.rate_limiter
+        if limiter is None:
+            return None
+        budget = limiter.budget(endpoint, endpoint.key(self.api_key))
+        return await limiter.acquire(budget, limiter.estimate(messages, model_settings, model_request_parameters))
+
+    def _observing(self, grant: Rate_grant | None):
+        return self.router.rate_limiter.observing(grant.budget) if grant is not None else nullcontext()
+
+    def _settle(self, grant: Rate_grant | None, usage: Usage | None, error: BaseException | None = None):
+        """
+        Settle the grant of a request once it's over, however it ended.
+
+        Args:
+            grant (Rate_grant | None): The request's grant, None without a rate limiter
+            usage (Usage | None): The usage of a request that completed, None if it failed or was cancelled
+            error (BaseException | None): The error it failed with, None if it completed or was cancelled
+        """
+        if grant is None:
+            return
+        limiter = self.router.rate_limiter
+        if usage is not None:
+            limiter.settle(grant, (usage.request_tokens or 0) + (usage.response_tokens or 0))
+        elif isinstance(error, ModelHTTPError) and error.status_code == 429:
+            limiter.rate_limited_by(grant, retry_after(error))
+        elif error is not None and not was_sent(error):
+            limiter.settle(grant, None)
+        else:
+            # Timed out, failed or cancelled after it may have reached the provider: the estimate stays taken
+            limiter.abandon(grant)
+
+    def _fall_back(self, endpoint: Model_endpoint, error: BaseException, errors: list[Exception]):
+        if not should_fall_back(error):
+            raise error
+        self.router.record_failure(endpoint, error, retry_after(error))
+        errors.append(error)
+
+    def _queue_again(self, errors: list[Exception], attempt: int) -> bool:
+        """Whether every endpoint answered 429 and the request goes back to the rate limiter's queue"""
+        limiter = self.router.rate_limiter
+        return (limiter is not None and attempt < limiter.retries and bool(errors)
+                and all(isinstance(e, ModelHTTPError) and e.status_code == 429 for e in errors))
+
+    @staticmethod
+    def _all_failed(errors: list[Exception]) -> Exception:
+        # With a single endpoint, surface its own error
+        return errors[0] if len(errors) == 1 else FallbackExceptionGroup('Every model endpoint failed', errors)
+
+    @staticmethod
+    def _record_route(endpoint: Model_endpoint, errors: list[Exception], waited: float):
+        span = current_span()
+        if span.recording:
+            span.set_attributes(model=endpoint.model, endpoint=endpoint.name, fallbacks=len(errors))
+            if waited:
+                span.set_attributes(rate_limit_wait=round(waited, 4))
+
+    async def request(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                      model_request_parameters: ModelRequestParameters) -> ModelResponse:
+        waited = 0.0
+        for attempt in itertools.count():
+            errors: list[Exception] = []
+            for endpoint in self._order():
+                model = self.model_of(endpoint)
+                settings = self._settings(endpoint, model_settings)
+                parameters = model.customize_request_parameters(model_request_parameters)
+                grant = await self._acquire(endpoint, messages, settings, parameters)
+                waited += grant.waited if grant is not None else 0.0
+                start = time.perf_counter()
+                response = error = None
+                try:
+                    with self._observing(grant):
+                        response = await asyncio.wait_for(model.request(messages, settings, parameters),
+                                                          self.router.request_timeout)
+                except Exception as e:
+                    error = e
+                finally:
+                    # Also when cancelled, so the grant doesn't hold the budget (or its probe) until it expires
+                    self._settle(grant, response.usage if response is not None else None, error)
+                if error is not None:
+                    self._fall_back(endpoint, error, errors)
+                    continue
+                self.router.record_success(endpoint, time.perf_counter() - start)
+                self._record_route(endpoint, errors, waited)
+                return response
+            if not self._queue_again(errors, attempt):
+                raise self._all_failed(errors)
+
+    @asynccontextmanager
+    async def request_stream(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                             model_request_parameters: ModelRequestParameters) -> AsyncIterator[StreamedResponse]:
+        waited = 0.0
+        for attempt in itertools.count():
+            errors: list[Exception] = []
+            for endpoint in self._order():
+                model = self.model_of(endpoint)
+                settings = self._settings(endpoint, model_settings)
+                parameters = model.customize_request_parameters(model_request_parameters)
+                grant = await self._acquire(endpoint, messages, settings, parameters)
+                waited += grant.waited if grant is not None else 0.0
+                async with AsyncExitStack() as stack:
+                    start = time.perf_counter()
+                    response = error = None
+                    try:
+                        # Entering the stream waits for its first chunk, so this bounds the time to first token
+                        async with asyncio.timeout(self.router.request_timeout):
+                            with self._observing(grant):
+                                response = await stack.enter_async_context(
+                                    model.request_stream(messages, settings, parameters))
+                    except Exception as e:
+                        error = e
+                    finally:
+                        if response is None:
+                            self._settle(grant, None, error)
+                    if error is not None:
+                        self._fall_back(endpoint, error, errors)
+                        continue
+                    self.router.record_success(endpoint, time.perf_counter() - start)
+                    self._record_route(endpoint, errors, waited)
+                    completed = False
+                    try:
+                        yield response
+                        completed = True
+                    finally:
+                        # The usage of a stream cut short may not be reported yet
+                        usage = response.usage()
+                        self._settle(grant, usage if completed or usage.has_values() else None)
+                    return
+            if not self._queue_again(errors, attempt):
+                raise self._all_failed(errors)
+
+    @property
+    def model_name(self) -> str:
+        return ','.join(endpoint.model for endpoint in self.router.endpoints)
+
+    @property
+    def system(self) -> str:
+        return 'openai'
+
+    @property
+    def base_url(self) -> str | None:
+        return self.router.endpoints[0].base_url
+
+
+# Single gpt-4.1-mini endpoint, the model agents use when none is configured
+default_router = Model_router([Model_endpoint(name='gpt-4.1-mini', model='gpt-4.1-mini')])
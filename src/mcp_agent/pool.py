@@ -0,0 +1,495 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+import weakref
+from dataclasses import dataclass, field
+from functools import cache
+from typing import TYPE_CHECKING
+
+from src.mcp_agent.tool_calls import Tool_call_policy
+from src.mcp_agent.tracing import Tracer, default_tracer
+
+if TYPE_CHECKING:
+    # The MCP SDK and its transports are imported when the first server is built
+    from pydantic_ai.mcp import MCPServer
+    from pydantic_ai.tools import ToolDefinition
+
+
+def server_key(config: dict) -> tuple:
+    """
+    Build the pool key of a server config.
+
+    Url servers are keyed by (type, url, headers) and stdio servers by (command, args), plus the
+    `tool_prefix` their tools are renamed with, if any.
+    """
+    prefix = (config['tool_prefix'],) if config.get('tool_prefix') else ()
+    if 'command' in config:
+        return ('stdio', config['command'], tuple(config.get('args') or ())) + prefix
+    headers = config.get('headers')
+    if isinstance(headers, dict):
+        headers = json.dumps(headers, sort_keys=True)
+    return (config.get('type', 'http'), config['url'], headers) + prefix
+
+
+class Tool_list_cache:
+    """
+    Cached `list_tools` result of one server connection.
+
+    Entries expire after `ttl` seconds, are dropped when the server sends
+    `notifications/tools/list_changed`, and can be invalidated explicitly.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.tools: list[ToolDefinition] | None = None
+        self.fetched_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.tools = None
+
+    def is_fresh(self) -> bool:
+        return self.tools is not None and (self.ttl is None or time.monotonic() - self.fetched_at < self.ttl)
+
+    async def get(self, fetch) -> list[ToolDefinition]:
+        if self.is_fresh():
+            self.hits += 1
+            return list(self.tools)
+        async with self._lock:
+            # Concurrent turns share a single listing call
+            if self.is_fresh():
+                self.hits += 1
+                return list(self.tools)
+            self.misses += 1
+            tools = await fetch()
+            self.tools, self.fetched_at = tools, time.monotonic()
+            return list(tools)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'cached': self.tools is not None}
+
+
+class _Cached_tools_server:
+    """Mixin that serves `list_tools` from a `Tool_list_cache` instead of a round trip per turn"""
+
+    tools_cache: Tool_list_cache
+
+    @property
+    def connected(self) -> bool:
+        return bool(self._running_count)
+
+    @property
+    def is_running(self) -> bool:
+        # pydantic-ai fails the whole run on a server that isn't running. A pooled connection that
+        # drops mid-run instead offers no tools (see list_tools) until the pool reconnects it;
+        # agents leave it out of their next turns in the meantime (`connected` is the real state)
+        return True
+
+    async def list_tools(self) -> list[ToolDefinition]:
+        if not self.connected:
+            return []
+        return await self.tools_cache.get(super().list_tools)
+
+    async def __aenter__(self):
+        opening = self._running_count == 0
+        try:
+            await super().__aenter__()
+        except BaseException:
+            if opening and self._running_count == 0:
+                # pydantic-ai leaves the transport open when the handshake fails, close it in this
+                # task rather than leaving it to the garbage collector in another one
+                await self._exit_stack.aclose()
+            raise
+        if opening:
+            # A new session may expose different tools, and must tell us when they change
+            self.tools_cache.invalidate()
+            self._client._message_handler = self._handle_server_message
+        return self
+
+    async def _handle_server_message(self, message):
+        from mcp import types as mcp_types
+
+        if isinstance(message, mcp_types.ServerNotification) and isinstance(
+            message.root, mcp_types.ToolListChangedNotification
+        ):
+            self.tools_cache.invalidate()
+
+
+@cache
+def server_class(transport: str) -> type:
+    """
+    Caching subclass of the pydantic-ai server of a transport ('stdio', 'SSE' or 'http'),
+    created on first use so importing this module doesn't load the MCP SDK
+    """
+    from pydantic_ai.mcp import MCPServerSSE, MCPServerStdio, MCPServerStreamableHTTP
+
+    base = {'stdio': MCPServerStdio, 'SSE': MCPServerSSE, 'http': MCPServerStreamableHTTP}[transport]
+    return type(f"Cached_{base.__name__}", (_Cached_tools_server, base), {'__module__': __name__})
+
+
+TOOL_CALL_SETTINGS = ('max_concurrency', 'timeout', 'retry_attempts', 'backoff', 'max_backoff', 'idempotent_tools')
+
+
+def build_server(config: dict, tools_ttl: float = 300, tool_call_defaults: dict = None,
+                 result_cache=None, tracer: Tracer = None) -> MCPServer:
+    """
+    Create an (unconnected) MCP server object from a server config, with a tool listing cache
+    and a `Tool_call_policy`. Tool call settings of the config override `tool_call_defaults`.
+    """
+    # Distinguishes same-named tools of different servers, e.g. 'github_search' and 'jira_search'
+    prefix = config.get('tool_prefix') or None
+    if 'command' in config:
+        server = server_class('stdio')(command=config['command'], args=config.get('args') or [], tool_prefix=prefix)
+    elif config.get('type', 'http') == 'SSE':
+        if config.get('headers') is not None:
+            server = server_class('SSE')(url=config['url'], headers=config['headers'], tool_prefix=prefix)
+        else:
+            server = server_class('SSE')(config['url'], tool_prefix=prefix)
+    elif config.get('headers') is not None:
+        server = server_class('http')(url=config['url'], headers=config['headers'], tool_prefix=prefix)
+    else:
+        server = server_class('http')(config['url'], tool_prefix=prefix)
+    server.tools_cache = Tool_list_cache(ttl=tools_ttl)
+    settings = dict(tool_call_defaults or {})
+    settings.update({name: config[name] for name in TOOL_CALL_SETTINGS if config.get(name) is not None})
+    key = server_key(config)
+    server.process_tool_call = Tool_call_policy(**settings, name=server_label(key), cache_scope=server_scope(key),
+                                                result_cache=result_cache, tracer=tracer)
+    return server
+
+
+class ServerUnavailableError(Exception):
+    """Raised when a degraded MCP server is acquired before its next retry is due"""
+
+
+def server_label(key: tuple) -> str:
+    """Readable name of a pool key that leaves out headers, which may hold credentials"""
+    prefix = f" ({key[3]}_)" if len(key) > 3 else ''
+    if key[0] == 'stdio':
+        return ' '.join([key[1], *key[2]]) + prefix
+    return f"{key[0]} {key[1]}{prefix}"
+
+
+def server_scope(key: tuple) -> str:
+    """Identity of a pool key in the tool result cache: its label plus a digest of the whole key, headers included"""
+    digest = hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()[:16]
+    return f"{server_label(key)}#{digest}"
+
+
+@dataclass
+class _Pool_entry:
+    key: tuple
+    server: MCPServer
+    refs: int = 0
+    last_released: float = field(default_factory=time.monotonic)
+    task: asyncio.Task | None = None
+    ready: asyncio.Event | None = None
+    stop: asyncio.Event | None = None
+    error: BaseException | None = None
+    connect_timeout: float | None = None
+    failures: int = 0
+    retry_at: float = 0.0
+    last_error: str | None = None
+
+    @property
+    def is_live(self) -> bool:
+        # Still connecting until ready is set
+        return (self.task is not None and not self.task.done() and self.ready.is_set()
+                and self.error is None)
+
+
+class MCPServerPool:
+    """
+    Process-wide pool of live MCP server connections shared across agents.
+
+    Each connection is owned by a dedicated holder task that enters and exits the server's
+    context, so the transport is opened and closed in the same task no matter which agent
+    acquired or released it. Agents with the same server config share one session, and stdio
+    servers are spawned once per process instead of once per agent.
+    """
+
+    def __init__(self, idle_timeout: float = 300, health_check_interval: float = 60, ping_timeout: float = 5,
+                 tools_ttl: float = 300, tool_call_defaults: dict = None, result_cache=None, tracer: Tracer = None,
+                 connect_timeout: float = 10, retry_backoff: float = 1, max_retry_backoff: float = 60):
+        """
+        Args:
+            idle_timeout (float): Seconds an unreferenced connection is kept open before it is closed
+            health_check_interval (float): Seconds between background pings of live connections
+            ping_timeout (float): Seconds to wait for a ping before a connection is considered dead
+            tools_ttl (float): Seconds a server's tool listing is cached, None to cache until invalidated
+            tool_call_defaults (dict, optional): Default `Tool_call_policy` settings of every server
+                                                 (max_concurrency, timeout, retry_attempts, backoff, max_backoff,
+                                                 idempotent_tools)
+            result_cache (Tool_result_cache, optional): Opt-in tool result memoization shared by every server
+            tracer (Tracer, optional): Records connects, disconnects and tool calls as spans,
+                                       defaults to the process-wide tracer
+            connect_timeout (float): Seconds a server may take to connect, overridden by a
+                                     `connect_timeout` key in its config
+            retry_backoff (float): Delay before a server that failed to connect may be tried again,
+                                   doubled on each consecutive failure
+            max_retry_backoff (float): Upper bound of that delay
+        """
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        self.tools_ttl = tools_ttl
+        self.tool_call_defaults = dict(tool_call_defaults or {})
+        self.result_cache = result_cache
+        self.tracer = tracer if tracer is not None else default_tracer
+        self.connect_timeout = connect_timeout
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.entries: dict[tuple, _Pool_entry] = {}
+        # Servers whose entry was removed once closed and unreferenced, while an agent still holds them
+        self._detached: weakref.WeakValueDictionary[tuple, MCPServer] = weakref.WeakValueDictionary()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._maintenance: asyncio.Task | None = None
+
+    def server_for(self, config: dict) -> MCPServer:
+        """Return the shared server object for a config, creating it if needed (does not connect)"""
+        key = server_key(config)
+        entry = self.entries.get(key)
+        if entry is None:
+            server = self._detached.pop(key, None)
+            if server is None:
+                server = build_server(config, self.tools_ttl, self.tool_call_defaults, self.result_cache, self.tracer)
+                server.pool_key = key
+            entry = self._adopt(server)
+        if config.get('connect_timeout') is not None:
+            entry.connect_timeout = entry.server.pool_connect_timeout = config['connect_timeout']
+        return entry.server
+
+    def _adopt(self, server: MCPServer) -> _Pool_entry:
+        entry = self.entries[server.pool_key] = _Pool_entry(
+            key=server.pool_key, server=server, connect_timeout=getattr(server, 'pool_connect_timeout', None))
+        return entry
+
+    def _forget(self, entry: _Pool_entry):
+        """Remove a closed, unreferenced entry, so the pool doesn't grow with every config it has seen"""
+        # Not if it was acquired again while being closed
+        if entry.refs == 0 and entry.task is None and self.entries.get(entry.key) is entry:
+            del self.entries[entry.key]
+            entry.server.tools_cache.invalidate()
+            # An agent may still hold the server and connect it again, see `_entry_of`
+            self._detached[entry.key] = entry.server
+
+    def _check_loop(self):
+        # Connections are bound to the loop that opened them, start over if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._maintenance = None
+            for entry in self.entries.values():
+                entry.task = entry.ready = entry.stop = entry.error = None
+                entry.server._running_count = 0
+        if self.health_check_interval and (self._maintenance is None or self._maintenance.done()):
+            self._maintenance = loop.create_task(self._maintain_forever())
+
+    async def _hold(self, entry: _Pool_entry):
+        try:
+            async with entry.server:
+                entry.ready.set()
+                await entry.stop.wait()
+        except BaseException as e:
+            # A holder abandoned after a connect timeout must not touch the entry's next attempt
+            if entry.task is asyncio.current_task():
+                # Report the underlying failure rather than the transport's task group, and make sure a
+                # cancelled transport doesn't look like a cancellation to the agent waiting on it
+                error = e
+                while isinstance(error, BaseExceptionGroup) and len(error.exceptions) == 1:
+                    error = error.exceptions[0]
+                entry.error = error if isinstance(error, Exception) else ConnectionError(
+                    f"MCP server {server_label(entry.key)} closed: {error!r}")
+                entry.ready.set()
+            if not isinstance(e, Exception):
+                raise
+
+    async def _start(self, entry: _Pool_entry):
+        with self.tracer.span('mcp.connect', server=server_label(entry.key)):
+            entry.error = None
+            entry.ready = asyncio.Event()
+            entry.stop = asyncio.Event()
+            entry.task = asyncio.get_running_loop().create_task(self._hold(entry))
+            timeout = entry.connect_timeout if entry.connect_timeout is not None else self.connect_timeout
+            try:
+                await asyncio.wait_for(entry.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                entry.task.cancel()
+                entry.error = TimeoutError(f"MCP server {server_label(entry.key)} did not connect within {timeout}s")
+                entry.ready.set()
+            if entry.error is not None:
+                error, entry.task = entry.error, None
+                self._mark_failed(entry, error)
+                raise error
+            entry.failures, entry.last_error = 0, None
+
+    def _mark_failed(self, entry: _Pool_entry, error: BaseException):
+        entry.failures += 1
+        entry.last_error = f"{type(error).__name__}: {error}"
+        delay = min(self.retry_backoff * 2 ** (entry.failures - 1), self.max_retry_backoff)
+        entry.retry_at = time.monotonic() + delay
+
+    async def _stop(self, entry: _Pool_entry):
+        if entry.task is None:
+            return
+        with self.tracer.span('mcp.disconnect', server=server_label(entry.key)) as span:
+            entry.stop.set()
+            try:
+                await entry.task
+            except BaseException as e:
+                span.record_error(e)
+                print(f"Error closing MCP server {server_label(entry.key)}: {e}")
+            entry.task = None
+
+    async def acquire(self, server: MCPServer) -> MCPServer:
+        """Connect the server if it isn't already and take a reference on it"""
+        self._check_loop()
+        entry = self._entry_of(server)
+        if not entry.is_live:
+            if entry.failures and time.monotonic() < entry.retry_at:
+                raise ServerUnavailableError(
+                    f"MCP server {server_label(entry.key)} is degraded ({entry.last_error}), "
+                    f"retrying in {entry.retry_at - time.monotonic():.0f}s"
+                )
+            if entry.ready is not None and entry.task is not None and not entry.ready.is_set():
+                # Another agent is already connecting it
+                await entry.ready.wait()
+                if entry.error is not None:
+                    raise entry.error
+            else:
+                await self._start(entry)
+        entry.refs += 1
+        return entry.server
+
+    async def release(self, server: MCPServer):
+        """Drop a reference, the connection stays open until it has been idle for `idle_timeout`"""
+        entry = self._entry_of(server)
+        entry.refs = max(entry.refs - 1, 0)
+        if entry.refs == 0:
+            entry.last_released = time.monotonic()
+            if not self.idle_timeout:
+                await self._stop(entry)
+                self._forget(entry)
+
+    async def close_unreferenced(self, server: MCPServer) -> bool:
+        """
+        Close a server's connection right away instead of after `idle_timeout` if no agent holds it,
+        e.g. when it was removed from the configuration. Returns whether it was closed.
+        """
+        entry = self._entry_of(server)
+        if entry.refs or (entry.task is not None and not entry.ready.is_set()):
+            # Held, or being connected by an agent about to hold it
+            return False
+        closed = entry.task is not None
+        await self._stop(entry)
+        self._forget(entry)
+        return closed
+
+    def _entry_of(self, server: MCPServer) -> _Pool_entry:
+        key = getattr(server, 'pool_key', None)
+        entry = self.entries.get(key)
+        if entry is not None and entry.server is server:
+            return entry
+        if entry is None and self._detached.get(key) is server:
+            # Its entry was removed while idle, the agent holding it is using it again
+            del self._detached[key]
+            return self._adopt(server)
+        raise KeyError(f"MCP server is not managed by this pool: {server}")
+
+    def label_of(self, server: MCPServer) -> str:
+        return server_label(self._entry_of(server).key)
+
+    def retry_in(self, server: MCPServer) -> float:
+        """Seconds until a degraded server may be tried again, 0 if it may be tried now"""
+        entry = self._entry_of(server)
+        return max(entry.retry_at - time.monotonic(), 0.0) if entry.failures else 0.0
+
+    async def health_check(self) -> dict:
+        """Ping every live connection and reconnect the ones that stopped answering or are still referenced"""
+        status = {}
+        for entry in list(self.entries.values()):
+            if entry.task is not None and not entry.ready.is_set():
+                # Still connecting, bounded by the connect timeout
+                continue
+            if entry.task is None:
+                # Down but still referenced: try again once its retry backoff has passed
+                if entry.refs == 0 or time.monotonic() < entry.retry_at:
+                    continue
+                healthy = False
+            else:
+                healthy = entry.is_live
+            if healthy:
+                try:
+                    await asyncio.wait_for(entry.server._client.send_ping(), self.ping_timeout)
+                except Exception:
+                    healthy = False
+            if not healthy:
+                await self._stop(entry)
+                if entry.refs > 0:
+                    try:
+                        await self._start(entry)
+                        healthy = True
+                    except Exception as e:
+                        print(f"Error reconnecting MCP server {server_label(entry.key)}: {e}")
+            status[server_label(entry.key)] = healthy
+        return status
+
+    async def evict_idle(self) -> int:
+        """Close connections nobody has referenced for longer than `idle_timeout`, and remove their entries"""
+        now = time.monotonic()
+        evicted = 0
+        for entry in list(self.entries.values()):
+            connecting = entry.task is not None and not entry.ready.is_set()
+            if entry.refs == 0 and not connecting and now - entry.last_released > self.idle_timeout:
+                if entry.task is not None:
+                    await self._stop(entry)
+                    evicted += 1
+                self._forget(entry)
+        return evicted
+
+    async def _maintain_forever(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.health_check()
+                await self.evict_idle()
+            except Exception as e:
+                print(f"Error during MCP pool maintenance: {e}")
+
+    async def close_all(self):
+        """Close every connection in the pool"""
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+        for entry in list(self.entries.values()):
+            entry.refs = 0
+            await self._stop(entry)
+            self._forget(entry)
+
+    def invalidate_tools(self, server: MCPServer = None):
+        """Drop the cached tool listing of one server, or of every server"""
+        for entry in self.entries.values():
+            if server is None or entry.server is server:
+                entry.server.tools_cache.invalidate()
+
+    def stats(self) -> dict:
+        """Number of references, liveness and tool cache counters of each pooled connection"""
+        return {
+            server_label(entry.key): {
+                'refs': entry.refs,
+                'live': entry.is_live,
+                'failures': entry.failures,
+                'last_error': entry.last_error,
+                'tools_cache': entry.server.tools_cache.stats(),
+            }
+            for entry in self.entries.values()
+        }
+
+
+# Shared by every MCP_Agent in the process unless one is given explicitly
+default_pool = MCPServerPool()
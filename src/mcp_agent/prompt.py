@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+from datetime import datetime, timezone
+from typing import Callable
+
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+
+class Prompt_assembler:
+    """
+    Builds model requests so providers can reuse their prompt cache across turns.
+
+    The system prompt and every stored turn stay byte-identical from one request to the
+    next. Volatile context (the current time, coarsened to `time_resolution` minutes) is
+    never stored in the history: it is appended at send time as one trailing part of the
+    last request, so at most the tail of the prompt changes between turns.
+    """
+
+    def __init__(self, time_resolution: int = 60, clock: Callable[[], datetime] = None,
+                 extra_context: Callable[[], str | None] = None):
+        """
+        Args:
+            time_resolution (int): Minutes the current time is rounded down to, 0 to leave the time out
+            clock (callable, optional): Returns the current time, defaults to UTC now
+            extra_context (callable, optional): Returns more volatile context for the trailing slot
+        """
+        self.time_resolution = time_resolution
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.extra_context = extra_context
+
+    def volatile_context(self) -> str | None:
+        """Content of the trailing slot"""
+        lines = []
+        if self.time_resolution:
+            now = self.clock()
+            minutes = (now.hour * 60 + now.minute) // self.time_resolution * self.time_resolution
+            now = now.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+            lines.append(f"The current time is {now.strftime('%Y-%m-%d %H:%M %Z').strip()}.")
+        if self.extra_context is not None and (extra := self.extra_context()):
+            lines.append(extra)
+        return '\n'.join(lines) or None
+
+    def append_context(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """pydantic-ai history processor, must run last so nothing follows the trailing slot"""
+        context = self.volatile_context()
+        if not context or not messages or not isinstance(messages[-1], ModelRequest):
+            return messages
+        last = messages[-1]
+        return messages[:-1] + [dataclasses.replace(last, parts=[*last.parts, UserPromptPart(content=context)])]
+
+
+async def check_prefix_stability(agent, queries: list[str]) -> list[float]:
+    """
+    Test harness asserting that the prompt of each request extends the previous one.
+
+    Runs `queries` through an `MCP_Agent` with a stand-in model that records every request,
+    renders the requests with the agent's OpenAI message mapping, and checks that everything
+    but the trailing slot of a request is a byte prefix of the next one.
+
+    Returns the share of each request (after the first) that was a reusable prefix.
+    Raises AssertionError at the first request that breaks the prefix. Note that a history
+    compaction by the agent's `History_policy` legitimately starts a new prefix.
+
+    ```python
+    agent = MCP_Agent(api_keys={'openai_api_key': 'unused'}, instructions='Be brief.')
+    ratios = await check_prefix_stability(agent, ['hi', 'how are you?', 'bye'])
+    ```
+    """
+    from pydantic_ai.models.function import FunctionModel
+
+    from src.mcp_agent.models import Routed_model
+
+    requests: list[list[ModelMessage]] = []
+
+    def record(messages: list[ModelMessage], info) -> ModelResponse:
+        requests.append(list(messages))
+        return ModelResponse(parts=[TextPart(content=f"reply {len(requests)}")])
+
+    mapper = agent.llms['mcp_llm']
+    if isinstance(mapper, Routed_model):
+        mapper = mapper.model_of(mapper.router.endpoints[0])
+    model, agent.agent.model = agent.agent.model, FunctionModel(record)
+    try:
+        for query in queries:
+            await agent.chat(query)
+    finally:
+        agent.agent.model = model
+
+    rendered = []
+    for messages in requests:
+        openai_messages = await mapper._map_messages(messages)
+        rendered.append([json.dumps(m, sort_keys=True, default=str) for m in openai_messages])
+
+    ratios = []
+    for turn, (previous, current) in enumerate(zip(rendered, rendered[1:]), start=1):
+        stable = previous[:-1]
+        if current[:len(stable)] != stable:
+            diverged = next((i for i, (a, b) in enumerate(zip(stable, current)) if a != b), len(current))
+            raise AssertionError(
+                f"request {turn + 1} does not extend request {turn}: first difference at message {diverged}"
+            )
+        ratios.append(sum(map(len, stable)) / max(sum(map(len, current)), 1))
+    return ratios
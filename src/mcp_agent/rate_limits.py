@@ -0,0 +1,360 @@
+"""
+Process-wide scheduling of model requests under the provider's rate limits.
+
+Every (endpoint, API key, model) has a budget of requests and tokens per minute, refilled
+continuously like the provider's own limiter. Its limits are the endpoint's `rpm` and `tpm`,
+or learned from the `x-ratelimit-*` headers of the responses, which also correct what is left.
+A request takes an estimate of its tokens (prompt, tool schemas and the completion it may
+produce) before it is sent, and the estimate is corrected from the usage of the response.
+Requests that don't fit wait in a queue served fairly: the session (owner) served the least
+during the current contention goes first, so one busy session can't starve the others. A 429
+empties the budget until its `Retry-After`, and while the limits of a budget are still unknown
+its first request is sent alone to learn them.
+
+The budgets live in one process. When several processes use the same API keys (see
+`src.gradio_app.serve`), each one takes `1 / processes` of the limits, configured or learned.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterator
+
+import httpx
+from pydantic_ai.messages import ModelMessage
+from pydantic_ai.models import ModelRequestParameters
+from pydantic_ai.settings import ModelSettings
+
+from src.mcp_agent.history import estimate_tokens
+
+if TYPE_CHECKING:
+    from src.mcp_agent.models import Model_endpoint
+
+# Seconds the first request of a budget holds the others back while its limits are learned
+PROBE_TIMEOUT = 10
+# Seconds between checks of a budget whose first request is in flight
+PROBE_POLL = 0.25
+
+# Owner of the model requests of the current agent turn, see `rate_limit_owner`
+_owner: contextvars.ContextVar[str | None] = contextvars.ContextVar('rate_limit_owner', default=None)
+
+# Budget of the request being sent, which the response headers are applied to
+_observed_budget: contextvars.ContextVar[Rate_budget | None] = contextvars.ContextVar('observed_budget', default=None)
+
+
+@contextmanager
+def rate_limit_owner(owner: str) -> Iterator[None]:
+    """Attribute the model requests made in the block to `owner`, the unit of fair queueing"""
+    token = _owner.set(owner)
+    try:
+        yield
+    finally:
+        try:
+            _owner.reset(token)
+        except ValueError:
+            # Exited from another context, e.g. an async generator closed by a different task
+            pass
+
+
+def _header_number(headers: httpx.Headers, name: str) -> float | None:
+    try:
+        return float(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+@dataclass
+class Rate_grant:
+    """Budget taken by one request, settled once its usage is known"""
+    budget: Rate_budget
+    tokens: int
+    waited: float
+
+
+@dataclass
+class _Waiter:
+    owner: str | None
+    tokens: int
+    order: int
+    future: asyncio.Future
+
+
+class Rate_budget:
+    """Requests and tokens per minute of one endpoint, API key and model, with its queue of waiting requests"""
+
+    def __init__(self, rpm: float = None, tpm: float = None, share: float = 1.0):
+        """
+        Args:
+            rpm (float, optional): Requests per minute, learned from the response headers when not set
+            tpm (float, optional): Tokens per minute, learned from the response headers when not set
+            share (float): Fraction of the limits this process may use, the rest is left to the other processes
+        """
+        self.share = share
+        self.rpm = rpm * share if rpm else rpm
+        self.tpm = tpm * share if tpm else tpm
+        self.requests = float(rpm or 0)
+        self.tokens = float(tpm or 0)
+        self.blocked_until = 0.0
+        # Until the limits are known, a single request is sent to learn them from its response
+        self.learned = rpm is not None or tpm is not None
+        self.probing_until = 0.0
+        self.updated = time.monotonic()
+        self.waiters: list[_Waiter] = []
+        self.served: dict[str | None, int] = {}
+        self._timer: asyncio.TimerHandle | None = None
+
+    def _refill(self, now: float):
+        elapsed = max(now - self.updated, 0)
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def delay(self, tokens: int) -> float:
+        """Seconds until a request of `tokens` fits the budget, 0 if it fits now"""
+        now = time.monotonic()
+        self._refill(now)
+        delay = max(self.blocked_until - now, 0)
+        if now < self.probing_until:
+            delay = max(delay, min(self.probing_until - now, PROBE_POLL))
+        if self.rpm and self.requests < 1:
+            delay = max(delay, (1 - self.requests) * 60 / self.rpm)
+        if self.tpm:
+            # A request larger than the whole budget waits for a full one rather than forever
+            needed = min(tokens, self.tpm)
+            if self.tokens < needed:
+                delay = max(delay, (needed - self.tokens) * 60 / self.tpm)
+        return delay
+
+    def take(self, tokens: int):
+        self.requests -= 1
+        self.tokens -= tokens
+        if not self.learned:
+            self.probing_until = time.monotonic() + PROBE_TIMEOUT
+
+    def probed(self):
+        """A response came back: the limits are known (or the provider doesn't send them)"""
+        self.learned = True
+        self.probing_until = 0.0
+        self.dispatch()
+
+    def unprobed(self):
+        """The probe ended without a usable response: the next request learns the limits instead"""
+        self.probing_until = 0.0
+        self.dispatch()
+
+    def refund(self, tokens: float, request: bool = False):
+        """Give back tokens (and the request) taken by an estimate that was too high, or never sent"""
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + tokens)
+        if request and self.rpm:
+            self.requests = min(self.rpm, self.requests + 1)
+        self.dispatch()
+
+    def observe(self, headers: httpx.Headers):
+        """Apply the `x-ratelimit-*` headers of a response: the provider's view wins when it has less left"""
+        limit_requests = _header_number(headers, 'x-ratelimit-limit-requests')
+        limit_tokens = _header_number(headers, 'x-ratelimit-limit-tokens')
+        remaining_requests = _header_number(headers, 'x-ratelimit-remaining-requests')
+        remaining_tokens = _header_number(headers, 'x-ratelimit-remaining-tokens')
+        if limit_requests is None and limit_tokens is None and remaining_requests is None and remaining_tokens is None:
+            return
+        self._refill(time.monotonic())
+        if limit_requests:
+            if self.rpm is None:
+                self.requests = limit_requests * self.share
+            self.rpm = limit_requests * self.share
+        if limit_tokens:
+            if self.tpm is None:
+                self.tokens = limit_tokens * self.share
+            self.tpm = limit_tokens * self.share
+        if remaining_requests is not None:
+            self.requests = min(self.requests, remaining_requests)
+        if remaining_tokens is not None:
+            self.tokens = min(self.tokens, remaining_tokens)
+        self.probed()
+
+    def block(self, seconds: float):
+        """Stop granting requests for `seconds`, after the provider answered 429"""
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.requests = min(self.requests, 0)
+        self.probed()
+
+    def dispatch(self):
+        """Grant the waiting requests that fit, fairest first, and wake up again when the next one will"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.waiters:
+            waiter = min(self.waiters, key=lambda w: (self.served.get(w.owner, 0), w.order))
+            if waiter.future.done():
+                self.waiters.remove(waiter)
+                continue
+            delay = self.delay(waiter.tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self.dispatch)
+                return
+            self.waiters.remove(waiter)
+            self.take(waiter.tokens)
+            self.served[waiter.owner] = self.served.get(waiter.owner, 0) + 1
+            waiter.future.set_result(None)
+        # The contention is over, the next one starts with every owner even
+        self.served.clear()
+
+    def stats(self) -> dict:
+        self._refill(time.monotonic())
+        return {'rpm': self.rpm, 'tpm': self.tpm, 'requests_left': round(self.requests, 1) if self.rpm else None,
+                'tokens_left': round(self.tokens) if self.tpm else None, 'waiting': len(self.waiters),
+                'blocked': round(max(self.blocked_until - time.monotonic(), 0), 3)}
+
+
+class Rate_limiter:
+    """
+    Process-wide scheduler of the model requests of every agent, one `Rate_budget` per
+    endpoint, API key and model.
+    """
+
+    def __init__(self, completion_tokens: int = 512, max_wait: float = 300, retries: int = 3, block: float = 1.0,
+                 processes: int = 1):
+        """
+        Args:
+            completion_tokens (int): Completion tokens counted for a request without `max_tokens`
+            max_wait (float): Seconds a request may wait for its budget before failing
+            retries (int): Times a request answered 429 is queued again instead of failing
+            block (float): Seconds a budget is blocked after a 429 without `Retry-After`
+            processes (int): Processes sharing the API keys, each budget gets `1 / processes` of the limits
+        """
+        self.completion_tokens = completion_tokens
+        self.max_wait = max_wait
+        self.retries = retries
+        self.block = block
+        self.processes = max(processes, 1)
+        self.budgets: dict[tuple, Rate_budget] = {}
+        self._order = itertools.count()
+        self.granted = 0
+        self.queued = 0
+        self.waited = 0.0
+        self.rate_limited = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> Rate_limiter | None:
+        """
+        Build the limiter of the `rate_limits` block of config.json, None when disabled.
+        `processes` defaults to the `MCP_AGENT_PROCESS_COUNT` set by `src.gradio_app.serve`.
+        """
+        if not config or not config.get('enabled'):
+            return None
+        processes = config.get('processes') or int(os.environ.get('MCP_AGENT_PROCESS_COUNT') or 1)
+        return cls(completion_tokens=config.get('completion_tokens', 512), max_wait=config.get('max_wait', 300),
+                   retries=config.get('retries', 3), block=config.get('block', 1.0), processes=processes)
+
+    def budget(self, endpoint: Model_endpoint, api_key: str | None) -> Rate_budget:
+        """Budget of an endpoint, shared by every request made to it with the same key"""
+        key = (endpoint.base_url, hashlib.sha256((api_key or '').encode()).hexdigest()[:16], endpoint.model)
+        budget = self.budgets.get(key)
+        if budget is None:
+            budget = self.budgets[key] = Rate_budget(endpoint.rpm, endpoint.tpm, share=1 / self.processes)
+        return budget
+
+    def estimate(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                 model_request_parameters: ModelRequestParameters) -> int:
+        """Tokens a request may use: its prompt, its tool schemas and the completion it may produce"""
+        tools = [*model_request_parameters.function_tools, *model_request_parameters.output_tools]
+        schemas = sum(len(tool.name) + len(tool.description or '') + len(json.dumps(tool.parameters_json_schema))
+                      for tool in tools) // 4
+        return estimate_tokens(messages) + schemas + ((model_settings or {}).get('max_tokens') or self.completion_tokens)
+
+    async def acquire(self, budget: Rate_budget, tokens: int) -> Rate_grant:
+        """
+        Wait until a request of `tokens` fits `budget` and take it.
+
+        Raises:
+            asyncio.TimeoutError: The budget didn't allow the request within `max_wait` seconds
+        """
+        if not budget.waiters and budget.delay(tokens) == 0:
+            budget.take(tokens)
+            self.granted += 1
+            return Rate_grant(budget, tokens, 0.0)
+        self.queued += 1
+        start = time.perf_counter()
+        waiter = _Waiter(_owner.get(), tokens, next(self._order), asyncio.get_running_loop().create_future())
+        budget.waiters.append(waiter)
+        budget.dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as it was given up on, never sent
+                budget.refund(tokens, request=True)
+                budget.unprobed()
+            else:
+                waiter.future.cancel()
+                if waiter in budget.waiters:
+                    budget.waiters.remove(waiter)
+                budget.dispatch()
+            raise
+        waited = time.perf_counter() - start
+        self.granted += 1
+        self.waited += waited
+        return Rate_grant(budget, tokens, waited)
+
+    def settle(self, grant: Rate_grant, used_tokens: int | None):
+        """Correct the estimate of a granted request with the tokens it used, None if it failed unsent"""
+        if used_tokens is None:
+            # Nothing was learned about the limits
+            grant.budget.refund(grant.tokens, request=True)
+            grant.budget.unprobed()
+            return
+        if used_tokens < grant.tokens:
+            grant.budget.refund(grant.tokens - used_tokens)
+        else:
+            grant.budget.tokens -= used_tokens - grant.tokens
+        grant.budget.probed()
+
+    def abandon(self, grant: Rate_grant):
+        """Release a granted request that failed or was cancelled once it may have been sent: its estimate stays taken"""
+        grant.budget.unprobed()
+
+    def rate_limited_by(self, grant: Rate_grant, retry_after: float | None):
+        """Record a 429: the budget is blocked for `retry_after` seconds"""
+        self.rate_limited += 1
+        grant.budget.block(retry_after if retry_after is not None else self.block)
+
+    @contextmanager
+    def observing(self, budget: Rate_budget) -> Iterator[None]:
+        """Apply the rate-limit headers of the responses received in the block to `budget`"""
+        token = _observed_budget.set(budget)
+        try:
+            yield
+        finally:
+            try:
+                _observed_budget.reset(token)
+            except ValueError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.granted,
+            'queued': self.queued,
+            'wait_s': round(self.waited, 3),
+            'rate_limited': self.rate_limited,
+            'budgets': {f"{base_url or 'openai'}/{model}": budget.stats()
+                        for (base_url, _, model), budget in self.budgets.items()},
+        }
+
+
+async def observe_rate_limit_headers(response: httpx.Response):
+    """httpx response hook applying the `x-ratelimit-*` headers to the budget of the request being sent"""
+    budget = _observed_budget.get()
+    if budget is not None:
+        budget.observe(response.headers)
@@ -0,0 +1,251 @@
+"""
+Response cache in front of `MCP_Agent.chat`.
+
+A turn whose query was already answered in the same context (instructions, model, MCP servers,
+the whole conversation so far and the volatile prompt context, e.g. the current time slot) is
+answered from the cache instead of a model round trip.
+The exact tier matches the normalized query by hash; the optional similarity tier embeds the
+query and matches near-identical questions asked in the same context. Only answers produced
+without any tool call are cached, since tool results depend on the outside world.
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from pydantic_ai.messages import ModelMessage, ToolCallPart, UserPromptPart
+
+from src.mcp_agent.history import summary_text
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation insensitive form of a query"""
+    return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?!. ')
+
+
+def _digest(*parts: str) -> bytes:
+    return hashlib.sha256('\x00'.join(parts).encode()).digest()
+
+
+def hashing_embedder(dim: int = 1024) -> Callable[[str], Any]:
+    """
+    Local embedding function without any model: word unigrams and character trigrams hashed
+    into a `dim`-sized unit vector. Good at catching rewordings, typos and word order changes.
+    """
+    import numpy as np
+
+    def embed(text: str):
+        text = normalize_query(text)
+        features = text.split() + [text[i:i + 3] for i in range(max(len(text) - 2, 1))]
+        vector = np.zeros(dim, dtype=np.float32)
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], 'little') % dim] += 1 if digest[4] & 1 else -1
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    return embed
+
+
+def embedder_from_config(name: str) -> Callable[[str], Any]:
+    """'hashing' for `hashing_embedder`, or 'module:function' returning a vector for a string"""
+    if name in (None, '', 'hashing'):
+        return hashing_embedder()
+    module, _, function = name.partition(':')
+    return getattr(importlib.import_module(module), function)
+
+
+class Vector_index:
+    """Fixed-capacity matrix of unit vectors searched by cosine similarity, rows scoped by context"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._vectors = None
+        self._contexts = None
+        self._used = None
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def _allocate(self, dim: int):
+        import numpy as np
+
+        self._vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+        self._contexts = np.zeros(self.capacity, dtype=np.int64)
+        self._used = np.zeros(self.capacity, dtype=bool)
+
+    def add(self, vector, context: bytes) -> int | None:
+        """Store a vector, returns its row or None when the index is full"""
+        if not self._free:
+            return None
+        if self._vectors is None:
+            self._allocate(len(vector))
+        row = self._free.pop()
+        self._vectors[row] = vector
+        self._contexts[row] = int.from_bytes(context[:8], 'little', signed=True)
+        self._used[row] = True
+        return row
+
+    def remove(self, row: int):
+        self._used[row] = False
+        self._free.append(row)
+
+    def search(self, vector, context: bytes) -> tuple[int | None, float]:
+        """Most similar row of the same context and its cosine similarity"""
+        import numpy as np
+
+        if self._vectors is None:
+            return None, 0.0
+        rows = np.flatnonzero(self._used & (self._contexts == int.from_bytes(context[:8], 'little', signed=True)))
+        if not len(rows):
+            return None, 0.0
+        scores = self._vectors[rows] @ vector
+        best = int(np.argmax(scores))
+        return int(rows[best]), float(scores[best])
+
+
+@dataclass
+class _Entry:
+    output: str
+    expires: float
+    row: int | None = None
+
+
+class Response_cache:
+    """
+    Process-wide cache of tool-free answers, shared by every agent using it.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted past
+    `max_entries`. With an `embedder`, a query without an exact match is also answered by
+    the most similar cached query of the same context, if its similarity reaches `threshold`.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1000, embedder: Callable[[str], Any] = None,
+                 threshold: float = 0.92):
+        """
+        Args:
+            ttl (float): Seconds a cached answer stays valid
+            max_entries (int): Maximum number of cached answers
+            embedder (callable, optional): Maps a query to a unit vector, enables the similarity tier
+                                           (e.g. `hashing_embedder()`)
+            threshold (float): Minimum cosine similarity of a similarity hit
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embedder = embedder
+        self.threshold = threshold
+        self.index = Vector_index(max_entries) if embedder is not None else None
+        self._entries: OrderedDict[bytes, _Entry] = OrderedDict()
+        self._rows: dict[int, bytes] = {}
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config: dict, time_resolution: int = 0) -> Response_cache | None:
+        """
+        Build the cache from the `response_cache` block of config.json, None when disabled.
+
+        Args:
+            config (dict): The `response_cache` block
+            time_resolution (int): Minutes of the time slot in the prompt, which caps the TTL: an
+                                   answer is keyed by its slot and can't be hit once it's over
+        """
+        if not config or not config.get('enabled'):
+            return None
+        similarity = config.get('similarity') or {}
+        ttl = config.get('ttl', 3600)
+        return cls(
+            ttl=min(ttl, time_resolution * 60) if time_resolution else ttl,
+            max_entries=config.get('max_entries', 1000),
+            embedder=embedder_from_config(similarity.get('embedder')) if similarity.get('enabled') else None,
+            threshold=similarity.get('threshold', 0.92),
+        )
+
+    def context(self, instructions: str | None, scope: str, history: list[ModelMessage],
+                volatile: str | None = None) -> bytes | None:
+        """
+        Hash of what, besides the query, an answer depends on, None when the turn can't be cached.
+
+        The whole conversation is part of it, not only its last turns: conversations that merely
+        end the same way may still differ in what the answer depends on (a name given earlier).
+        Conversations holding non-text prompts, which the transcript can't tell apart, aren't cached.
+        """
+        if any(isinstance(part, UserPromptPart) and not isinstance(part.content, str)
+               for message in history for part in message.parts):
+            return None
+        return _digest(instructions or '', scope, volatile or '', summary_text(history))
+
+    def get(self, query: str, context: bytes) -> tuple[str, str] | None:
+        """Return ('exact' or 'similar', cached answer) for a query, None on a miss"""
+        key = _digest(context.hex(), normalize_query(query))
+        entry = self._live(key)
+        if entry is not None:
+            self.hits += 1
+            return 'exact', entry.output
+        if self.index is not None:
+            row, score = self.index.search(self.embedder(query), context)
+            if row is not None and score >= self.threshold:
+                entry = self._live(self._rows[row])
+                if entry is not None:
+                    self.similar_hits += 1
+                    return 'similar', entry.output
+        self.misses += 1
+        return None
+
+    def _live(self, key: bytes) -> _Entry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self._delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, query: str, context: bytes, new_messages: list[ModelMessage], output: Any) -> bool:
+        """
+        Cache the answer of a turn, given the messages the turn added. Turns that called a tool
+        or didn't produce a text answer are not cached. Returns whether the answer was stored.
+        """
+        if not isinstance(output, str) or not output or any(
+            isinstance(part, ToolCallPart) for message in new_messages for part in message.parts
+        ):
+            self.bypassed += 1
+            return False
+        key = _digest(context.hex(), normalize_query(query))
+        self._delete(key)
+        while len(self._entries) >= self.max_entries:
+            self._delete(next(iter(self._entries)))
+            self.evictions += 1
+        entry = _Entry(output, time.monotonic() + self.ttl)
+        if self.index is not None:
+            entry.row = self.index.add(self.embedder(query), context)
+            self._rows[entry.row] = key
+        self._entries[key] = entry
+        return True
+
+    def _delete(self, key: bytes):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.row is not None:
+            self.index.remove(entry.row)
+            self._rows.pop(entry.row, None)
+
+    def clear(self):
+        for key in list(self._entries):
+            self._delete(key)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'entries': len(self._entries),
+            'evictions': self.evictions,
+        }
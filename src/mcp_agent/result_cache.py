@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import pydantic_core
+from pydantic_ai.messages import BinaryContent
+
+
+def result_key(server: str, tool_name: str, args: dict[str, Any]) -> str:
+    """Cache key of a tool call: (server, tool name, canonicalized arguments)"""
+    canonical = json.dumps(args or {}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{server}\x00{tool_name}\x00{canonical}".encode()).hexdigest()
+
+
+class Memory_result_backend:
+    """In-process LRU store bounded by the total size of the cached values"""
+
+    # Cheap enough to run on the event loop (and not thread-safe)
+    blocking = False
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._items: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.time():
+            self.delete(key)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self.delete(key)
+        self._items[key] = (value, time.time() + ttl)
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            oldest, (old_value, _) = self._items.popitem(last=False)
+            self.size -= len(old_value)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= len(item[0])
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class Sqlite_result_backend:
+    """On-disk store in a sqlite file, LRU-evicted by last access when over `max_bytes`"""
+
+    # Disk I/O: called from a worker thread, see `Tool_result_cache`
+    blocking = True
+
+    def __init__(self, path: str | Path = 'tool_result_cache.sqlite', max_bytes: int = 512 * 1024 * 1024):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # A crash may lose the last writes, which a cache can afford, but not corrupt the file
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+            'expires REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def get(self, key: str) -> bytes | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, expires FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._delete(key)
+                return None
+            self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            return bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._db.execute(
+                'INSERT INTO results (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value), now + ttl, now),
+            )
+            self.size += len(value)
+            if self.size > self.max_bytes:
+                self._db.execute('DELETE FROM results WHERE expires < ?', (now,))
+                self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            while self.size > self.max_bytes:
+                oldest = self._db.execute('SELECT key FROM results ORDER BY accessed LIMIT 1').fetchone()
+                self._delete(oldest[0])
+                self.evictions += 1
+
+    def _delete(self, key: str):
+        row = self._db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+            self.size -= row[0]
+
+    def delete(self, key: str):
+        with self._lock:
+            self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM results')
+            self.size = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+
+class Tool_result_cache:
+    """
+    Opt-in memoization of MCP tool results, shared by every agent of the process.
+
+    Only tools on the allow-list are cached, since most tools are not safe to replay
+    (anything with side effects, or whose answer depends on time). Results are stored as
+    JSON, so binary results such as images are never cached. Blocking backends (sqlite) are
+    accessed from a worker thread, so a lookup never stalls the event loop.
+    """
+
+    def __init__(self, tools: dict[str, float | None] | list[str], default_ttl: float = 300,
+                 backend: Memory_result_backend | Sqlite_result_backend = None):
+        """
+        Args:
+            tools (dict or list): Allow-list of cacheable tool names, optionally mapped to their own TTL in seconds
+            default_ttl (float): TTL of allowed tools without one
+            backend (optional): Storage backend, defaults to an in-memory `Memory_result_backend`
+        """
+        if not isinstance(tools, dict):
+            tools = {name: None for name in tools}
+        self.tools = tools
+        self.default_ttl = default_ttl
+        self.backend = backend if backend is not None else Memory_result_backend()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> Tool_result_cache | None:
+        """Build the cache from the `tool_result_cache` block of config.json, None when disabled"""
+        if not config or not config.get('enabled'):
+            return None
+        if config.get('backend') == 'sqlite':
+            backend = Sqlite_result_backend(config.get('path', 'tool_result_cache.sqlite'),
+                                            config.get('max_bytes', 512 * 1024 * 1024))
+        else:
+            backend = Memory_result_backend(config.get('max_bytes', 64 * 1024 * 1024))
+        return cls(config.get('tools', {}), config.get('default_ttl', 300), backend)
+
+    def is_cacheable(self, tool_name: str) -> bool:
+        return tool_name in self.tools
+
+    def ttl_of(self, tool_name: str) -> float:
+        ttl = self.tools.get(tool_name)
+        return self.default_ttl if ttl is None else ttl
+
+    async def _run(self, function, *args):
+        if getattr(self.backend, 'blocking', False):
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def get(self, server: str, tool_name: str, args: dict[str, Any]) -> tuple[bool, Any]:
+        """Return (hit, result) for a call"""
+        value = await self._run(self.backend.get, result_key(server, tool_name, args))
+        if value is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, pydantic_core.from_json(value)
+
+    async def set(self, server: str, tool_name: str, args: dict[str, Any], result: Any):
+        if isinstance(result, BinaryContent) or (
+            isinstance(result, list) and any(isinstance(part, BinaryContent) for part in result)
+        ):
+            return
+        try:
+            value = pydantic_core.to_json(result)
+        except pydantic_core.PydanticSerializationError:
+            return
+        await self._run(self.backend.set, result_key(server, tool_name, args), value, self.ttl_of(tool_name))
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.backend),
+            'bytes': self.backend.size,
+            'evictions': self.backend.evictions,
+        }
@@ -0,0 +1,204 @@
+"""
+Declarative MCP server configuration.
+
+The server fleet is declared in the `servers` list of the `mcp_servers` block of config.json,
+with no limit on its size. Each entry is a url server ({'name', 'url', 'type', 'headers'}) or a
+stdio server ({'name', 'command', 'args'}), plus the optional per-server settings (`lazy`,
+`connect_timeout`, `timeout`, `retry_attempts`, ...). `Server_config_watcher` reloads the file
+when it changes, and `MCP_Agent.update_servers` applies the new list by diffing it with the old
+one, so unchanged servers keep their connections and cached tool listings.
+"""
+from __future__ import annotations
+
+import ast
+import asyncio
+import json
+import os
+import shlex
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from src.mcp_agent.pool import server_key
+
+SERVER_TYPES = ('http', 'SSE')
+
+
+def parse_headers(value) -> dict | None:
+    """
+    Headers of a server as a dict, from a dict, a JSON or Python dict literal
+    ("{'Authorization': 'Bearer 123'}") or "Name: value" lines. None when empty.
+    """
+    if value is None or isinstance(value, dict):
+        return value or None
+    text = str(value).strip()
+    if not text:
+        return None
+    if text.startswith('{'):
+        try:
+            headers = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                headers = ast.literal_eval(text)
+            except (ValueError, SyntaxError):
+                raise ValueError(f"Headers are not a valid dict: {text[:40]}...") from None
+        if not isinstance(headers, dict):
+            raise ValueError('Headers must be a dict')
+        return {str(name): str(value) for name, value in headers.items()} or None
+    headers = {}
+    for line in text.splitlines():
+        name, separator, header_value = line.partition(':')
+        if not separator or not name.strip():
+            raise ValueError(f"Headers must be a dict or 'Name: value' lines, got {line[:40]!r}")
+        headers[name.strip()] = header_value.strip()
+    return headers or None
+
+
+def parse_args(value) -> list[str]:
+    """Arguments of a stdio server, from a list, a JSON or Python list literal, or a shell-like string"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(arg) for arg in value]
+    text = str(value).strip()
+    if text.startswith('['):
+        try:
+            args = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                args = ast.literal_eval(text)
+            except (ValueError, SyntaxError):
+                raise ValueError(f"Arguments are not a valid list: {text[:40]}...") from None
+        return [str(arg) for arg in args]
+    return shlex.split(text)
+
+
+def normalize_server(config: dict) -> dict:
+    """
+    Validated copy of a server config, with its headers and arguments parsed and a default name.
+
+    Raises:
+        ValueError: The config has neither a `url` nor a `command`, or an unknown `type`
+    """
+    config = dict(config)
+    if config.get('command'):
+        config['command'] = str(config['command']).strip()
+        config['args'] = parse_args(config.get('args'))
+        config.setdefault('name', Path(config['command']).name)
+        return config
+    if not config.get('url'):
+        raise ValueError(f"MCP server {config.get('name', 'config')!r} needs a 'url' or a 'command'")
+    config['url'] = str(config['url']).strip()
+    config['type'] = config.get('type') or 'http'
+    if config['type'] not in SERVER_TYPES:
+        raise ValueError(f"Unknown MCP server type {config['type']!r}, expected one of {', '.join(SERVER_TYPES)}")
+    config['headers'] = parse_headers(config.get('headers'))
+    config.setdefault('name', config['url'])
+    return config
+
+
+def servers_from_config(config: dict) -> list[dict]:
+    """Normalized server configs of the `servers` list of the `mcp_servers` block of config.json"""
+    servers = ((config or {}).get('mcp_servers') or {}).get('servers') or []
+    return [normalize_server(server) for server in servers if server.get('enabled', True)]
+
+
+def split_servers(servers: list[dict]) -> tuple[list[dict], list[dict]]:
+    """(url servers, stdio servers), the `mpc_server_urls` and `mpc_stdio_commands` of `MCP_Agent`"""
+    return ([server for server in servers if 'command' not in server],
+            [server for server in servers if 'command' in server])
+
+
+def diff_servers(old: list[dict], new: list[dict]) -> tuple[list[dict], list[dict], list[dict]]:
+    """
+    (added, removed, unchanged) server configs. Servers are the same when they share a connection:
+    the same url, type and headers, or the same command and arguments.
+    """
+    old_keys = {server_key(server) for server in old}
+    new_keys = {server_key(server) for server in new}
+    return ([server for server in new if server_key(server) not in old_keys],
+            [server for server in old if server_key(server) not in new_keys],
+            [server for server in new if server_key(server) in old_keys])
+
+
+class Server_config_watcher:
+    """
+    Polls config.json and calls `on_change` with the new server list whenever it differs.
+
+    A file that doesn't parse, or declares an invalid server, is reported and ignored until it is
+    fixed, so a half-saved edit never tears the running servers down.
+    """
+
+    def __init__(self, path: str | Path, on_change: Callable[[list[dict]], Awaitable], interval: float = 2,
+                 servers: list[dict] = None):
+        """
+        Args:
+            path (str): The config.json file to watch
+            on_change (callable): Coroutine function called with the new normalized server list
+            interval (float): Seconds between checks of the file's modification time
+            servers (list, optional): The server list currently applied, read from the file by default
+        """
+        self.path = Path(path)
+        self.on_change = on_change
+        self.interval = interval
+        self.servers = servers if servers is not None else self._read()
+        self.reloads = 0
+        self.last_error: str | None = None
+        self._mtime = self._stat()
+        self._task: asyncio.Task | None = None
+
+    def _stat(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _read(self) -> list[dict]:
+        try:
+            return servers_from_config(json.loads(self.path.read_text()))
+        except FileNotFoundError:
+            return []
+
+    def start(self):
+        """Start watching on the running event loop, if not already watching"""
+        if self.interval and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check(self) -> bool:
+        """Reload the file if it changed since the last check, returns whether the servers changed"""
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            servers = await asyncio.to_thread(self._read)
+        except (ValueError, OSError) as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Ignoring invalid MCP server config in {self.path}: {self.last_error}")
+            return False
+        self.last_error = None
+        if servers == self.servers:
+            return False
+        added, removed, unchanged = diff_servers(self.servers, servers)
+        print(f"Reloading MCP servers from {self.path}: {len(added)} added, {len(removed)} removed, "
+              f"{len(unchanged)} unchanged")
+        self.servers = servers
+        self.reloads += 1
+        await self.on_change(servers)
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Error reloading MCP servers: {e}")
@@ -0,0 +1,251 @@
+"""
+Persistent conversation memory.
+
+A store keeps, per session, an append-only log of messages and a small head: the messages
+that precede the log window in the agent's memory (system prompt carried over by the window,
+summary of evicted turns). The memory of a session is `head + log[start_seq:]`, so a turn
+only appends its new messages and moves `start_seq` forward when old turns are evicted, and
+resuming a session reads just the current window.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+
+
+def encode_messages(messages: list[ModelMessage]) -> bytes:
+    """Serialize messages with pydantic-ai's type adapter, zlib-compressed"""
+    return zlib.compress(ModelMessagesTypeAdapter.dump_json(messages), 1)
+
+
+def decode_messages(data: bytes) -> list[ModelMessage]:
+    return ModelMessagesTypeAdapter.validate_json(zlib.decompress(data))
+
+
+def message_digest(message: ModelMessage) -> bytes:
+    """Digest of the serialized content of a message, equal for equal messages whatever their identity"""
+    return hashlib.blake2b(ModelMessagesTypeAdapter.dump_json([message]), digest_size=16).digest()
+
+
+class Memory_session_store:
+    """In-process store, for development and tests"""
+
+    def __init__(self):
+        # session_id -> [head, start_seq, rows], rows being (seq, encoded message)
+        self._sessions: dict[str, list] = {}
+
+    def load(self, session_id: str) -> tuple[list[ModelMessage], list[tuple[int, ModelMessage]]]:
+        """Return the head and the (seq, message) rows of the window of a session"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return [], []
+        head, start_seq, rows = session
+        return decode_messages(head), [(seq, decode_messages(data)[0]) for seq, data in rows if seq >= start_seq]
+
+    def save(self, session_id: str, messages: list[ModelMessage], head: list[ModelMessage] = None,
+             start_seq: int = None) -> list[int]:
+        """
+        Append `messages` to the log of a session and return their seqs.
+
+        Args:
+            head (list, optional): New head of the session, None to keep the current one
+            start_seq (int, optional): New start of the window, None to keep the current one,
+                                       -1 to start it after the current end of the log
+        """
+        session = self._sessions.setdefault(session_id, [encode_messages([]), 0, []])
+        next_seq = session[2][-1][0] + 1 if session[2] else 0
+        if head is not None:
+            session[0] = encode_messages(head)
+        if start_seq is not None:
+            session[1] = next_seq if start_seq == -1 else start_seq
+        seqs = list(range(next_seq, next_seq + len(messages)))
+        session[2].extend((seq, encode_messages([message])) for seq, message in zip(seqs, messages))
+        return seqs
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def log_size(self, session_id: str) -> int:
+        """Number of messages in the log of a session"""
+        session = self._sessions.get(session_id)
+        return len(session[2]) if session is not None else 0
+
+    def sessions(self) -> list[str]:
+        return list(self._sessions)
+
+
+class Sqlite_session_store:
+    """Store in a sqlite file, the local default"""
+
+    def __init__(self, path: str | Path = 'sessions.sqlite', keep_full_history: bool = True):
+        """
+        Args:
+            path (str): sqlite file
+            keep_full_history (bool): Keep the messages that left the window as a transcript,
+                                      otherwise they are deleted when the window moves
+        """
+        self.path = str(path)
+        self.keep_full_history = keep_full_history
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'session_id TEXT PRIMARY KEY, head BLOB NOT NULL, start_seq INTEGER NOT NULL, '
+            'next_seq INTEGER NOT NULL, updated REAL NOT NULL)'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'session_id TEXT NOT NULL, seq INTEGER NOT NULL, data BLOB NOT NULL, '
+            'PRIMARY KEY (session_id, seq)) WITHOUT ROWID'
+        )
+
+    def load(self, session_id: str) -> tuple[list[ModelMessage], list[tuple[int, ModelMessage]]]:
+        """Return the head and the (seq, message) rows of the window of a session"""
+        with self._lock:
+            session = self._db.execute('SELECT head, start_seq FROM sessions WHERE session_id = ?',
+                                       (session_id,)).fetchone()
+            if session is None:
+                return [], []
+            rows = self._db.execute('SELECT seq, data FROM messages WHERE session_id = ? AND seq >= ? ORDER BY seq',
+                                    (session_id, session[1])).fetchall()
+        return decode_messages(session[0]), [(seq, decode_messages(data)[0]) for seq, data in rows]
+
+    def save(self, session_id: str, messages: list[ModelMessage], head: list[ModelMessage] = None,
+             start_seq: int = None) -> list[int]:
+        """
+        Append `messages` to the log of a session in one transaction and return their seqs.
+
+        Args:
+            head (list, optional): New head of the session, None to keep the current one
+            start_seq (int, optional): New start of the window, None to keep the current one,
+                                       -1 to start it after the current end of the log
+        """
+        encoded = [encode_messages([message]) for message in messages]
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                session = self._db.execute('SELECT start_seq, next_seq FROM sessions WHERE session_id = ?',
+                                           (session_id,)).fetchone()
+                current_start, next_seq = session if session is not None else (0, 0)
+                if start_seq == -1:
+                    start_seq = next_seq
+                elif start_seq is None:
+                    start_seq = current_start
+                seqs = list(range(next_seq, next_seq + len(encoded)))
+                if session is None:
+                    self._db.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, ?)',
+                                     (session_id, encode_messages(head or []), start_seq, next_seq + len(encoded),
+                                      time.time()))
+                elif head is not None:
+                    self._db.execute('UPDATE sessions SET head = ?, start_seq = ?, next_seq = ?, updated = ? '
+                                     'WHERE session_id = ?',
+                                     (encode_messages(head), start_seq, next_seq + len(encoded), time.time(),
+                                      session_id))
+                else:
+                    self._db.execute('UPDATE sessions SET start_seq = ?, next_seq = ?, updated = ? '
+                                     'WHERE session_id = ?',
+                                     (start_seq, next_seq + len(encoded), time.time(), session_id))
+                self._db.executemany('INSERT INTO messages VALUES (?, ?, ?)',
+                                     [(session_id, seq, data) for seq, data in zip(seqs, encoded)])
+                if not self.keep_full_history:
+                    self._db.execute('DELETE FROM messages WHERE session_id = ? AND seq < ?', (session_id, start_seq))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return seqs
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            self._db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def log_size(self, session_id: str) -> int:
+        """Number of messages in the log of a session"""
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+    def sessions(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT session_id FROM sessions ORDER BY updated DESC')]
+
+
+def store_from_config(config: dict) -> Memory_session_store | Sqlite_session_store | None:
+    """Build the store of the `session_store` block of config.json, None when disabled"""
+    if not config or not config.get('enabled'):
+        return None
+    if config.get('backend', 'sqlite') == 'memory':
+        return Memory_session_store()
+    return Sqlite_session_store(config.get('path', 'sessions.sqlite'), config.get('keep_full_history', True))
+
+
+class Persisted_history:
+    """
+    Mirror of one agent's memory in a store.
+
+    After each turn `sync` works out, from the content of the messages (a digest of each), which
+    part of the new memory was already stored: messages evicted by the history window just move
+    the start of the window, and only the messages of the new turn are appended. Messages rebuilt
+    with the same content, as the history window does, count as stored. When the memory can't be
+    expressed that way (e.g. after a reset) the window restarts after the log.
+    """
+
+    def __init__(self, store, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self._head: list[bytes] = []
+        # (seq, digest) of the messages of the window
+        self._window: list[tuple[int, bytes]] = []
+        # Digest of each message of the last synced memory, by id, holding the message so the id stays its own
+        self._digests: dict[int, tuple[ModelMessage, bytes]] = {}
+
+    def _digest(self, message: ModelMessage) -> bytes:
+        known = self._digests.get(id(message))
+        return known[1] if known is not None and known[0] is message else message_digest(message)
+
+    async def load(self) -> list[ModelMessage]:
+        """Read the current window of the session"""
+        head, window = await asyncio.to_thread(self.store.load, self.session_id)
+        self._head = [message_digest(message) for message in head]
+        self._window = [(seq, message_digest(message)) for seq, message in window]
+        messages = head + [message for _, message in window]
+        self._digests = {id(message): (message, digest)
+                         for message, digest in zip(messages, self._head + [digest for _, digest in self._window])}
+        return messages
+
+    async def sync(self, messages: list[ModelMessage]):
+        """Persist `messages`, the agent's memory after a turn"""
+        digests = [self._digest(message) for message in messages]
+        self._digests = {id(message): (message, digest) for message, digest in zip(messages, digests)}
+        positions = {digest: index for index, (_, digest) in enumerate(self._window)}
+        first = next((index for index, digest in enumerate(digests) if digest in positions), None)
+        kept = len(self._window) - positions[digests[first]] if first is not None else 0
+        if first is not None and digests[first:first + kept] == [digest for _, digest in self._window[-kept:]]:
+            head, window, tail = digests[:first], self._window[-kept:], messages[first + kept:]
+            start_seq = window[0][0]
+        else:
+            head, window, tail, start_seq = [], [], messages, -1
+        head_changed = head != self._head
+        if not tail and not head_changed and start_seq == (self._window[0][0] if self._window else None):
+            return
+        seqs = await asyncio.to_thread(self.store.save, self.session_id, tail,
+                                       messages[:len(head)] if head_changed else None, start_seq)
+        self._head, self._window = head, window + list(zip(seqs, digests[len(digests) - len(tail):]))
+
+    def reset(self):
+        """Start an empty window, the previous messages stay in the log"""
+        self.store.save(self.session_id, [], [], -1)
+        self._head, self._window, self._digests = [], [], {}
+
+    def offload(self):
+        """Forget the in-memory mirror, the next sync after a `load` picks up where the store is"""
+        self._head, self._window, self._digests = [], [], {}
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import random
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+import anyio
+import httpx
+import pydantic_core
+from pydantic_ai.exceptions import ModelRetry
+
+from src.mcp_agent.tracing import Tracer, current_span, default_tracer
+
+# Failures of a call that never reached the server (its connection was already gone, or couldn't be
+# opened): retrying them is safe for any tool
+UNSENT_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+)
+
+# Failures where the call didn't complete but may have run on the server (a timeout, a connection
+# lost mid-call), as opposed to the tool reporting an error: only retried for idempotent tools
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    OSError,
+    httpx.TransportError,
+    *UNSENT_ERRORS,
+)
+
+# Tool call tasks started by the current agent turn, see `tool_call_scope`
+_turn_tool_calls: contextvars.ContextVar[set[asyncio.Task] | None] = contextvars.ContextVar(
+    'turn_tool_calls', default=None
+)
+
+
+@contextmanager
+def tool_call_scope() -> Iterator[set[asyncio.Task]]:
+    """
+    Scope of one agent turn: tool calls still running when the block exits are cancelled.
+
+    pydantic-ai runs the tool calls of a model response as separate tasks and doesn't cancel
+    them when the run itself is cancelled, so without this an abandoned turn would keep its
+    tool calls (and the server's concurrency slots) busy until they complete.
+    """
+    tasks: set[asyncio.Task] = set()
+    token = _turn_tool_calls.set(tasks)
+    try:
+        yield tasks
+    finally:
+        try:
+            _turn_tool_calls.reset(token)
+        except ValueError:
+            # Exited from another context, e.g. an async generator closed by a different task
+            pass
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+class Tool_call_policy:
+    """
+    `process_tool_call` hook of one MCP server: bounds its concurrency and applies a
+    per-call timeout with retries and exponential backoff.
+
+    A call that timed out or lost its connection may still have run on the server, so it is
+    only retried for tools declared idempotent (or cached, which implies they are read-only).
+    Other tools are only retried when the call never reached the server.
+
+    pydantic-ai already runs the tool calls of one model response as concurrent tasks,
+    so with a semaphore per server a fan-out turn takes about as long as its slowest tool
+    while no single server gets more than `max_concurrency` calls at once.
+    """
+
+    def __init__(self, max_concurrency: int = 4, timeout: float = 30, retry_attempts: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 8, name: str = '', result_cache=None,
+                 tracer: Tracer = None, cache_scope: str = None, idempotent_tools: Iterable[str] = ()):
+        """
+        Args:
+            max_concurrency (int): Maximum number of calls in flight on the server
+            timeout (float): Seconds before a single call attempt is abandoned
+            retry_attempts (int): Total attempts for calls failing with a timeout or transport error, see
+                                  `idempotent_tools`
+            backoff (float): Delay before the first retry, doubled (with jitter) on every retry
+            max_backoff (float): Upper bound of the retry delay
+            name (str): Name of the server, used in spans
+            result_cache (Tool_result_cache, optional): Memoizes results of the tools it allows
+            tracer (Tracer, optional): Records each call as a `tool.call` span, defaults to the process-wide tracer
+            cache_scope (str, optional): Identity of the server in the result cache keys, including its
+                                         credentials so differently authenticated configs never share results.
+                                         Defaults to `name`
+            idempotent_tools (Iterable[str]): Tools (as named to the model) safe to call again after a
+                                              timeout or a connection lost mid-call
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retry_attempts = max(retry_attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = name
+        self.cache_scope = cache_scope or name
+        self.result_cache = result_cache
+        self.idempotent_tools = frozenset(idempotent_tools or ())
+        self.tracer = tracer if tracer is not None else default_tracer
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore, self._loop = asyncio.Semaphore(self.max_concurrency), loop
+        return self._semaphore
+
+    def delay(self, attempt: int) -> float:
+        return min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1)
+
+    def is_idempotent(self, tool_name: str) -> bool:
+        return tool_name in self.idempotent_tools or (self.result_cache is not None
+                                                      and self.result_cache.is_cacheable(tool_name))
+
+    async def call(self, call_tool, tool_name: str, args: dict[str, Any]) -> Any:
+        """Run one tool call under the server's concurrency limit, timeout and retry policy"""
+        cache = self.result_cache
+        if cache is not None and cache.is_cacheable(tool_name):
+            hit, result = await cache.get(self.cache_scope, tool_name, args)
+            current_span().set_attribute('cache_hit', hit)
+            if hit:
+                return result
+            result = await self._call(call_tool, tool_name, args)
+            await cache.set(self.cache_scope, tool_name, args, result)
+            return result
+        return await self._call(call_tool, tool_name, args)
+
+    async def _call(self, call_tool, tool_name: str, args: dict[str, Any]) -> Any:
+        idempotent = self.is_idempotent(tool_name)
+        error, attempts = None, 0
+        for attempt in range(self.retry_attempts):
+            if attempt:
+                await asyncio.sleep(self.delay(attempt - 1))
+                current_span().set_attribute('attempts', attempt + 1)
+            attempts = attempt + 1
+            try:
+                async with self.semaphore:
+                    return await asyncio.wait_for(call_tool(tool_name, args), self.timeout)
+            except TRANSIENT_ERRORS as e:
+                error = e
+                if not idempotent and not isinstance(e, UNSENT_ERRORS):
+                    break
+        reason = 'timed out' if isinstance(error, asyncio.TimeoutError) else f"failed ({error!r})"
+        if not idempotent and not isinstance(error, UNSENT_ERRORS):
+            raise ModelRetry(f"Tool {tool_name} {reason} after {attempts} attempt(s), it may have completed: "
+                             f"check its effects before calling it again")
+        raise ModelRetry(f"Tool {tool_name} {reason} after {attempts} attempt(s)")
+
+    async def __call__(self, ctx, call_tool, tool_name: str, args: dict[str, Any]) -> Any:
+        turn_tasks = _turn_tool_calls.get()
+        task = asyncio.current_task()
+        if turn_tasks is not None:
+            turn_tasks.add(task)
+        try:
+            with self.tracer.span('tool.call', server=self.name, tool=tool_name) as span:
+                result = await self.call(call_tool, tool_name, args)
+                if span.recording:
+                    span.set_attributes(args_bytes=_json_size(args), result_bytes=_json_size(result))
+                # The agent running the call (its deps) may move oversized results out of the conversation
+                offloader = getattr(ctx.deps, 'tool_results', None)
+                if offloader is not None:
+                    processed = await offloader.process(tool_name, result)
+                    if processed is not result:
+                        span.set_attribute('offloaded', True)
+                    result = processed
+                return result
+        finally:
+            if turn_tasks is not None:
+                turn_tasks.discard(task)
+
+
+def _json_size(value: Any) -> int | None:
+    try:
+        return len(pydantic_core.to_json(value))
+    except pydantic_core.PydanticSerializationError:
+        return None
@@ -0,0 +1,275 @@
+"""
+Out-of-band storage of large tool results.
+
+A tool result over the size budget is not put in the conversation: it is stored in a result
+store and replaced by a stub holding its handle, its size and a preview. The model reads
+further slices on demand with the `read_tool_result` tool, so the prompt of every following
+turn stays bounded whatever the tools return.
+"""
+from __future__ import annotations
+
+import asyncio
+import mmap
+import os
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+import pydantic_core
+from pydantic_ai.messages import BinaryContent
+from pydantic_ai.tools import RunContext, Tool, ToolDefinition
+
+
+class Memory_result_store:
+    """
+    Process-wide in-memory store of large results, LRU-evicted past `max_bytes`.
+    Safe to use from worker threads: the index is guarded by a lock, file I/O runs outside it.
+    """
+
+    blocking = False
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._items: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes) -> str:
+        """Store `data` and return its handle"""
+        handle = secrets.token_urlsafe(9)
+        item = self._write(handle, data)
+        evicted = []
+        with self._lock:
+            self._items[handle] = item
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._items) > 1:
+                evicted.append(self._pop(next(iter(self._items))))
+                self.evictions += 1
+        for item in evicted:
+            self._drop(item)
+        return handle
+
+    def __contains__(self, handle: str) -> bool:
+        return handle in self._items
+
+    def read(self, handle: str, offset: int, length: int) -> bytes | None:
+        """`length` bytes of a stored result from `offset`, None if the handle is unknown or evicted"""
+        with self._lock:
+            item = self._items.get(handle)
+            if item is None:
+                return None
+            self._items.move_to_end(handle)
+        try:
+            return bytes(self._view(item)[offset:offset + length])
+        except ValueError:
+            # Evicted (its map closed) while being read from another thread
+            return None
+
+    def length(self, handle: str) -> int | None:
+        with self._lock:
+            item = self._items.get(handle)
+            return len(self._view(item)) if item is not None else None
+
+    def delete(self, handle: str):
+        with self._lock:
+            item = self._pop(handle)
+        if item is not None:
+            self._drop(item)
+
+    def clear(self):
+        with self._lock:
+            items = [self._pop(handle) for handle in list(self._items)]
+        for item in items:
+            self._drop(item)
+
+    def _pop(self, handle: str):
+        """Remove a result from the index, the caller holds the lock and drops the item afterwards"""
+        item = self._items.pop(handle, None)
+        if item is not None:
+            self.size -= len(self._view(item))
+        return item
+
+    def _write(self, handle: str, data: bytes):
+        return data
+
+    def _view(self, item):
+        return item
+
+    def _drop(self, item):
+        pass
+
+    def stats(self) -> dict:
+        return {'results': len(self._items), 'bytes': self.size, 'evictions': self.evictions}
+
+
+class Mmap_result_store(Memory_result_store):
+    """
+    Store writing each result to a temp file read back through a memory map, so large
+    results live in the page cache rather than the Python heap
+    """
+
+    blocking = True
+
+    def __init__(self, directory: str | Path = None, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        Args:
+            directory (str, optional): Where the files are written, a new temp directory by default
+            max_bytes (int): Total size of the stored results before the least recently read are deleted
+        """
+        super().__init__(max_bytes)
+        self.directory = Path(directory) if directory else Path(tempfile.mkdtemp(prefix='mcp_agent_results_'))
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, handle: str, data: bytes):
+        path = self.directory / handle
+        with open(path, 'wb') as f:
+            f.write(data)
+        if not data:
+            return path, b''
+        with open(path, 'rb') as f:
+            return path, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _view(self, item):
+        return item[1]
+
+    def _drop(self, item):
+        path, view = item
+        if isinstance(view, mmap.mmap):
+            view.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def result_store_from_config(config: dict) -> Memory_result_store | Mmap_result_store:
+    """Build the store of the `tool_results` block of config.json"""
+    config = config or {}
+    if config.get('backend') == 'mmap':
+        return Mmap_result_store(config.get('dir'), config.get('max_bytes', 1024 * 1024 * 1024))
+    return Memory_result_store(config.get('max_bytes', 256 * 1024 * 1024))
+
+
+class Tool_result_offloader:
+    """
+    Tool-result stage of one agent: results over `max_bytes` are moved to a result store and
+    replaced in the conversation by a handle, their size and a preview.
+
+    The store is usually shared by every agent of the process; the offloader keeps track of
+    the handles of its own agent so they can be released when its conversation is reset.
+    """
+
+    def __init__(self, store: Memory_result_store | Mmap_result_store, max_bytes: int = 8000,
+                 preview_bytes: int = 1500, max_read_bytes: int = 6000):
+        """
+        Args:
+            store: Where oversized results are kept, e.g. `Memory_result_store()` or `Mmap_result_store()`
+            max_bytes (int): Results larger than this (as UTF-8 text or JSON) are stored out of band
+            preview_bytes (int): Size of the beginning of the result kept in the conversation
+            max_read_bytes (int): Largest slice `read_tool_result` returns at once
+        """
+        self.store = store
+        self.max_bytes = max_bytes
+        self.preview_bytes = preview_bytes
+        self.max_read_bytes = max_read_bytes
+        self.handles: set[str] = set()
+        self.offloaded = 0
+
+    async def process(self, tool_name: str, result: Any) -> Any:
+        """Return `result` as is when it fits the budget, or the stub replacing it"""
+        if isinstance(result, BinaryContent) or (
+            isinstance(result, list) and any(isinstance(part, BinaryContent) for part in result)
+        ):
+            return result
+        if isinstance(result, str):
+            data = result.encode()
+        else:
+            try:
+                data = pydantic_core.to_json(result)
+            except pydantic_core.PydanticSerializationError:
+                return result
+        if len(data) <= self.max_bytes:
+            return result
+        handle = await asyncio.to_thread(self.store.put, data) if self.store.blocking else self.store.put(data)
+        # Forget the handles the store has evicted since, so the set stays as small as what is stored
+        self.handles = {known for known in self.handles if known in self.store}
+        self.handles.add(handle)
+        self.offloaded += 1
+        return self.stub(tool_name, handle, data, result)
+
+    def stub(self, tool_name: str, handle: str, data: bytes, result: Any) -> str:
+        keys = f" Top-level keys: {', '.join(map(str, list(result)[:20]))}." if isinstance(result, dict) else ''
+        preview = data[:self.preview_bytes].decode(errors='ignore')
+        lines = data.count(b'\n') + 1
+        return (
+            f"[The result of {tool_name} is too large for the conversation ({len(data)} bytes, "
+            f"{lines} lines) and was stored as handle \"{handle}\".{keys}\n"
+            f"First {len(preview.encode())} bytes:\n{preview}\n"
+            f"...\nCall read_tool_result with this handle, a byte offset and a length to read the rest.]"
+        )
+
+    async def read_tool_result(self, handle: str, offset: int = 0, length: int = 4000) -> str:
+        """
+        Read part of a large tool result that was stored out of band.
+
+        Args:
+            handle: Handle of the stored result, as given in place of the result
+            offset: Byte offset to start reading from
+            length: Number of bytes to read
+        """
+        length = max(min(length, self.max_read_bytes), 0)
+        total = self.store.length(handle) if handle in self.handles else None
+        if total is None:
+            self.handles.discard(handle)
+            return f"No stored result with handle {handle!r}, it may have expired. Call the tool again if needed."
+        offset = max(offset, 0)
+        if self.store.blocking:
+            data = await asyncio.to_thread(self.store.read, handle, offset, length)
+        else:
+            data = self.store.read(handle, offset, length)
+        if data is None:
+            return f"No stored result with handle {handle!r}, it may have expired. Call the tool again if needed."
+        end = offset + len(data)
+        return (f"[Bytes {offset}-{end} of {total}{', end of result' if end >= total else ''}]\n"
+                f"{data.decode(errors='ignore')}")
+
+    def clear(self):
+        """Release the results stored for this agent"""
+        for handle in self.handles:
+            self.store.delete(handle)
+        self.handles.clear()
+
+
+async def read_tool_result(ctx: RunContext[Any], handle: str, offset: int = 0, length: int = 4000) -> str:
+    """
+    Read part of a large tool result that was stored out of band.
+
+    Args:
+        handle: Handle of the stored result, as given in place of the result
+        offset: Byte offset to start reading from
+        length: Number of bytes to read
+    """
+    return await ctx.deps.tool_results.read_tool_result(handle, offset, length)
+
+
+async def _offered_once_offloaded(ctx: RunContext[Any], tool_def: ToolDefinition) -> ToolDefinition | None:
+    # Only offered once a result of this agent was stored out of band, so it costs nothing until then
+    return tool_def if ctx.deps.tool_results.handles else None
+
+
+@cache
+def read_tool_result_tool() -> Tool:
+    """
+    The `read_tool_result` tool, shared by every agent: its schema is built once per process and
+    each run reads through the offloader of the agent passed as `deps`
+    """
+    return Tool(read_tool_result, name='read_tool_result', prepare=_offered_once_offloaded)
+
+
+# Process-wide in-memory store, used by agents not given one
+default_result_store = Memory_result_store()
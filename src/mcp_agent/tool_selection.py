@@ -0,0 +1,233 @@
+"""
+Relevance-based tool selection for large MCP server fleets.
+
+Every request would otherwise carry the schema of every tool of every connected server. The
+selector is the agent's `prepare_tools` stage: it ranks the tools against the current query and
+the recent turns with BM25 over their names, descriptions and parameters (optionally blended with
+a local embedding), and offers only the top `top_k`, plus the tools the conversation is already
+using. The index of a tool set is built once, when the set is first seen, and reused as long as
+the connections serve the same tools.
+
+When the model asks for a tool that wasn't offered (a hidden one, or one that doesn't exist),
+the rest of the turn is run with every tool.
+"""
+from __future__ import annotations
+
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Callable
+
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, RetryPromptPart, ToolCallPart, UserPromptPart
+from pydantic_ai.tools import RunContext, ToolDefinition
+
+from src.mcp_agent.response_cache import embedder_from_config
+from src.mcp_agent.tracing import current_span
+
+STOPWORDS = frozenset((
+    'a an and are as at be by can do does for from get has have how i in is it me my of on or please '
+    'set show that the this to use using what when which with you your'
+).split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased words of a text, with identifiers split (getWeather, get_weather -> get, weather)"""
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text)
+    tokens = []
+    for token in re.split(r'[^a-z0-9]+', text.lower()):
+        if token and token not in STOPWORDS:
+            # Crude plural folding, enough to match "files" with "file"
+            tokens.append(token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token)
+    return tokens
+
+
+def _parameter_text(schema: dict) -> str:
+    properties = (schema or {}).get('properties') or {}
+    return ' '.join(f"{name} {spec.get('description', '')}" for name, spec in properties.items()
+                    if isinstance(spec, dict))
+
+
+class Tool_index:
+    """BM25 term weights (and optional embeddings) of a set of tools, as NumPy matrices"""
+
+    def __init__(self, tool_defs: list[ToolDefinition], embedder: Callable[[str], Any] = None,
+                 k1: float = 1.2, b: float = 0.75):
+        import numpy as np
+
+        self.names = [tool.name for tool in tool_defs]
+        # Rough schema size of each tool (~4 characters per token), what hiding it saves per request
+        self.tokens = np.array([len(tool.name) + len(tool.description or '') + len(json.dumps(tool.parameters_json_schema))
+                                for tool in tool_defs]) // 4
+        texts = [f"{tool.name} {tool.description or ''} {_parameter_text(tool.parameters_json_schema)}"
+                 for tool in tool_defs]
+        # Names count twice: they are short and the most telling
+        documents = [tokenize(tool.name) + tokenize(text) for tool, text in zip(tool_defs, texts)]
+        self.vocabulary: dict[str, int] = {}
+        for document in documents:
+            for term in document:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+        counts = np.zeros((len(documents), max(len(self.vocabulary), 1)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for term in document:
+                counts[row, self.vocabulary[term]] += 1
+        lengths = counts.sum(axis=1, keepdims=True)
+        frequency = (counts > 0).sum(axis=0)
+        idf = np.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+        self.weights = idf * counts * (k1 + 1) / (counts + k1 * (1 - b + b * lengths / max(lengths.mean(), 1)))
+        self.embedder = embedder
+        self.embeddings = np.stack([embedder(text) for text in texts]) if embedder is not None and texts else None
+
+    def scores(self, query: str, embedding_weight: float = 0.5):
+        """Relevance of every tool to a query, in [0, 1] when blended with embeddings"""
+        import numpy as np
+
+        columns = [self.vocabulary[term] for term in set(tokenize(query)) if term in self.vocabulary]
+        scores = self.weights[:, columns].sum(axis=1) if columns else np.zeros(len(self.names), dtype=np.float32)
+        if self.embeddings is None:
+            return scores
+        top = scores.max() if len(scores) else 0
+        lexical = scores / top if top > 0 else scores
+        return (1 - embedding_weight) * lexical + embedding_weight * np.maximum(self.embeddings @ self.embedder(query), 0)
+
+
+def _current_run(messages: list[ModelMessage]) -> tuple[list[ModelMessage], list[ModelMessage]]:
+    """(history before the current turn, messages of the current turn)"""
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if isinstance(message, ModelRequest) and any(isinstance(part, UserPromptPart) for part in message.parts):
+            return messages[:index], messages[index:]
+    return messages, []
+
+
+class Tool_selector:
+    """
+    `prepare_tools` stage offering the model only the tools relevant to the current turn.
+
+    Shared by every agent of the process: its index cache is keyed by the tool set, and its
+    counters add up the selections of all agents.
+    """
+
+    def __init__(self, top_k: int = 10, context_turns: int = 1, embedder: Callable[[str], Any] = None,
+                 embedding_weight: float = 0.5, always: list[str] = ('read_tool_result',), max_indexes: int = 32):
+        """
+        Args:
+            top_k (int): Number of tools offered by relevance; tool sets this small are offered whole
+            context_turns (int): Previous turns whose user prompts are part of the query, and whose
+                                 tools stay offered, so follow-up questions keep their tools
+            embedder (callable, optional): Maps a text to a unit vector (e.g. `hashing_embedder()`),
+                                           blended with BM25 to match tools described in other words
+            embedding_weight (float): Weight of the embedding similarity in the blended score
+            always (list): Names of tools offered whatever the query
+            max_indexes (int): Number of distinct tool sets whose index is kept
+        """
+        self.top_k = top_k
+        self.context_turns = context_turns
+        self.embedder = embedder
+        self.embedding_weight = embedding_weight
+        self.always = set(always)
+        self.max_indexes = max_indexes
+        self._indexes: OrderedDict[tuple, Tool_index] = OrderedDict()
+        self.selections = 0
+        self.expansions = 0
+        self.tools_offered = 0
+        self.tools_total = 0
+        self.tokens_saved = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> Tool_selector | None:
+        """Build the selector of the `tool_selection` block of config.json, None when disabled"""
+        if not config or not config.get('enabled'):
+            return None
+        return cls(top_k=config.get('top_k', 10), context_turns=config.get('context_turns', 1),
+                   embedder=embedder_from_config(config.get('embedder')) if config.get('embedder') else None,
+                   embedding_weight=config.get('embedding_weight', 0.5),
+                   always=config.get('always', ['read_tool_result']))
+
+    def index_for(self, tool_defs: list[ToolDefinition]) -> Tool_index:
+        """Index of a tool set, built the first time the set is seen"""
+        key = tuple((tool.name, tool.description) for tool in tool_defs)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = Tool_index(tool_defs, self.embedder)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(key)
+        return index
+
+    def select(self, tool_defs: list[ToolDefinition], messages: list[ModelMessage], prompt: str = None) -> tuple[set[str], bool]:
+        """
+        Names of the tools to offer for the current turn of `messages`, and whether the selection
+        was expanded to every tool because the model asked for one that wasn't offered
+        """
+        names = {tool.name for tool in tool_defs}
+        if len(tool_defs) <= self.top_k:
+            return names, False
+        history, run = _current_run(messages)
+        queries = [prompt] if isinstance(prompt, str) else []
+        recent_tools = set()
+        turns = 0
+        for message in reversed(history):
+            if turns >= self.context_turns:
+                break
+            for part in message.parts:
+                if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                    queries.append(part.content)
+                    turns += 1
+                elif isinstance(part, ToolCallPart):
+                    recent_tools.add(part.tool_name)
+        for message in run:
+            for part in message.parts:
+                if isinstance(part, UserPromptPart) and isinstance(part.content, str) and part.content not in queries:
+                    queries.append(part.content)
+
+        index = self.index_for(tool_defs)
+        scores = index.scores(' '.join(queries), self.embedding_weight)
+        if not scores.any():
+            # Nothing to go on, offering nothing could leave the model without the tool it needs
+            return names, False
+        ranked = sorted(range(len(scores)), key=lambda row: -scores[row])
+        selected = {index.names[row] for row in ranked[:self.top_k] if scores[row] > 0}
+        selected |= (self.always | recent_tools) & names
+
+        # The selection only depends on what came before the turn, so it is the same at every step
+        # of the turn and calls made outside of it show the model needed something else
+        for message in run:
+            for part in message.parts:
+                if isinstance(message, ModelResponse) and isinstance(part, ToolCallPart) and part.tool_name not in selected:
+                    return names, True
+                if isinstance(part, RetryPromptPart) and part.tool_name and part.tool_name not in selected:
+                    return names, True
+        return selected, False
+
+    async def __call__(self, ctx: RunContext[Any], tool_defs: list[ToolDefinition]) -> list[ToolDefinition]:
+        selected, expanded = self.select(tool_defs, ctx.messages, ctx.prompt)
+        # Keep the configured order, the tool list is part of the cached request prefix
+        offered = [tool for tool in tool_defs if tool.name in selected]
+        saved = 0
+        if len(offered) < len(tool_defs):
+            index = self.index_for(tool_defs)
+            saved = int(sum(tokens for name, tokens in zip(index.names, index.tokens) if name not in selected))
+        self.selections += 1
+        self.expansions += expanded
+        self.tools_offered += len(offered)
+        self.tools_total += len(tool_defs)
+        self.tokens_saved += saved
+        span = current_span()
+        if span.recording:
+            span.set_attributes(tools_offered=len(offered), tools_total=len(tool_defs),
+                                tool_tokens_saved=span.attributes.get('tool_tokens_saved', 0) + saved)
+            if expanded:
+                span.set_attributes(tool_selection='expanded')
+            elif 'tool_selection' not in span.attributes:
+                span.set_attributes(tool_selection='narrowed' if saved else 'all')
+        return offered
+
+    def stats(self) -> dict:
+        return {
+            'selections': self.selections,
+            'expansions': self.expansions,
+            'tools_offered': self.tools_offered,
+            'tools_total': self.tools_total,
+            'tokens_saved': self.tokens_saved,
+            'indexes': len(self._indexes),
+        }
@@ -0,0 +1,371 @@
+"""
+Span tracing for MCP_Agent.
+
+Turns, model requests, tool calls and MCP connects/disconnects are recorded as spans with
+token counts and payload sizes as attributes, and handed to pluggable sinks when they end.
+A tracer without sinks hands out a shared no-op span, so instrumentation costs next to
+nothing while tracing is off.
+
+```python
+from src.mcp_agent.tracing import default_tracer, Memory_span_sink
+
+sink = default_tracer.add_sink(Memory_span_sink())
+await agent.chat('Hello')
+for span in sink.spans:
+    print(span.name, span.duration, span.attributes)
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+import httpx
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models import ModelRequestParameters, StreamedResponse
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar('mcp_agent_span', default=None)
+
+
+class Span:
+    """A timed operation, ended and exported when its `with` block exits"""
+
+    recording = True
+
+    def __init__(self, tracer: Tracer, name: str, attributes: dict[str, Any]):
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = time.time_ns()
+        self.end_time: int | None = None
+        self.duration: float | None = None
+        self.status = 'ok'
+        self.error: str | None = None
+        self._start = time.perf_counter()
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def record_error(self, error: BaseException):
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}"
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.duration = time.perf_counter() - self._start
+        self.end_time = self.start_time + int(self.duration * 1e9)
+        if isinstance(exc_val, (asyncio.CancelledError, GeneratorExit)):
+            # Abandoned by its caller (client gone, turn cancelled), not a failure
+            self.status = 'cancelled'
+        elif exc_val is not None:
+            self.record_error(exc_val)
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from another context, e.g. an async generator closed by a different task
+            pass
+        self.tracer.export(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration': self.duration,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class _Noop_span:
+    """Stand-in returned while tracing is disabled"""
+
+    recording = False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes: Any):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def __enter__(self) -> _Noop_span:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _Noop_span()
+
+
+def current_span() -> Span | _Noop_span:
+    """The innermost span in progress, or the no-op span"""
+    span = _current_span.get()
+    return span if span is not None else NOOP_SPAN
+
+
+class Memory_span_sink:
+    """Keeps the last `max_spans` finished spans in memory"""
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def find(self, name: str) -> list[Span]:
+        return [span for span in self.spans if span.name == name]
+
+    def clear(self):
+        self.spans.clear()
+
+    def close(self):
+        pass
+
+
+class Jsonl_span_sink:
+    """Appends finished spans to a JSONL file, one object per span"""
+
+    def __init__(self, path: str | Path = 'traces.jsonl'):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a')
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Otlp_span_sink:
+    """
+    Exports spans to an OpenTelemetry collector with the OTLP/HTTP JSON protocol.
+
+    Spans are batched and posted from a background thread, so exporting never blocks the
+    event loop; spans are dropped when the collector can't keep up.
+    """
+
+    def __init__(self, endpoint: str = 'http://localhost:4318/v1/traces', service_name: str = 'mcp-agent',
+                 headers: dict = None, batch_size: int = 256, flush_interval: float = 5, max_queue: int = 10000):
+        """
+        Args:
+            endpoint (str): OTLP/HTTP traces endpoint of the collector
+            service_name (str): `service.name` resource attribute of the exported spans
+            headers (dict, optional): Extra HTTP headers, e.g. for authentication
+            batch_size (int): Maximum number of spans per request
+            flush_interval (float): Seconds between exports of a partial batch
+            max_queue (int): Spans waiting for export beyond which new spans are dropped
+        """
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.headers = headers or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue[Span | None] = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._export_forever, daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def payload(self, spans: list[Span]) -> dict:
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{
+                'scope': {'name': 'mcp_agent'},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(span.start_time),
+                    'endTimeUnixNano': str(span.end_time),
+                    'attributes': [{'key': key, 'value': _otlp_value(value)}
+                                   for key, value in span.attributes.items() if value is not None],
+                    'status': {'code': 2, 'message': span.error} if span.status == 'error'
+                              else {'code': 0, 'message': 'cancelled'} if span.status == 'cancelled' else {'code': 1},
+                } for span in spans],
+            }],
+        }]}
+
+    def _export_forever(self):
+        with httpx.Client(timeout=10) as client:
+            closing = False
+            while not closing:
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        span = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if span is None:
+                        closing = True
+                        break
+                    batch.append(span)
+                if not batch:
+                    continue
+                try:
+                    client.post(self.endpoint, json=self.payload(batch), headers=self.headers).raise_for_status()
+                except httpx.HTTPError as e:
+                    self.dropped += len(batch)
+                    print(f"Error exporting spans to {self.endpoint}: {e}")
+
+    def close(self):
+        """Export the pending spans and stop the export thread"""
+        self._queue.put(None)
+        self._thread.join(timeout=self.flush_interval + 10)
+
+
+class Tracer:
+    """
+    Creates spans and hands finished ones to its sinks.
+
+    With no sinks, `span()` returns the shared no-op span: tracing is off and the
+    instrumentation only costs a function call.
+    """
+
+    def __init__(self, sinks: list = None):
+        """
+        Args:
+            sinks (list, optional): Objects with an `export(span)` method (and optionally `close()`),
+                                    e.g. `Memory_span_sink`, `Jsonl_span_sink`, `Otlp_span_sink`
+                                    or `Metrics_sink`
+        """
+        self.sinks = list(sinks or [])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def span(self, name: str, **attributes: Any) -> Span | _Noop_span:
+        """Start a span, to be used as `with tracer.span('name', key=value) as span:`"""
+        if not self.sinks:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def export(self, span: Span):
+        for sink in self.sinks:
+            try:
+                sink.export(span)
+            except Exception as e:
+                print(f"Error exporting span {span.name}: {e}")
+
+    def close(self):
+        for sink in self.sinks:
+            close = getattr(sink, 'close', None)
+            if close is not None:
+                close()
+        self.sinks = []
+
+
+class Traced_model(WrapperModel):
+    """Wraps a model so each request is recorded as a `model.request` span with its token usage"""
+
+    def __init__(self, wrapped, tracer: Tracer):
+        super().__init__(wrapped)
+        self.tracer = tracer
+
+    async def request(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                      model_request_parameters: ModelRequestParameters) -> ModelResponse:
+        with self.tracer.span('model.request', model=self.model_name, messages=len(messages), stream=False) as span:
+            response = await self.wrapped.request(messages, model_settings, model_request_parameters)
+            if span.recording:
+                span.set_attributes(input_tokens=response.usage.request_tokens,
+                                    output_tokens=response.usage.response_tokens)
+            return response
+
+    @asynccontextmanager
+    async def request_stream(self, messages: list[ModelMessage], model_settings: ModelSettings | None,
+                             model_request_parameters: ModelRequestParameters) -> AsyncIterator[StreamedResponse]:
+        with self.tracer.span('model.request', model=self.model_name, messages=len(messages), stream=True) as span:
+            async with self.wrapped.request_stream(messages, model_settings, model_request_parameters) as response:
+                yield response
+            if span.recording:
+                usage = response.usage()
+                span.set_attributes(input_tokens=usage.request_tokens, output_tokens=usage.response_tokens)
+
+
+def tracer_from_config(config: dict, tracer: Tracer = None) -> Tracer:
+    """
+    Add the sinks listed in the `tracing` block of config.json to `tracer` (the process-wide
+    tracer by default):
+
+        "tracing": {"sinks": ["jsonl", "otlp"], "jsonl_path": "traces.jsonl",
+                    "otlp_endpoint": "http://localhost:4318/v1/traces"}
+    """
+    tracer = tracer if tracer is not None else default_tracer
+    config = config or {}
+    for name in config.get('sinks', []):
+        if name == 'memory':
+            tracer.add_sink(Memory_span_sink(config.get('max_spans', 10000)))
+        elif name == 'jsonl':
+            tracer.add_sink(Jsonl_span_sink(config.get('jsonl_path', 'traces.jsonl')))
+        elif name == 'otlp':
+            tracer.add_sink(Otlp_span_sink(config.get('otlp_endpoint', 'http://localhost:4318/v1/traces'),
+                                           service_name=config.get('service_name', 'mcp-agent'),
+                                           headers=config.get('otlp_headers')))
+        else:
+            raise ValueError(f"Unknown span sink: {name}")
+    return tracer
+
+
+# Process-wide tracer, disabled until a sink is added
+default_tracer = Tracer()
@@ -0,0 +1,18 @@
+import inspect
+
+import gradio as gr
+import pytest
+from gradio.helpers import special_args
+
+from src.gradio_app import app
+
+
+def event_handlers():
+    return [fn for fn in app.demo.fns.values() if fn.fn is not None]
+
+
+@pytest.mark.parametrize('fn', event_handlers(), ids=lambda fn: fn.fn.__name__)
+def test_event_handlers_accept_their_inputs_and_request(fn):
+    # Gradio only injects gr.Request into a positional parameter, never after *args
+    args, *_ = special_args(fn.fn, inputs=[None] * len(fn.inputs), request=gr.Request())
+    inspect.signature(fn.fn).bind(*args)
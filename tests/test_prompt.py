@@ -0,0 +1,69 @@
+import asyncio
+import dataclasses
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic_ai.messages import ModelMessage, ModelRequest, SystemPromptPart
+
+from src.mcp_agent.agent import MCP_Agent
+from src.mcp_agent.prompt import Prompt_assembler, check_prefix_stability
+
+QUERIES = ['hi', 'how are you?', 'what can you do?', 'bye']
+
+
+def ticking_clock(step: timedelta):
+    """A clock that moves by `step` every time it is read"""
+    now = datetime(2025, 1, 1, 9, 0, tzinfo=timezone.utc)
+
+    def clock():
+        nonlocal now
+        now += step
+        return now
+
+    return clock
+
+
+class Head_context_assembler(Prompt_assembler):
+    """The regression the assembler exists to prevent: volatile context in the system prompt"""
+
+    def append_context(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        head = messages[0]
+        parts = [SystemPromptPart(content=f"{head.parts[0].content}\n{self.volatile_context()}"), *head.parts[1:]]
+        return [dataclasses.replace(head, parts=parts), *messages[1:]]
+
+
+def agent_with(assembler: Prompt_assembler) -> MCP_Agent:
+    return MCP_Agent(api_keys={'openai_api_key': 'unused'}, instructions='Be brief.', prompt_assembler=assembler)
+
+
+def test_each_request_extends_the_previous_one():
+    ratios = asyncio.run(check_prefix_stability(agent_with(Prompt_assembler()), QUERIES))
+
+    assert len(ratios) == len(QUERIES) - 1
+    # The reusable prefix grows with the conversation
+    assert ratios == sorted(ratios)
+    assert all(ratio > 0 for ratio in ratios)
+
+
+def test_time_changes_only_touch_the_trailing_slot():
+    # Every request falls in a new time slot
+    assembler = Prompt_assembler(time_resolution=1, clock=ticking_clock(timedelta(minutes=5)))
+
+    asyncio.run(check_prefix_stability(agent_with(assembler), QUERIES))
+
+
+def test_volatile_context_in_the_head_breaks_the_prefix():
+    assembler = Head_context_assembler(time_resolution=1, clock=ticking_clock(timedelta(minutes=5)))
+
+    with pytest.raises(AssertionError, match='does not extend'):
+        asyncio.run(check_prefix_stability(agent_with(assembler), QUERIES))
+
+
+def test_trailing_slot_is_not_stored_in_the_history():
+    agent = agent_with(Prompt_assembler(clock=ticking_clock(timedelta(minutes=5))))
+
+    asyncio.run(check_prefix_stability(agent, QUERIES[:2]))
+
+    stored = [part.content for message in agent.memory.messages if isinstance(message, ModelRequest)
+              for part in message.parts]
+    assert not any('The current time is' in str(content) for content in stored)